@@ -0,0 +1,200 @@
+# This file is part of beets.
+# Copyright 2015, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Aggregate functions that summarize a set of objects, like counts and
+sums. They are used with `Results.aggregate`.
+"""
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+import itertools
+import operator
+
+from .snapshot import numpy, is_numeric
+
+
+class Aggregate(object):
+    """A value computed over a group of objects from some of their
+    fields. It is evaluated in SQL when possible and otherwise by
+    accumulating the fields' values in Python.
+    """
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def sql(self, columns):
+        """Get an SQL aggregate expression over the given column
+        expressions, one for each field.
+        """
+        raise NotImplementedError()
+
+    def start(self):
+        """Get the initial state for accumulating values in Python.
+        """
+        raise NotImplementedError()
+
+    def step(self, state, values):
+        """Update the state with the values of the fields for one
+        object and return the new state.
+        """
+        raise NotImplementedError()
+
+    def finish(self, state):
+        """Get the aggregate value from the final state.
+        """
+        return state
+
+    def columnar(self, columns, size):
+        """Compute the aggregate over whole columns of values, one for
+        each field, from a `Snapshot` with `size` rows.
+        """
+        state = self.start()
+        for values in itertools.izip(*columns):
+            state = self.step(state, values)
+        return self.finish(state)
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            type(self).__name__,
+            ', '.join(repr(f) for f in self.fields),
+        )
+
+
+class Count(Aggregate):
+    """The number of objects.
+    """
+    def __init__(self):
+        super(Count, self).__init__()
+
+    def sql(self, columns):
+        return 'COUNT(*)'
+
+    def start(self):
+        return 0
+
+    def step(self, state, values):
+        return state + 1
+
+    def columnar(self, columns, size):
+        return size
+
+
+class Sum(Aggregate):
+    """The sum of a field. If several fields are given, their product
+    is summed. Objects where any of the fields is null are skipped.
+    """
+    def sql(self, columns):
+        return 'COALESCE(SUM({0}), 0)'.format(' * '.join(columns))
+
+    def start(self):
+        return 0
+
+    def step(self, state, values):
+        if None in values:
+            return state
+        product = 1
+        for value in values:
+            product *= value
+        return state + product
+
+    def columnar(self, columns, size):
+        if not all(is_numeric(column) for column in columns):
+            return super(Sum, self).columnar(columns, size)
+        if numpy:
+            return reduce(operator.mul, columns).sum()
+        elif len(columns) == 1:
+            return sum(columns[0])
+        else:
+            return sum(reduce(operator.mul, values)
+                       for values in itertools.izip(*columns))
+
+
+class Min(Aggregate):
+    """The smallest non-null value of a field.
+    """
+    def __init__(self, field):
+        super(Min, self).__init__(field)
+
+    def sql(self, columns):
+        return 'MIN({0})'.format(columns[0])
+
+    def start(self):
+        return None
+
+    def step(self, state, values):
+        value = values[0]
+        if state is None or (value is not None and value < state):
+            return value
+        return state
+
+    def columnar(self, columns, size):
+        column = columns[0]
+        if not is_numeric(column):
+            return super(Min, self).columnar(columns, size)
+        if not size:
+            return None
+        return column.min() if numpy else min(column)
+
+
+class Max(Aggregate):
+    """The largest non-null value of a field.
+    """
+    def __init__(self, field):
+        super(Max, self).__init__(field)
+
+    def sql(self, columns):
+        return 'MAX({0})'.format(columns[0])
+
+    def start(self):
+        return None
+
+    def step(self, state, values):
+        value = values[0]
+        if state is None or (value is not None and value > state):
+            return value
+        return state
+
+    def columnar(self, columns, size):
+        column = columns[0]
+        if not is_numeric(column):
+            return super(Max, self).columnar(columns, size)
+        if not size:
+            return None
+        return column.max() if numpy else max(column)
+
+
+class CountDistinct(Aggregate):
+    """The number of distinct non-null values of a field.
+    """
+    def __init__(self, field):
+        super(CountDistinct, self).__init__(field)
+
+    def sql(self, columns):
+        return 'COUNT(DISTINCT {0})'.format(columns[0])
+
+    def start(self):
+        return set()
+
+    def step(self, state, values):
+        if values[0] is not None:
+            state.add(values[0])
+        return state
+
+    def finish(self, state):
+        return len(state)
+
+    def columnar(self, columns, size):
+        column = columns[0]
+        if numpy and is_numeric(column):
+            return len(numpy.unique(column))
+        return len(set(column) - set([None]))
@@ -19,16 +19,28 @@ from __future__ import (division, absolute_import, print_function,
 
 import time
 import os
+import re
+import array
 from collections import defaultdict
 import threading
 import sqlite3
 import contextlib
 import collections
+import itertools
+import json
+import zlib
 
 import beets
+from beets import util
+from beets import logging
 from beets.util.functemplate import Template
 from beets.dbcore import types
-from .query import MatchQuery, NullSort, TrueQuery
+from .query import MatchQuery, NullSort, TrueQuery, string_query_class, \
+    flex_value
+from .snapshot import Snapshot, typecode, make_column, encode_value
+
+
+log = logging.getLogger('beets')
 
 
 class FormattedMapping(collections.Mapping):
@@ -77,6 +89,73 @@ class FormattedMapping(collections.Mapping):
         return value
 
 
+# Compact storage for model values.
+
+_MISSING = object()
+"""Marks a fixed field that has no value in `FixedValues`.
+"""
+
+_CLEAN = frozenset()
+"""The dirty set of a model without modifications. It is shared by all
+clean objects; a set of their own is created on the first write.
+"""
+
+
+class FixedValues(object):
+    """A `dict`-like container for the values of a model's fixed fields
+    that takes less memory than a dictionary. The values are kept in a
+    list, at the positions given by a key table that is shared by all
+    the objects of a model class.
+
+    This is not a `collections.MutableMapping`: the ABCs have no
+    `__slots__` on Python 2, so every container would get a `__dict__`.
+    """
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, keys):
+        """Create an empty container for the fields in `keys`, a
+        mapping from field names to positions.
+        """
+        self._keys = keys
+        self._values = [_MISSING] * len(keys)
+
+    def __getitem__(self, key):
+        value = self._values[self._keys[key]]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        index = self._keys.get(key)
+        if index is None or self._values[index] is _MISSING:
+            return default
+        return self._values[index]
+
+    def __setitem__(self, key, value):
+        self._values[self._keys[key]] = value
+
+    def __delitem__(self, key):
+        index = self._keys[key]
+        if self._values[index] is _MISSING:
+            raise KeyError(key)
+        self._values[index] = _MISSING
+
+    def __contains__(self, key):
+        index = self._keys.get(key)
+        return index is not None and self._values[index] is not _MISSING
+
+    def __iter__(self):
+        for key, index in self._keys.iteritems():
+            if self._values[index] is not _MISSING:
+                yield key
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not _MISSING)
+
+    def keys(self):
+        return list(self)
+
+
 # Abstract base for model classes.
 
 class Model(object):
@@ -123,6 +202,21 @@ class Model(object):
     terms.
     """
 
+    _search_table = None
+    """The name of an SQLite full-text index over the search fields,
+    which must all be fixed fields. Unqualified substring queries use
+    the index when SQLite supports it. Triggers on the model's table
+    keep the index up to date. If None, no index is kept.
+    """
+
+    _indices = ()
+    """Fixed fields to index in the main table, for fields that objects
+    are often looked up by. Each entry is a field name or a tuple of
+    field names for a multi-column index. The indexes are created along
+    with the table, as are indexes for the `_sorts` that provide an
+    `index_clause`.
+    """
+
     _types = {}
     """Optional Types for non-fixed (i.e., flexible and computed) fields.
     """
@@ -138,6 +232,37 @@ class Model(object):
     value is the same as the old value (e.g., `o.f = o.f`).
     """
 
+    _compact = False
+    """Keep the values of fixed fields in a `FixedValues` container
+    instead of a dictionary. This takes much less memory when many
+    objects are loaded at once, at a small cost in speed. A database
+    can also ask for it for all the objects associated with it (see
+    `Database.compact_models`).
+    """
+
+    __slots__ = ('_db', '_dirty', '_values_fixed', '_values_flex')
+
+    _fixed_keys_cache = {}
+
+    @classmethod
+    def _search_index(cls):
+        """Get the name of this model's full-text index table, or None
+        if it has none or the SQLite library cannot build it.
+        """
+        if cls._search_table and search_index_supported():
+            return cls._search_table
+
+    @classmethod
+    def _fixed_keys(cls):
+        """Get the key table that `FixedValues` containers for this
+        class share: a mapping from fixed field names to positions.
+        """
+        keys = cls._fixed_keys_cache.get(cls)
+        if keys is None:
+            keys = dict((key, i) for i, key in enumerate(sorted(cls._fields)))
+            cls._fixed_keys_cache[cls] = keys
+        return keys
+
     @classmethod
     def _getters(cls):
         """Return a mapping from field names to getter functions.
@@ -160,8 +285,8 @@ class Model(object):
         initial field values.
         """
         self._db = db
-        self._dirty = set()
-        self._values_fixed = {}
+        self._dirty = _CLEAN
+        self._values_fixed = self._new_fixed_values()
         self._values_flex = {}
 
         # Initial contents.
@@ -177,7 +302,9 @@ class Model(object):
         """
         obj = cls(db)
         for key, value in fixed_values.iteritems():
-            obj._values_fixed[key] = cls._type(key).from_sql(value)
+            # Skip columns for fields that the model no longer has.
+            if key in cls._fields:
+                obj._values_fixed[key] = cls._type(key).from_sql(value)
         for key, value in flex_values.iteritems():
             obj._values_flex[key] = cls._type(key).from_sql(value)
         return obj
@@ -188,11 +315,30 @@ class Model(object):
             ', '.join('{0}={1!r}'.format(k, v) for k, v in dict(self).items()),
         )
 
-    def clear_dirty(self):
-        """Mark all fields as *clean* (i.e., not needing to be stored to
-        the database).
+    def _new_fixed_values(self):
+        """Create an empty container for the values of fixed fields.
+        """
+        if self._compact or getattr(self._db, 'compact_models', False):
+            return FixedValues(self._fixed_keys())
+        else:
+            return {}
+
+    def clear_dirty(self, *keys):
+        """Mark all fields, or only the given ones, as *clean* (i.e.,
+        not needing to be stored to the database).
         """
-        self._dirty = set()
+        if keys and self._dirty:
+            self._dirty.difference_update(keys)
+        else:
+            self._dirty = _CLEAN
+
+    def _mark_dirty(self, key):
+        """Mark a field as needing to be stored to the database.
+        """
+        if self._dirty:
+            self._dirty.add(key)
+        else:
+            self._dirty = set([key])
 
     def _check_db(self, need_id=True):
         """Ensure that this object is associated with a database row: it
@@ -245,14 +391,14 @@ class Model(object):
         old_value = source.get(key)
         source[key] = value
         if self._always_dirty or old_value != value:
-            self._dirty.add(key)
+            self._mark_dirty(key)
 
     def __delitem__(self, key):
         """Remove a flexible attribute from the model.
         """
         if key in self._values_flex:  # Flexible.
             del self._values_flex[key]
-            self._dirty.add(key)  # Mark for dropping on store.
+            self._mark_dirty(key)  # Mark for dropping on store.
         elif key in self._getters():  # Computed.
             raise KeyError('computed field {0} cannot be deleted'.format(key))
         elif key in self._fields:  # Fixed.
@@ -335,55 +481,16 @@ class Model(object):
         """Save the object's metadata into the library database.
         """
         self._check_db()
-
-        # Build assignments for query.
-        assignments = []
-        subvars = []
-        for key in self._fields:
-            if key != 'id' and key in self._dirty:
-                self._dirty.remove(key)
-                assignments.append(key + '=?')
-                value = self._type(key).to_sql(self[key])
-                subvars.append(value)
-        assignments = ','.join(assignments)
-
-        with self._db.transaction() as tx:
-            # Main table update.
-            if assignments:
-                query = 'UPDATE {0} SET {1} WHERE id=?'.format(
-                    self._table, assignments
-                )
-                subvars.append(self.id)
-                tx.mutate(query, subvars)
-
-            # Modified/added flexible attributes.
-            for key, value in self._values_flex.items():
-                if key in self._dirty:
-                    self._dirty.remove(key)
-                    tx.mutate(
-                        'INSERT INTO {0} '
-                        '(entity_id, key, value) '
-                        'VALUES (?, ?, ?);'.format(self._flex_table),
-                        (self.id, key, value),
-                    )
-
-            # Deleted flexible attributes.
-            for key in self._dirty:
-                tx.mutate(
-                    'DELETE FROM {0} '
-                    'WHERE entity_id=? AND key=?'.format(self._flex_table),
-                    (self.id, key)
-                )
-
-        self.clear_dirty()
+        self._db.store_many([self])
 
     def load(self):
         """Refresh the object's metadata from the library database.
         """
         self._check_db()
+        self._db._uncache(type(self), self.id)
         stored_obj = self._db._get(type(self), self.id)
         assert stored_obj is not None, "object {0} not in DB".format(self.id)
-        self._values_fixed = {}
+        self._values_fixed = self._new_fixed_values()
         self._values_flex = {}
         self.update(dict(stored_obj))
         self.clear_dirty()
@@ -401,6 +508,9 @@ class Model(object):
                 'DELETE FROM {0} WHERE entity_id=?'.format(self._flex_table),
                 (self.id,)
             )
+            self._db._record_changes(
+                tx, [(self._table, self.id, 'remove', ())]
+            )
 
     def add(self, db=None):
         """Add the object to the library database. This object must be
@@ -413,19 +523,7 @@ class Model(object):
         if db:
             self._db = db
         self._check_db(False)
-
-        with self._db.transaction() as tx:
-            new_id = tx.mutate(
-                'INSERT INTO {0} DEFAULT VALUES'.format(self._table)
-            )
-            self.id = new_id
-            self.added = time.time()
-
-            # Mark every non-null field as dirty and store.
-            for key in self:
-                if self[key] is not None:
-                    self._dirty.add(key)
-            self.store()
+        self._db.add_many([self])
 
     # Formatting and templating.
 
@@ -460,19 +558,164 @@ class Model(object):
         return cls._type(key).parse(string)
 
 
+# Full-text search.
+
+_search_index_supported = None
+
+
+def search_index_supported():
+    """Determine whether the SQLite library can build full-text indices
+    for substring searches (i.e., FTS5 with the trigram tokenizer).
+    """
+    global _search_index_supported
+    if _search_index_supported is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE test '
+                         'USING fts5(field, tokenize=trigram)')
+        except sqlite3.OperationalError:
+            _search_index_supported = False
+        else:
+            _search_index_supported = True
+        finally:
+            conn.close()
+    return _search_index_supported
+
+
+# SQL functions for matching values.
+
+_regexp_cache = {}
+_REGEXP_CACHE_SIZE = 128
+
+
+def _regexp(pattern, value):
+    """Implement SQLite's ``value REGEXP pattern`` operator the way
+    `RegexpQuery` matches values. Compiled patterns are cached.
+    """
+    try:
+        regexp = _regexp_cache[pattern]
+    except KeyError:
+        if len(_regexp_cache) >= _REGEXP_CACHE_SIZE:
+            _regexp_cache.clear()
+        regexp = _regexp_cache[pattern] = re.compile(pattern)
+    return regexp.search(util.as_string(value)) is not None
+
+
+def _string_match(key, pattern, value):
+    """Match a value using the `string_match` method of the
+    `StringFieldQuery` subclass registered under `key`.
+    """
+    query_class = string_query_class(key)
+    return query_class.string_match(pattern, util.as_string(value))
+
+
 # Database controller and supporting interfaces.
 
+# Matches an SQL statement that modifies a single table and captures
+# the name of the table.
+_WRITE_TABLE_RE = re.compile(
+    r'\s*(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO'
+    r'|UPDATE(?:\s+OR\s+\w+)?'
+    r'|DELETE\s+FROM)\s+(\w+)',
+    re.I
+)
+
+
+# The columns of a flexible attribute table. The value column has no
+# type affinity, so each value keeps the type it was stored with.
+ATTRIBUTE_COLUMNS = """
+    id INTEGER PRIMARY KEY,
+    entity_id INTEGER,
+    key TEXT,
+    value,
+    UNIQUE(entity_id, key) ON CONFLICT REPLACE
+"""
+
+
+def _is_numeric(typ):
+    """Determine whether flexible attributes of type `typ` are stored
+    as numbers.
+    """
+    return typ.model_type in (int, float) and flex_value(typ) != 'value'
+
+
+def _flex_to_sql(typ, value):
+    """Convert the value of a flexible attribute with type `typ` for
+    storage. Values of numeric types are stored as numbers, so that
+    SQLite compares them as numbers. Other values are stored as text.
+    """
+    if _is_numeric(typ):
+        if isinstance(value, basestring):
+            value = typ.parse(value)
+        try:
+            return typ.to_sql(typ.model_type(value))
+        except (TypeError, ValueError):
+            return typ.null
+    elif value is None or isinstance(value, (unicode, bytes, buffer)):
+        return value
+    elif isinstance(value, bool):
+        return unicode(int(value))
+    else:
+        return unicode(value)
+
+
+Change = collections.namedtuple(
+    'Change', ['seq', 'model', 'id', 'op', 'keys']
+)
+"""An entry in the change journal: the `op` ("add", "store", or
+"remove") applied to the object of type `model` with the given `id`,
+the `keys` of the fields that changed, and the `seq` number ordering
+the change among all others.
+"""
+
+
+def _index_fields(fields):
+    """Normalize an index definition, a field name or a sequence of
+    field names, to a tuple of field names.
+    """
+    if isinstance(fields, basestring):
+        return (fields,)
+    return tuple(fields)
+
+
+def _index_name(table, fields):
+    """Get the name of the index on the given fields of a table.
+    """
+    return '{0}_by_{1}'.format(table, '_'.join(fields))
+
+
 class Results(object):
     """An item query result set. Iterating over the collection lazily
     constructs LibModel objects that reflect database rows.
+
+    The matching rows are not loaded all at once. The first window of
+    full rows (along with their flexible attributes) is fetched when the
+    results are first needed, so the first objects do not wait for the
+    rest of the rows. Only if iteration goes past that window are the
+    ids of the remaining rows read, and their rows are then fetched in
+    windows as iteration proceeds. The ids are kept, so memory use
+    still grows with the number of matches, by one machine integer per
+    row.
+    """
+
+    _window_size = 256
+    """The number of rows materialized at once. The rows and flexible
+    attributes for a window are fetched with a single query each, so
+    this must stay below SQLite's limit on the number of parameters in a
+    statement (999).
     """
-    def __init__(self, model_class, rows, db, query=None, sort=None):
+
+    def __init__(self, model_class, db, where='1', subvals=(),
+                 order_by=None, query=None, sort=None, limit=None,
+                 offset=None):
         """Create a result set that will construct objects of type
         `model_class`.
 
         `model_class` is a subclass of `LibModel` that will be
-        constructed. `rows` is a query result: a list of mappings. The
-        new objects will be associated with the database `db`.
+        constructed. `where` and `subvals` are an SQL expression that
+        selects the matching rows and `order_by` is an optional SQL
+        ordering for them. The new objects will be associated with the
+        database `db`.
 
         If `query` is provided, it is used as a predicate to filter the
         results for a "slow query" that cannot be evaluated by the
@@ -480,22 +723,150 @@ class Results(object):
         full list of results before returning. This means it is a "slow
         sort" and all objects must be built before returning the first
         one.
+
+        `limit` and `offset` restrict the results to a slice of the
+        sorted, filtered sequence. When there is no slow query or sort,
+        the slice is taken by the database.
         """
         self.model_class = model_class
-        self.rows = rows
         self.db = db
+        self.where = where
+        self.subvals = subvals
+        self.order_by = order_by
         self.query = query
         self.sort = sort
+        self.limit = limit
+        self.offset = offset or 0
+
+        # Is a slice taken from the results, and can the database take
+        # it for us?
+        sliced = limit is not None or bool(offset)
+        self._sql_slice = sliced and not (query or sort)
+        self._python_slice = sliced and bool(query or sort)
+
+        # The ids of the matching rows, in order, or None if the query
+        # has not been executed yet. Until the remaining ids are needed,
+        # only those of the first window are known (and `_more` says
+        # whether there may be others); the first window's rows are
+        # kept until their objects are built.
+        self._ids = None
+        self._more = False
+        self._first_rows = None
+
+        # The number of ids consumed by the caching iterator and the
+        # materialized objects corresponding to them.
+        self._consumed = 0
+        self._objects = []
 
-        # We keep a queue of rows we haven't yet consumed for
-        # materialization. We preserve the original total number of
-        # rows.
-        self._rows = rows
-        self._row_count = len(rows)
+    def is_slow(self):
+        """Indicate whether some of the filtering or sorting happens in
+        Python, so that all candidate objects have to be built.
+        """
+        return bool(self.query or self.sort)
 
-        # The materialized objects corresponding to rows that have been
-        # consumed.
-        self._objects = []
+    def _select(self, columns, ordered=True, limit=None):
+        """Build an SQL statement selecting the given columns from the
+        matching rows (in order, if `ordered`). If `limit` is given, at
+        most that many rows are selected. Return the statement and its
+        substitution values.
+        """
+        sql = 'SELECT {0} FROM {1} WHERE {2}'.format(
+            columns, self.model_class._table, self.where
+        )
+        subvals = list(self.subvals)
+        if ordered and self.order_by:
+            sql += ' ORDER BY {0}'.format(self.order_by)
+        if self._sql_slice:
+            if self.limit is not None:
+                limit = self.limit if limit is None \
+                    else min(limit, self.limit)
+            # A negative limit means no limit in SQLite.
+            sql += ' LIMIT ? OFFSET ?'
+            subvals += [-1 if limit is None else limit, self.offset]
+        elif limit is not None:
+            sql += ' LIMIT ?'
+            subvals.append(limit)
+        return sql, subvals
+
+    def _slice(self, objects):
+        """Apply the limit and offset to an iterable of objects, unless
+        the database has already done so.
+        """
+        if self._python_slice:
+            stop = None if self.limit is None else self.offset + self.limit
+            return itertools.islice(objects, self.offset, stop)
+        else:
+            return objects
+
+    def _get_first_ids(self):
+        """Get the ids of the first window of matching rows, executing
+        the query for their full rows if necessary.
+        """
+        if self._ids is None:
+            sql, subvals = self._select('*', limit=self._window_size)
+            if self.db.log_query_plans and log.isEnabledFor(logging.DEBUG):
+                self.db._log_query_plan(sql, subvals)
+            with self.db.transaction() as tx:
+                rows = tx.query(sql, subvals)
+            self._first_rows = rows
+            self._ids = array.array(b'l', (row[b'id'] for row in rows))
+            self._more = len(rows) == self._window_size
+        return self._ids
+
+    def _get_ids(self):
+        """Get the ids of all the matching rows, executing the queries
+        if necessary. The ids are kept in a compact array rather than as
+        a list of rows.
+
+        The ids after the first window come from a second query. Rows
+        that have moved into the first window since it was fetched are
+        left out, so that no object is produced twice.
+        """
+        ids = self._get_first_ids()
+        if self._more:
+            seen = set(ids)
+            sql, subvals = self._select('id')
+            with self.db.transaction() as tx:
+                cursor = tx.cursor(sql, subvals)
+                while True:
+                    rows = cursor.fetchmany(self._window_size)
+                    if not rows:
+                        break
+                    ids.extend(row[0] for row in rows
+                               if row[0] not in seen)
+            self._more = False
+        return ids
+
+    def _has_ids(self, index):
+        """Check whether there is a matching row at position `index`,
+        reading the remaining ids only when the first window does not
+        reach that far.
+        """
+        if index < len(self._get_first_ids()):
+            return True
+        return index < len(self._get_ids())
+
+    def _materialize(self, start):
+        """Build the objects for the window of ids beginning at index
+        `start`, applying the slow query (if any). Return the list of
+        objects and the index just past the window.
+        """
+        if start == 0 and self._first_rows is not None:
+            # The first window's rows have been fetched with its ids.
+            models = self._models_from_rows(self._first_rows)
+            end = len(self._first_rows)
+            self._first_rows = None
+        else:
+            ids = self._get_ids()
+            end = min(start + self._window_size, len(ids))
+            models = self._make_models(ids[start:end].tolist())
+        objects = []
+        for obj in models:
+            # If there is a slow-query predicate, ensure that the
+            # object passes it.
+            if not self.query or self.query.match(obj):
+                objects.append(obj)
+        return objects, end
 
     def _get_objects(self):
         """Construct and generate Model objects for they query. The
@@ -508,25 +879,42 @@ class Results(object):
         first.
         """
         index = 0  # Position in the materialized objects.
-        while index < len(self._objects) or self._rows:
+        while index < len(self._objects) or \
+                self._has_ids(self._consumed):
             # Are there previously-materialized objects to produce?
             if index < len(self._objects):
                 yield self._objects[index]
                 index += 1
 
-            # Otherwise, we consume another row, materialize its object
-            # and produce it.
+            # Otherwise, we consume another window of rows and
+            # materialize their objects.
             else:
-                while self._rows:
-                    row = self._rows.pop(0)
-                    obj = self._make_model(row)
-                    # If there is a slow-query predicate, ensurer that the
-                    # object passes it.
-                    if not self.query or self.query.match(obj):
-                        self._objects.append(obj)
-                        index += 1
-                        yield obj
-                        break
+                objects, self._consumed = self._materialize(self._consumed)
+                self._objects += objects
+
+    def _stream_objects(self):
+        """Generate Model objects in database order without keeping
+        them in the cache.
+        """
+        if self._complete:
+            # Already materialized: no need to go back to the database.
+            for obj in self._objects:
+                yield obj
+            return
+
+        index = 0
+        while self._has_ids(index):
+            objects, index = self._materialize(index)
+            for obj in objects:
+                yield obj
+
+    @property
+    def _complete(self):
+        """Indicates whether every matching object has been
+        materialized and cached.
+        """
+        return self._ids is not None and not self._more and \
+            self._consumed == len(self._ids)
 
     def __iter__(self):
         """Construct and generate Model objects for all matching
@@ -535,26 +923,84 @@ class Results(object):
         if self.sort:
             # Slow sort. Must build the full list first.
             objects = self.sort.sort(list(self._get_objects()))
-            return iter(objects)
+            return self._slice(iter(objects))
 
         else:
             # Objects are pre-sorted (i.e., by the database).
-            return self._get_objects()
+            return self._slice(self._get_objects())
+
+    def stream(self):
+        """Iterate over the matching objects, in sorted order, without
+        caching them.
+
+        This is meant for consumers that only look at each object once:
+        the memory used does not grow with the number of objects that
+        have been produced. Iterating over the `Results` object itself
+        afterward works, but has to construct the objects again. A slow
+        sort needs the full list of objects, so this is equivalent to
+        plain iteration in that case.
+        """
+        if self.sort:
+            return iter(self)
+        else:
+            return self._slice(self._stream_objects())
+
+    def _get_flex_values(self, ids):
+        """Fetch the flexible attributes for all the objects with the
+        given ids using a single query. Return a dictionary mapping each
+        id to a dictionary of raw flexible values.
+        """
+        flex_values = defaultdict(dict)
+        if not ids:
+            return flex_values
 
-    def _make_model(self, row):
-        # Get the flexible attributes for the object.
         with self.db.transaction() as tx:
             flex_rows = tx.query(
-                'SELECT * FROM {0} WHERE entity_id=?'.format(
-                    self.model_class._flex_table
+                'SELECT entity_id, key, value FROM {0} '
+                'WHERE entity_id IN ({1})'.format(
+                    self.model_class._flex_table,
+                    ', '.join('?' * len(ids)),
                 ),
-                (row[b'id'],)
+                ids,
             )
+        for entity_id, key, value in flex_rows:
+            flex_values[entity_id][key] = value
+        return flex_values
+
+    def _make_models(self, ids):
+        """Construct Model objects for a window of ids, in the given
+        order. The rows and the flexible attributes for the whole window
+        are fetched at once. Rows that have disappeared from the
+        database, or no longer match the query, since the query was
+        executed are skipped.
+        """
+        if not ids:
+            return []
 
+        with self.db.transaction() as tx:
+            rows = tx.query(
+                'SELECT * FROM {0} WHERE id IN ({1}) AND ({2})'.format(
+                    self.model_class._table,
+                    ', '.join('?' * len(ids)),
+                    self.where,
+                ),
+                list(ids) + list(self.subvals),
+            )
+        rows = dict((row[b'id'], row) for row in rows)
+        return self._models_from_rows([rows[id] for id in ids if id in rows])
+
+    def _models_from_rows(self, rows):
+        """Construct Model objects for a window of rows, fetching their
+        flexible attributes with a single query.
+        """
+        flex_values = self._get_flex_values([row[b'id'] for row in rows])
+        return [self._make_model(row, flex_values.get(row[b'id'], {}))
+                for row in rows]
+
+    def _make_model(self, row, flex_values={}):
         cols = dict(row)
         values = dict((k, v) for (k, v) in cols.items()
                       if not k[:4] == 'flex')
-        flex_values = dict((row[b'key'], row[b'value']) for row in flex_rows)
 
         # Construct the Python object
         obj = self.model_class._awaken(self.db, values, flex_values)
@@ -563,7 +1009,11 @@ class Results(object):
     def __len__(self):
         """Get the number of matching objects.
         """
-        if not self._rows:
+        if self._python_slice:
+            # The slice can only be taken from the objects themselves.
+            return sum(1 for obj in self)
+
+        elif self._complete:
             # Fully materialized. Just count the objects.
             return len(self._objects)
 
@@ -574,20 +1024,48 @@ class Results(object):
                 count += 1
             return count
 
+        elif self._ids is not None and not self._more:
+            # A fast query that has already been executed. Just count
+            # the rows.
+            return len(self._ids)
+
         else:
-            # A fast query. Just count the rows.
-            return self._row_count
+            # A fast query. Let the database count the rows.
+            with self.db.transaction() as tx:
+                if self._sql_slice:
+                    sql, subvals = self._select('1', False)
+                    rows = tx.query(
+                        'SELECT COUNT(*) FROM ({0})'.format(sql), subvals
+                    )
+                else:
+                    rows = tx.query(*self._select('COUNT(*)', False))
+            return rows[0][0]
 
     def __nonzero__(self):
         """Does this result contain any objects?
         """
-        return bool(len(self))
+        if self._complete and not self._python_slice:
+            return bool(self._objects)
+
+        elif self.query or self._python_slice:
+            # A slow query. Materialize objects until one matches.
+            return self.get() is not None
+
+        elif self._ids is not None:
+            return bool(self._ids)
+
+        else:
+            # A fast query. Let the database look for a single row.
+            sql, subvals = self._select('1', False)
+            with self.db.transaction() as tx:
+                rows = tx.query('SELECT EXISTS ({0})'.format(sql), subvals)
+            return bool(rows[0][0])
 
     def __getitem__(self, n):
         """Get the nth item in this result set. This is inefficient: all
         items up to n are materialized and thrown away.
         """
-        if not self._rows and not self.sort:
+        if self._complete and not self.sort and not self._python_slice:
             # Fully materialized and already in order. Just look up the
             # object.
             return self._objects[n]
@@ -610,6 +1088,212 @@ class Results(object):
         except StopIteration:
             return None
 
+    def aggregate(self, group_by=(), **aggregates):
+        """Summarize the matching objects with `Aggregate` functions
+        (see `dbcore.aggregate`) given as keyword arguments.
+
+        The objects are grouped by the values of the fields in
+        `group_by`. Return a list with a dictionary for each group, in
+        order of the group values, that maps the grouping fields and
+        the keyword names to their values. Without `group_by`, there is
+        exactly one group.
+
+        The database computes the aggregates unless part of the query
+        or one of the fields can only be evaluated in Python.
+        """
+        fields = list(group_by)
+        for agg in aggregates.values():
+            fields += [f for f in agg.fields if f not in fields]
+
+        getters = self.model_class._getters()
+        if self.query or self._python_slice or \
+                any(field in getters for field in fields):
+            return self._aggregate_objects(group_by, aggregates)
+        else:
+            return self._aggregate_rows(fields, group_by, aggregates)
+
+    def _column(self, field):
+        """Get an SQL expression for the value of a fixed or flexible
+        field and its substitution values.
+        """
+        typ = self.model_class._type(field)
+        if field in self.model_class._fields:
+            null = typ.to_sql(typ.null)
+            if null is None:
+                return field, []
+            return 'COALESCE({0}, ?)'.format(field), [null]
+        else:
+            return (
+                '(SELECT {0} FROM {1} WHERE entity_id={2}.id '
+                'AND key=?)'.format(flex_value(typ),
+                                    self.model_class._flex_table,
+                                    self.model_class._table),
+                [field],
+            )
+
+    def _aggregate_rows(self, fields, group_by, aggregates):
+        """Compute aggregates with a GROUP BY query.
+        """
+        # Select the fields of the matching rows as f0, f1, ...
+        names = {}
+        columns = []
+        subvals = []
+        for field in fields:
+            expr, vals = self._column(field)
+            names[field] = 'f{0}'.format(len(columns))
+            columns.append('{0} AS {1}'.format(expr, names[field]))
+            subvals += vals
+        inner, inner_subvals = self._select(', '.join(columns) or '1',
+                                            self._sql_slice)
+
+        # Group and aggregate them.
+        outputs = [names[field] for field in group_by]
+        for agg in aggregates.values():
+            outputs.append(agg.sql([names[field] for field in agg.fields]))
+        sql = 'SELECT {0} FROM ({1})'.format(', '.join(outputs), inner)
+        if group_by:
+            sql += ' GROUP BY {0} ORDER BY {0}'.format(
+                ', '.join(names[field] for field in group_by)
+            )
+
+        with self.db.transaction() as tx:
+            rows = tx.query(sql, subvals + inner_subvals)
+
+        out = []
+        for row in rows:
+            values = {}
+            for i, field in enumerate(group_by):
+                value = row[i]
+                if value is not None or field in self.model_class._fields:
+                    value = self.model_class._type(field).from_sql(value)
+                values[field] = value
+            for i, name in enumerate(aggregates, len(group_by)):
+                values[name] = row[i]
+            out.append(values)
+        return out
+
+    def _aggregate_objects(self, group_by, aggregates):
+        """Compute aggregates by accumulating the values of the matching
+        objects.
+        """
+        aggregates = aggregates.items()
+        groups = {}
+        if not group_by:
+            groups[()] = [agg.start() for _, agg in aggregates]
+
+        for obj in self.stream():
+            key = tuple(obj.get(field) for field in group_by)
+            states = groups.get(key)
+            if states is None:
+                states = [agg.start() for _, agg in aggregates]
+            groups[key] = [
+                agg.step(state, [obj.get(field) for field in agg.fields])
+                for (_, agg), state in zip(aggregates, states)
+            ]
+
+        out = []
+        for key in sorted(groups):
+            values = dict(zip(group_by, key))
+            for (name, agg), state in zip(aggregates, groups[key]):
+                values[name] = agg.finish(state)
+            out.append(values)
+        return out
+
+    def snapshot(self, fields, cache=None):
+        """Load the values of `fields` for the matching objects into a
+        columnar `Snapshot` (see `dbcore.snapshot`) for fast scans and
+        aggregation.
+
+        If `cache` is a file path, the snapshot is saved there and read
+        back on later calls instead of querying the database, as long as
+        neither the query nor the change journal has moved on. Queries
+        that are evaluated in Python are not cached.
+        """
+        fields = list(fields)
+        getters = self.model_class._getters()
+        if self.query or self._python_slice or \
+                any(field in getters for field in fields):
+            return self._snapshot_objects(fields)
+
+        # Select each field, with numeric fixed fields cast so that
+        # they fit in typed arrays.
+        codes = [self._typecode(field) for field in fields]
+        values = [array.array(code) if code else [] for code in codes]
+        columns = []
+        subvals = []
+        for field, code in zip(fields, codes):
+            expr, vals = self._column(field)
+            if code:
+                expr = 'CAST({0} AS {1})'.format(
+                    expr, 'INTEGER' if code == b'l' else 'REAL'
+                )
+            columns.append(expr)
+            subvals += vals
+        sql, inner_subvals = self._select(', '.join(columns) or '1',
+                                          self._sql_slice)
+        subvals += inner_subvals
+
+        with self.db.transaction() as tx:
+            key = None
+            if cache:
+                # Byte strings (e.g., from path queries) cannot be
+                # written as JSON directly.
+                key = json.dumps([fields, sql,
+                                  [encode_value(v) for v in subvals],
+                                  self.db.last_change()])
+                snapshot = Snapshot.load(cache, key)
+                if snapshot is not None:
+                    return snapshot
+
+            cursor = tx.cursor(sql, subvals)
+            while True:
+                rows = cursor.fetchmany(self._window_size)
+                if not rows:
+                    break
+                for column, row_values in zip(values, zip(*rows)):
+                    column.extend(row_values)
+
+        snapshot = Snapshot([
+            (field, self._snapshot_column(field, code, column))
+            for field, code, column in zip(fields, codes, values)
+        ], key)
+        if cache:
+            snapshot.save(cache)
+        return snapshot
+
+    def _typecode(self, field):
+        """Get the array type code for a field's snapshot column. Only
+        fixed fields, which are never null, are kept in typed arrays.
+        """
+        if field in self.model_class._fields:
+            return typecode(self.model_class._type(field))
+        return None
+
+    def _snapshot_column(self, field, code, values):
+        """Build a snapshot column from the values of a field as they
+        are stored in the database.
+        """
+        if code:
+            return make_column(code, values)
+        typ = self.model_class._type(field)
+        if field in self.model_class._fields:
+            return make_column(None, (typ.from_sql(v) for v in values))
+        return make_column(None, (None if v is None else typ.from_sql(v)
+                                  for v in values))
+
+    def _snapshot_objects(self, fields):
+        """Build a snapshot from the values of the matching objects.
+        """
+        codes = [self._typecode(field) for field in fields]
+        values = [[] for _ in fields]
+        for obj in self.stream():
+            for column, field in zip(values, fields):
+                column.append(obj.get(field))
+        return Snapshot([
+            (field, make_column(code, column))
+            for field, code, column in zip(fields, codes, values)
+        ])
+
 
 class Transaction(object):
     """A context manager for safe, concurrent access to the database.
@@ -617,6 +1301,8 @@ class Transaction(object):
     """
     def __init__(self, db):
         self.db = db
+        self.locked = False
+        self.written = set()
 
     def __enter__(self):
         """Begin a transaction. This transaction may be created while
@@ -625,10 +1311,11 @@ class Transaction(object):
         with self.db._tx_stack() as stack:
             first = not stack
             stack.append(self)
-        if first:
+        if first and not self.db.concurrent:
             # Beginning a "root" transaction, which corresponds to an
             # SQLite transaction.
             self.db._db_lock.acquire()
+            self.locked = True
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -642,25 +1329,72 @@ class Transaction(object):
         if empty:
             # Ending a "root" transaction. End the SQLite transaction.
             self.db._connection().commit()
-            self.db._db_lock.release()
+            # Other threads may have cached objects read before the
+            # changes were committed.
+            for model_cls in self.written:
+                self.db._uncache(model_cls)
+            if self.locked:
+                self.locked = False
+                self.db._db_lock.release()
+
+    def _lock_for_write(self):
+        """Ensure that the current root transaction holds the database
+        lock before modifying the database. In concurrent mode, the lock
+        is only taken on the first write, so read-only transactions
+        never wait for one another.
+        """
+        with self.db._tx_stack() as stack:
+            root = stack[0]
+        if not root.locked:
+            self.db._db_lock.acquire()
+            root.locked = True
+
+    def _invalidate(self, models):
+        """Drop the cached objects of the given model classes, now and
+        again when the root transaction commits. This also advances
+        their write generations (see `Database._cache_generations`).
+        """
+        with self.db._tx_stack() as stack:
+            root = stack[0]
+        root.written.update(models)
+        for model_cls in models:
+            self.db._uncache(model_cls)
 
     def query(self, statement, subvals=()):
         """Execute an SQL statement with substitution values and return
         a list of rows from the database.
         """
-        cursor = self.db._connection().execute(statement, subvals)
-        return cursor.fetchall()
+        return self.cursor(statement, subvals).fetchall()
+
+    def cursor(self, statement, subvals=()):
+        """Execute an SQL statement with substitution values and return
+        the cursor, from which rows can be fetched incrementally. The
+        rows must be consumed before the transaction ends.
+        """
+        return self.db._connection().execute(statement, subvals)
 
     def mutate(self, statement, subvals=()):
         """Execute an SQL statement with substitution values and return
         the row ID of the last affected row.
         """
+        self._lock_for_write()
         cursor = self.db._connection().execute(statement, subvals)
+        self._invalidate(self.db._written_models(statement))
         return cursor.lastrowid
 
+    def mutate_many(self, statement, seq_of_subvals):
+        """Execute an SQL statement once for each sequence of
+        substitution values.
+        """
+        self._lock_for_write()
+        self.db._connection().executemany(statement, seq_of_subvals)
+        self._invalidate(self.db._written_models(statement))
+
     def script(self, statements):
         """Execute a string containing multiple SQL statements."""
+        self._lock_for_write()
         self.db._connection().executescript(statements)
+        self._invalidate(self.db._models)
 
 
 class Database(object):
@@ -671,8 +1405,39 @@ class Database(object):
     """The Model subclasses representing tables in this database.
     """
 
-    def __init__(self, path):
+    _journal_table = None
+    """The name of a table that records every change made through
+    models (see `changes_since`), or None to keep no record.
+    """
+
+    def __init__(self, path, concurrent=False, cache_size=0,
+                 journal_size=0):
+        """Open the database at `path`.
+
+        If `concurrent` is true, the database uses write-ahead logging
+        and only transactions that modify the database are serialized:
+        reads proceed in parallel on each thread's connection.
+
+        `cache_size` is the number of objects of each model type that
+        `_get` keeps in an identity map, so that looking up the same
+        object again returns it without a query. Zero disables the map.
+
+        `journal_size` is the number of the latest changes kept in the
+        change journal: older ones are pruned when the database is
+        opened. Zero keeps every change.
+        """
         self.path = path
+        self.concurrent = concurrent
+        self.cache_size = cache_size
+        self.journal_size = journal_size
+
+        # Log SQLite's plan for each query that fetches objects, at the
+        # debug level, to see which indexes it uses.
+        self.log_query_plans = False
+
+        # Keep the fixed fields of the objects associated with the
+        # database in `FixedValues` containers (see `Model._compact`).
+        self.compact_models = False
 
         self._connections = {}
         self._tx_stacks = defaultdict(list)
@@ -688,13 +1453,65 @@ class Database(object):
         # backoff algorithm in the case of contention was causing
         # whole-second sleeps (!) that would trigger its internal
         # timeout. Using this lock ensures only one SQLite transaction
-        # is active at a time.
+        # is active at a time. In concurrent mode, it is only held by
+        # transactions that write.
         self._db_lock = threading.Lock()
 
-        # Set up database schema.
+        # The identity map: for each model class, an LRU-ordered map
+        # from ids to objects. An object is evicted with all others of
+        # its class when a transaction writes to one of the class's
+        # tables. The generation counters, which advance on every write
+        # to a class's tables, let `_get` detect a write that happened
+        # while it was querying and let other caches check whether they
+        # are still current.
+        self._cache = defaultdict(collections.OrderedDict)
+        self._cache_generations = defaultdict(int)
+        self._cache_lock = threading.Lock()
+        self._table_models = {}
+
+        if self.concurrent:
+            # Write-ahead logging lets readers proceed while a write is
+            # in progress. The setting is persistent for the database.
+            with self.transaction() as tx:
+                tx.query('PRAGMA journal_mode=WAL')
+
+        for model_cls in self._models:
+            for table in (model_cls._table, model_cls._flex_table,
+                          model_cls._search_table):
+                if table:
+                    self._table_models[table] = model_cls
+
+        # Set up database schema, unless it was already set up for the
+        # same models. The full-text indexes are checked as well, since
+        # a program that does not know about them may drop them.
+        version = self._schema_version()
+        with self.transaction() as tx:
+            current_version = tx.query('PRAGMA user_version')[0][0]
+        if current_version != version or not self._search_tables_current():
+            start = time.time()
+            self._make_schema()
+            with self.transaction() as tx:
+                tx.script('PRAGMA user_version={0};'.format(version))
+            log.debug(u'database schema set up in {0:.3f} seconds',
+                      time.time() - start)
+
+        if self._journal_table and self.journal_size > 0:
+            self.prune_changes(self.last_change() - self.journal_size)
+
+    def _make_schema(self):
+        """Create or update the tables and indexes for all the models.
+        """
         for model_cls in self._models:
             self._make_table(model_cls._table, model_cls._fields)
             self._make_attribute_table(model_cls._flex_table)
+            self._convert_flex_values(model_cls)
+            self._make_indices(model_cls)
+            if model_cls._search_index():
+                self._make_search_table(model_cls._search_table,
+                                        model_cls._table,
+                                        model_cls._search_fields)
+        if self._journal_table:
+            self._make_journal_table(self._journal_table)
 
     # Primitive access control: connections and transactions.
 
@@ -707,18 +1524,33 @@ class Database(object):
             if thread_id in self._connections:
                 return self._connections[thread_id]
             else:
-                # Make a new connection.
-                conn = sqlite3.connect(
-                    self.path,
-                    timeout=beets.config['timeout'].as_number(),
-                )
-
-                # Access SELECT results like dictionaries.
-                conn.row_factory = sqlite3.Row
-
+                conn = self._create_connection()
                 self._connections[thread_id] = conn
                 return conn
 
+    def _create_connection(self):
+        """Open a new SQLite connection to the database and set it up
+        for use by DBCore.
+        """
+        conn = sqlite3.connect(
+            self.path,
+            timeout=beets.config['timeout'].as_number(),
+        )
+
+        # Access SELECT results like dictionaries.
+        conn.row_factory = sqlite3.Row
+
+        if self.concurrent:
+            # With a write-ahead log, syncing on every commit is not
+            # necessary for consistency.
+            conn.execute('PRAGMA synchronous=NORMAL')
+
+        # Functions used by queries to match values inside SQLite.
+        conn.create_function('regexp', 2, _regexp)
+        conn.create_function('string_match', 3, _string_match)
+
+        return conn
+
     @contextlib.contextmanager
     def _tx_stack(self):
         """A context manager providing access to the current thread's
@@ -737,6 +1569,31 @@ class Database(object):
 
     # Schema setup and migration.
 
+    def _schema_version(self):
+        """Get a number that identifies the schema the models need:
+        their tables, fields, indexes, and full-text indexes. It is kept
+        in SQLite's `user_version` so that an up-to-date database can be
+        opened without checking each table.
+        """
+        parts = []
+        for model_cls in self._models:
+            parts.append(model_cls._table)
+            parts += sorted('{0} {1}'.format(name, typ.sql)
+                            for name, typ in model_cls._fields.items())
+            parts.append(model_cls._flex_table)
+            parts += sorted(key for key, typ in model_cls._types.items()
+                            if _is_numeric(typ))
+            parts += ['{0} {1}'.format(name, columns) for name, _, columns
+                      in self._declared_indices(model_cls)]
+            if model_cls._search_index():
+                parts.append(model_cls._search_table)
+                parts += model_cls._search_fields
+        parts.append(self._journal_table or '')
+
+        # A nonzero, positive 32-bit number; zero is a new database.
+        version = zlib.crc32('\n'.join(parts).encode('utf8')) & 0x7fffffff
+        return version or 1
+
     def _make_table(self, table, fields):
         """Set up the schema of the database. `fields` is a mapping
         from field names to `Type`s. Columns are added if necessary.
@@ -775,49 +1632,599 @@ class Database(object):
     def _make_attribute_table(self, flex_table):
         """Create a table and associated index for flexible attributes
         for the given entity (if they don't exist).
+
+        The values have no type affinity, so numbers are stored as
+        numbers. A table from an older version, which stores every
+        value as text, is rebuilt.
         """
+        with self.transaction() as tx:
+            rows = tx.query('PRAGMA table_info(%s)' % flex_table)
+        if any(row[1] == 'value' and row[2].upper() == 'TEXT'
+               for row in rows):
+            self._migrate_attribute_table(flex_table)
+
         with self.transaction() as tx:
             tx.script("""
-                CREATE TABLE IF NOT EXISTS {0} (
-                    id INTEGER PRIMARY KEY,
-                    entity_id INTEGER,
-                    key TEXT,
-                    value TEXT,
-                    UNIQUE(entity_id, key) ON CONFLICT REPLACE);
+                CREATE TABLE IF NOT EXISTS {0} ({1});
                 CREATE INDEX IF NOT EXISTS {0}_by_entity
                     ON {0} (entity_id);
-                """.format(flex_table))
+                """.format(flex_table, ATTRIBUTE_COLUMNS))
+
+    def _migrate_attribute_table(self, flex_table):
+        """Copy an attribute table with text values into one without
+        type affinity, keeping its rows and indexes.
+        """
+        with self.transaction() as tx:
+            rows = tx.query(
+                'SELECT sql FROM sqlite_master WHERE type = ? '
+                'AND tbl_name = ? AND sql IS NOT NULL',
+                ('index', flex_table)
+            )
+            tx.script("""
+                CREATE TABLE {0}_new ({1});
+                INSERT INTO {0}_new (id, entity_id, key, value)
+                    SELECT id, entity_id, key, value FROM {0};
+                DROP TABLE {0};
+                ALTER TABLE {0}_new RENAME TO {0};
+                {2}
+                """.format(flex_table, ATTRIBUTE_COLUMNS,
+                           ''.join(row[0] + ';' for row in rows)))
+
+    def _convert_flex_values(self, model_cls):
+        """Store the values of the numeric flexible attributes of
+        `model_cls` that are still kept as text as numbers, for
+        attributes that have been given a type since they were stored.
+        """
+        with self.transaction() as tx:
+            for key, typ in model_cls._types.items():
+                if key in model_cls._fields or not _is_numeric(typ):
+                    continue
+                tx.mutate(
+                    "UPDATE {0} SET value = {1} WHERE key = ? "
+                    "AND typeof(value) = 'text' AND value != ''".format(
+                        model_cls._flex_table, flex_value(typ)
+                    ),
+                    (key,)
+                )
+
+    def _search_table_columns(self, search_table):
+        """Get the list of columns in a full-text index table, which
+        is empty if the table does not exist.
+        """
+        with self.transaction() as tx:
+            rows = tx.query('PRAGMA table_info(%s)' % search_table)
+        return [row[1] for row in rows]
+
+    def _search_triggers_exist(self, search_table):
+        """Check that the triggers that keep a full-text index up to
+        date exist.
+        """
+        names = [search_table + suffix
+                 for suffix in ('_insert', '_update', '_delete')]
+        with self.transaction() as tx:
+            rows = tx.query(
+                "SELECT name FROM sqlite_master WHERE type='trigger' "
+                "AND name IN ({0})".format(', '.join('?' * len(names))),
+                names
+            )
+        return len(rows) == len(names)
+
+    def _search_table_current(self, search_table, fields):
+        """Check that a full-text index exists with the given fields as
+        its columns, along with the triggers that keep it up to date.
+        """
+        return self._search_table_columns(search_table) == list(fields) \
+            and self._search_triggers_exist(search_table)
+
+    def _search_tables_current(self):
+        """Check that the full-text index of every model is current.
+        """
+        for model_cls in self._models:
+            search_table = model_cls._search_index()
+            if search_table and not self._search_table_current(
+                    search_table, model_cls._search_fields):
+                return False
+        return True
+
+    def _make_search_table(self, search_table, table, fields):
+        """Create a full-text index over the given fields of `table`
+        (if it does not exist) and fill it from the table's rows. An
+        index over a different set of fields, or one whose triggers are
+        missing and so may be out of date, is rebuilt.
+
+        The index is kept up to date by triggers, so that it also
+        follows changes made without dbcore.
+        """
+        if self._search_table_current(search_table, fields):
+            return
+
+        columns = ', '.join(fields)
+        new_values = ', '.join('new.' + field for field in fields)
+        with self.transaction() as tx:
+            tx.script("""
+                DROP TRIGGER IF EXISTS {0}_insert;
+                DROP TRIGGER IF EXISTS {0}_update;
+                DROP TRIGGER IF EXISTS {0}_delete;
+                DROP TABLE IF EXISTS {0};
+                CREATE VIRTUAL TABLE {0}
+                    USING fts5({1}, tokenize=trigram);
+                INSERT INTO {0} (rowid, {1}) SELECT id, {1} FROM {2};
+                CREATE TRIGGER {0}_insert AFTER INSERT ON {2} BEGIN
+                    INSERT INTO {0} (rowid, {1}) VALUES (new.id, {3});
+                END;
+                CREATE TRIGGER {0}_update AFTER UPDATE OF {1} ON {2} BEGIN
+                    INSERT OR REPLACE INTO {0} (rowid, {1})
+                        VALUES (new.id, {3});
+                END;
+                CREATE TRIGGER {0}_delete AFTER DELETE ON {2} BEGIN
+                    DELETE FROM {0} WHERE rowid = old.id;
+                END;
+                """.format(search_table, columns, table, new_values))
+
+    def _make_journal_table(self, journal_table):
+        """Create the change journal table (if it does not exist).
+        Sequence numbers are never reused, even after old changes are
+        pruned.
+        """
+        with self.transaction() as tx:
+            tx.script("""
+                CREATE TABLE IF NOT EXISTS {0} (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entity TEXT,
+                    entity_id INTEGER,
+                    op TEXT,
+                    keys TEXT);
+                """.format(journal_table))
+
+    def _declared_indices(self, model_cls):
+        """Get the indexes that `model_cls` declares as a list of
+        `(name, fields, columns)` triples, where `columns` is the SQL
+        definition of the indexed columns. These are the fields in
+        `_indices` and the named sorts that can use an index.
+        """
+        out = []
+        for fields in model_cls._indices:
+            fields = _index_fields(fields)
+            out.append((_index_name(model_cls._table, fields), fields,
+                        ', '.join(fields)))
+
+        expressions = set()
+        for key, sort_cls in sorted(model_cls._sorts.items()):
+            expression = sort_cls(model_cls).index_clause()
+            if expression and expression not in expressions:
+                expressions.add(expression)
+                out.append(('{0}_sorted_by_{1}'.format(model_cls._table, key),
+                            (key,), expression))
+        return out
+
+    def _make_indices(self, model_cls):
+        """Create the indexes declared by `model_cls` (if they don't
+        exist).
+        """
+        statements = []
+        for name, _, columns in self._declared_indices(model_cls):
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2});'.format(
+                    name, model_cls._table, columns
+                )
+            )
+        if statements:
+            with self.transaction() as tx:
+                tx.script('\n'.join(statements))
+
+    # Managing indexes.
+
+    def indices(self, model_cls):
+        """Get the secondary indexes on the tables of `model_cls` as a
+        list of `(name, fields, declared)` triples, where `fields` is a
+        tuple of field names and `declared` indicates whether the model
+        declares the index. This includes the indexes added with
+        `add_index`, but not the index that finds the flexible
+        attributes of an object.
+        """
+        declared = dict((name, fields) for name, fields, _
+                        in self._declared_indices(model_cls))
+        flex_prefix = _index_name(model_cls._flex_table, ('key',)) + '_'
+        with self.transaction() as tx:
+            rows = tx.query(
+                'SELECT name, tbl_name FROM sqlite_master '
+                'WHERE type = ? AND sql IS NOT NULL AND tbl_name IN (?, ?) '
+                'ORDER BY name',
+                ('index', model_cls._table, model_cls._flex_table)
+            )
+            out = []
+            for name, table in rows:
+                if name in declared:
+                    out.append((name, declared[name], True))
+                elif table == model_cls._table:
+                    info = tx.query('PRAGMA index_info({0})'.format(name))
+                    out.append((name, tuple(row[2] for row in info), False))
+                elif name.startswith(flex_prefix):
+                    out.append((name, (name[len(flex_prefix):],), False))
+        return out
+
+    def add_index(self, model_cls, fields):
+        """Create an index on the given fields of `model_cls`, which
+        may be a field name or a tuple of field names. Return the name
+        of the index.
+
+        Fixed fields are indexed in the main table. A flexible field is
+        indexed in the attribute table by its typed value, so that
+        queries on that field can use the index; it cannot be combined
+        with other fields.
+        """
+        fields = _index_fields(fields)
+        table, name, sql = self._index_spec(model_cls, fields)
+        with self.transaction() as tx:
+            tx.script('CREATE INDEX IF NOT EXISTS {0} ON {1} {2};'.format(
+                name, table, sql
+            ))
+        return name
+
+    def drop_index(self, model_cls, fields):
+        """Remove the index on the given fields of `model_cls` created
+        by `add_index`. Declared indexes cannot be removed. Return
+        whether an index was removed.
+        """
+        fields = _index_fields(fields)
+        _, name, _ = self._index_spec(model_cls, fields)
+        indices = dict((n, d) for n, _, d in self.indices(model_cls))
+        if name not in indices:
+            return False
+        elif indices[name]:
+            raise ValueError('index on {0} is built in'.format(
+                ', '.join(fields)
+            ))
+        with self.transaction() as tx:
+            tx.script('DROP INDEX {0};'.format(name))
+        return True
+
+    def _index_spec(self, model_cls, fields):
+        """Get the table, name, and column definition of an index on
+        the given fields of `model_cls`. Raise a ValueError if the fields
+        cannot be indexed together.
+        """
+        for field in fields:
+            if not re.match(r'^[A-Za-z_]\w*$', field):
+                raise ValueError('invalid field name: {0}'.format(field))
+
+        flex = [f for f in fields if f not in model_cls._fields]
+        if not flex:
+            return (model_cls._table,
+                    _index_name(model_cls._table, fields),
+                    '({0})'.format(', '.join(fields)))
+        elif len(fields) > 1:
+            raise ValueError('flexible field {0} must be indexed '
+                             'alone'.format(flex[0]))
+
+        # A partial index over the values of a single attribute. The
+        # expression matches the one used by `FieldQuery.flex_clause`.
+        field = fields[0]
+        table = model_cls._flex_table
+        return (table,
+                _index_name(table, ('key', field)),
+                "({0}) WHERE key = '{1}'".format(
+                    flex_value(model_cls._type(field)), field
+                ))
+
+    def _log_query_plan(self, statement, subvals=()):
+        """Log SQLite's plan for executing a query.
+        """
+        with self.transaction() as tx:
+            rows = tx.query('EXPLAIN QUERY PLAN ' + statement, subvals)
+        log.debug(u'query plan for {0}', statement)
+        for row in rows:
+            log.debug(u'  {0}', row[3])
+
+    # Storing objects.
+
+    def store_many(self, objs):
+        """Save the changes to several objects in a single transaction,
+        like calling `store` on each of them. Objects of the same type
+        whose modified fields are the same are updated together with
+        `executemany`.
+        """
+        objs = list(objs)
+        updates = defaultdict(list)
+        flex_sets = defaultdict(list)
+        flex_dels = defaultdict(list)
+        changes = []
+
+        for obj in objs:
+            obj._check_db()
+            model_cls = type(obj)
+
+            # Objects that `add_many` is adding have a dirty id.
+            keys = obj._dirty - set(['id'])
+            if keys:
+                op = 'add' if 'id' in obj._dirty else 'store'
+                changes.append((obj._table, obj.id, op, keys))
+
+            # Fixed fields, grouped by the set of modified fields.
+            keys = tuple(sorted(key for key in obj._dirty
+                                if key in obj._fields and key != 'id'))
+            if keys:
+                row = [obj._type(key).to_sql(obj[key]) for key in keys]
+                row.append(obj.id)
+                updates[model_cls, keys].append(row)
+
+            # Modified, added and deleted flexible attributes.
+            for key in obj._dirty:
+                if key in obj._fields:
+                    continue
+                elif key in obj._values_flex:
+                    flex_sets[obj._flex_table].append(
+                        (obj.id, key,
+                         _flex_to_sql(obj._type(key), obj._values_flex[key]))
+                    )
+                else:
+                    flex_dels[obj._flex_table].append((obj.id, key))
+
+        with self.transaction() as tx:
+            for (model_cls, keys), rows in updates.items():
+                tx.mutate_many(
+                    'UPDATE {0} SET {1} WHERE id=?'.format(
+                        model_cls._table,
+                        ','.join(key + '=?' for key in keys),
+                    ),
+                    rows,
+                )
+            for flex_table, rows in flex_sets.items():
+                tx.mutate_many(
+                    'INSERT INTO {0} (entity_id, key, value) '
+                    'VALUES (?, ?, ?)'.format(flex_table),
+                    rows,
+                )
+            for flex_table, rows in flex_dels.items():
+                tx.mutate_many(
+                    'DELETE FROM {0} '
+                    'WHERE entity_id=? AND key=?'.format(flex_table),
+                    rows,
+                )
+            self._record_changes(tx, changes)
+
+        for obj in objs:
+            obj.clear_dirty()
+
+    def store_matching(self, model_cls, query, values):
+        """Set fixed fields to the same values on all the objects of
+        `model_cls` that match `query`, like modifying and storing each
+        of them but with a single UPDATE statement that does not load
+        them. `values` maps field names to their new values. The query
+        must be one that the database can evaluate.
+        """
+        clause, subvals = query.clause()
+        if clause is None:
+            raise ValueError('query {0!r} cannot be evaluated by the '
+                             'database'.format(query))
+        for key in values:
+            if key not in model_cls._fields or key == 'id':
+                raise ValueError('{0} is not a fixed field'.format(key))
+        keys = sorted(values)
+        sql_values = {}
+        for key in keys:
+            typ = model_cls._type(key)
+            sql_values[key] = typ.to_sql(typ.normalize(values[key]))
+
+        with self.transaction() as tx:
+            # The journal is updated first, while the query still
+            # matches the same rows.
+            if self._journal_table:
+                change = [model_cls._table, 'store', json.dumps(keys)]
+                tx.mutate(
+                    'INSERT INTO {0} (entity, entity_id, op, keys) '
+                    'SELECT ?, id, ?, ? FROM {1} WHERE {2}'.format(
+                        self._journal_table, model_cls._table, clause
+                    ),
+                    change + list(subvals),
+                )
+            tx.mutate(
+                'UPDATE {0} SET {1} WHERE {2}'.format(
+                    model_cls._table,
+                    ', '.join(key + '=?' for key in keys),
+                    clause,
+                ),
+                [sql_values[key] for key in keys] + list(subvals),
+            )
+
+    def add_many(self, objs):
+        """Add several new objects to the database in a single
+        transaction, like calling `add` on each of them. The objects'
+        `id` and `added` fields are set along with any current field
+        values.
+        """
+        objs = list(objs)
+        by_table = defaultdict(list)
+        for obj in objs:
+            by_table[obj._table].append(obj)
+
+        with self.transaction() as tx:
+            for table, group in by_table.items():
+                # SQLite gives a new row the largest id in the table
+                # plus one. Once the first row is inserted, this
+                # transaction holds the write lock, so the following
+                # ids are free too.
+                first_id = tx.mutate(
+                    'INSERT INTO {0} DEFAULT VALUES'.format(table)
+                )
+                ids = range(first_id, first_id + len(group))
+                tx.mutate_many(
+                    'INSERT INTO {0} (id) VALUES (?)'.format(table),
+                    [(id,) for id in ids[1:]],
+                )
+
+                for obj, id in zip(group, ids):
+                    obj._db = self
+                    obj.id = id
+                    obj.added = time.time()
+
+                    # Mark every non-null field as dirty and store.
+                    for key in obj:
+                        if obj[key] is not None:
+                            obj._mark_dirty(key)
+
+            self.store_many(objs)
+
+    # The change journal.
+
+    def _record_changes(self, tx, changes):
+        """Append changes to the journal (if there is one) in the
+        transaction `tx`. `changes` is a sequence of `(table, id, op,
+        keys)` tuples, where `op` is "add", "store", or "remove" and
+        `keys` are the names of the fields that changed.
+        """
+        if self._journal_table and changes:
+            tx.mutate_many(
+                'INSERT INTO {0} (entity, entity_id, op, keys) '
+                'VALUES (?, ?, ?, ?)'.format(self._journal_table),
+                [(table, id, op, json.dumps(sorted(keys)))
+                 for table, id, op, keys in changes],
+            )
+
+    def changes_since(self, seq=0, limit=None):
+        """Get the changes recorded in the journal after the sequence
+        number `seq`, oldest first, as a list of `Change` tuples. At
+        most `limit` changes are returned if it is given.
+
+        A consumer that keeps the `seq` of the last change it has seen
+        can pick up from there to update its own state incrementally.
+        Only changes made through models (`store`, `add`, `remove`, and
+        their bulk versions) are recorded.
+        """
+        if not self._journal_table:
+            raise ValueError('this database keeps no change journal')
+        with self.transaction() as tx:
+            rows = tx.query(
+                'SELECT seq, entity, entity_id, op, keys FROM {0} '
+                'WHERE seq > ? ORDER BY seq LIMIT ?'.format(
+                    self._journal_table
+                ),
+                (seq, -1 if limit is None else limit)
+            )
+        return [Change(row[0], self._table_models.get(row[1]), row[2],
+                       row[3], tuple(json.loads(row[4])))
+                for row in rows]
+
+    def last_change(self):
+        """Get the sequence number of the latest change in the journal,
+        or 0 if nothing has changed. It stays the same when the change
+        is pruned.
+        """
+        if not self._journal_table:
+            raise ValueError('this database keeps no change journal')
+        with self.transaction() as tx:
+            rows = tx.query('SELECT seq FROM sqlite_sequence WHERE name=?',
+                            (self._journal_table,))
+        return rows[0][0] if rows else 0
+
+    def first_change(self):
+        """Get the sequence number of the oldest change still in the
+        journal, or the next one if the journal is empty. A consumer
+        that last saw an earlier change than the one before it has
+        missed changes that were pruned, and must start over.
+        """
+        if not self._journal_table:
+            raise ValueError('this database keeps no change journal')
+        with self.transaction() as tx:
+            rows = tx.query('SELECT MIN(seq) FROM {0}'.format(
+                self._journal_table
+            ))
+        return rows[0][0] or self.last_change() + 1
+
+    def prune_changes(self, seq):
+        """Delete the changes up to and including the sequence number
+        `seq` from the journal, once no consumer needs them anymore.
+        """
+        if not self._journal_table:
+            raise ValueError('this database keeps no change journal')
+        with self.transaction() as tx:
+            tx.mutate('DELETE FROM {0} WHERE seq <= ?'.format(
+                self._journal_table
+            ), (seq,))
 
     # Querying.
 
-    def _fetch(self, model_cls, query=None, sort=None):
+    def _fetch(self, model_cls, query=None, sort=None, limit=None,
+               offset=None, after=None):
         """Fetch the objects of type `model_cls` matching the given
         query. The query may be given as a string, string sequence, a
         Query object, or None (to fetch everything). `sort` is an
         `Sort` object.
+
+        `limit` and `offset` select a slice of the results. `after` is
+        an id for keyset pagination: only objects with a greater id are
+        returned, ordered by id. It cannot be combined with a sort.
         """
         query = query or TrueQuery()  # A null query.
         sort = sort or NullSort()  # Unsorted.
         where, subvals = query.clause()
         order_by = sort.order_clause()
 
-        sql = ("SELECT * FROM {0} WHERE {1} {2}").format(
-            model_cls._table,
-            where or '1',
-            "ORDER BY {0}".format(order_by) if order_by else '',
-        )
+        slow_query = None if where else query
+        slow_sort = sort if sort.is_slow() else None
+        where = where or '1'
 
-        with self.transaction() as tx:
-            rows = tx.query(sql, subvals)
+        if after is not None:
+            if sort:
+                raise ValueError('keyset pagination cannot be sorted')
+            where = '({0}) AND id > ?'.format(where)
+            subvals = list(subvals) + [after]
+            order_by = 'id'
 
         return Results(
-            model_cls, rows, self,
-            None if where else query,  # Slow query component.
-            sort if sort.is_slow() else None,  # Slow sort component.
+            model_cls, self, where, subvals, order_by,
+            slow_query, slow_sort, limit, offset,
         )
 
     def _get(self, model_cls, id):
         """Get a Model object by its id or None if the id does not
         exist.
+
+        If the identity map is enabled, an object that was already
+        fetched (and has not been modified since) is returned again.
+        """
+        if not self.cache_size:
+            return self._fetch(model_cls, MatchQuery('id', id)).get()
+
+        with self._cache_lock:
+            cache = self._cache[model_cls]
+            obj = cache.pop(id, None)
+            if obj is not None and not obj._dirty:
+                # Mark as most recently used.
+                cache[id] = obj
+                return obj
+            generation = self._cache_generations[model_cls]
+
+        obj = self._fetch(model_cls, MatchQuery('id', id)).get()
+        if obj is not None:
+            with self._cache_lock:
+                if self._cache_generations[model_cls] == generation:
+                    cache = self._cache[model_cls]
+                    cache[id] = obj
+                    if len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+        return obj
+
+    def _uncache(self, model_cls, id=None):
+        """Remove the object of type `model_cls` with the given id from
+        the identity map, or all objects of that type if `id` is None.
         """
-        return self._fetch(model_cls, MatchQuery('id', id)).get()
+        with self._cache_lock:
+            if id is None:
+                self._cache.pop(model_cls, None)
+                self._cache_generations[model_cls] += 1
+            else:
+                self._cache[model_cls].pop(id, None)
+
+    def _written_models(self, statement):
+        """Get the model classes whose tables may be modified by an SQL
+        statement. Statements that cannot be analyzed are assumed to
+        modify every model.
+        """
+        match = _WRITE_TABLE_RE.match(statement)
+        if not match:
+            return self._models
+        elif match.group(1) in self._table_models:
+            return (self._table_models[match.group(1)],)
+        else:
+            return ()
@@ -18,6 +18,7 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import re
+import copy
 from operator import mul
 from beets import util
 from datetime import datetime, timedelta
@@ -83,17 +84,52 @@ class Query(object):
         return 0
 
 
+def flex_value(flex_type):
+    """Get an SQL expression for the `value` column of a flexible
+    attribute table, cast according to the attribute's `Type` (if
+    any). The column has no type affinity and keeps numbers as numbers,
+    but values written as text (e.g., before the attribute had a type)
+    still need the cast to compare as numbers.
+    """
+    sql_type = (flex_type.sql if flex_type else 'TEXT')
+    sql_type = sql_type.split()[0].upper()
+    if sql_type in ('INTEGER', 'REAL'):
+        return 'CAST(value AS {0})'.format(sql_type)
+    else:
+        return 'value'
+
+
+def sql_string(value):
+    """Quote a string as an SQL literal.
+    """
+    return "'{0}'".format(value.replace("'", "''"))
+
+
 class FieldQuery(Query):
     """An abstract query that searches in a specific field for a
     pattern. Subclasses must provide a `value_match` class method, which
     determines whether a certain pattern string matches a certain value
     string. Subclasses may also provide `col_clause` to implement the
     same matching functionality in SQLite.
+
+    A query on a flexible attribute is not "fast", but it can still be
+    evaluated in SQLite if it is told where the attributes are stored
+    using `bind_flex`.
     """
     def __init__(self, field, pattern, fast=True):
         self.field = field
         self.pattern = pattern
         self.fast = fast
+        self.flex_table = None
+        self.flex_type = None
+
+    def bind_flex(self, flex_table, flex_type=None):
+        """Evaluate this query on the flexible attribute table
+        `flex_table`. `flex_type` is the field's `Type`; it determines
+        how the stored values are cast for comparison.
+        """
+        self.flex_table = flex_table
+        self.flex_type = flex_type
 
     def col_clause(self):
         return None, ()
@@ -101,10 +137,59 @@ class FieldQuery(Query):
     def clause(self):
         if self.fast:
             return self.col_clause()
+        elif self.flex_table:
+            return self.flex_clause()
         else:
             # Matching a flexattr. This is a slow query.
             return None, ()
 
+    def _flex_value(self):
+        """Get an SQL expression for the stored value of the flexible
+        attribute, cast according to the field's type.
+        """
+        return flex_value(self.flex_type)
+
+    def _matches_values(self, item):
+        """Determine whether the query matches an object with the
+        values in the dictionary `item`. Used to decide how objects with
+        null or missing values are treated in SQL.
+        """
+        try:
+            return self.match(item)
+        except (KeyError, AttributeError, TypeError, ValueError):
+            return False
+
+    def flex_clause(self):
+        """Generate an SQL expression implementing the query on a
+        flexible attribute. The column clause is applied to the values
+        in the attribute table. Objects where the value is null or where
+        the attribute is missing are included according to what
+        `match` would do for them.
+        """
+        col_query = copy.copy(self)
+        col_query.field = self._flex_value()
+        col_clause, col_subvals = col_query.col_clause()
+        if not col_clause:
+            return None, ()
+
+        null = self.flex_type.null if self.flex_type else None
+        if self._matches_values({self.field: null}):
+            col_clause = '({0}) OR value IS NULL'.format(col_clause)
+
+        # The key is written into the statement rather than bound as a
+        # parameter so SQLite can use a partial index on the attribute.
+        key = sql_string(self.field)
+        clause = ('id IN (SELECT entity_id FROM {0} '
+                  'WHERE key = {1} AND ({2}))').format(self.flex_table,
+                                                       key, col_clause)
+        subvals = list(col_subvals)
+
+        if self._matches_values({}):
+            clause += (' OR id NOT IN (SELECT entity_id FROM {0} '
+                       'WHERE key = {1})').format(self.flex_table, key)
+
+        return clause, subvals
+
     @classmethod
     def value_match(cls, pattern, value):
         """Determine whether the value matches the pattern. Both
@@ -145,7 +230,6 @@ class NoneQuery(FieldQuery):
     def col_clause(self):
         return self.field + " IS NULL", ()
 
-    @classmethod
     def match(self, item):
         try:
             return item[self.field] is None
@@ -159,7 +243,15 @@ class NoneQuery(FieldQuery):
 class StringFieldQuery(FieldQuery):
     """A FieldQuery that converts values to strings before matching
     them.
+
+    Subclasses that do not provide their own `col_clause` are evaluated
+    in SQLite by calling their `string_match` method from an SQL
+    function.
     """
+    def col_clause(self):
+        return ('string_match(?, ?, {0})'.format(self.field),
+                [register_string_query(type(self)), self.pattern])
+
     @classmethod
     def value_match(cls, pattern, value):
         """Determine whether the value matches the pattern. The value
@@ -192,6 +284,24 @@ class SubstringQuery(StringFieldQuery):
         return pattern.lower() in value.lower()
 
 
+_string_queries = {}
+
+
+def register_string_query(cls):
+    """Make the `StringFieldQuery` subclass `cls` available to the
+    ``string_match`` SQL function. Return the key that identifies it.
+    """
+    key = '{0}.{1}'.format(cls.__module__, cls.__name__)
+    _string_queries[key] = cls
+    return key
+
+
+def string_query_class(key):
+    """Get the `StringFieldQuery` subclass registered with `key`.
+    """
+    return _string_queries[key]
+
+
 class RegexpQuery(StringFieldQuery):
     """A query that matches a regular expression in a specific item
     field.
@@ -209,6 +319,9 @@ class RegexpQuery(StringFieldQuery):
                                                 "a regular expression",
                                                 format(exc))
 
+    def col_clause(self):
+        return self.field + " REGEXP ?", [self.pattern.pattern]
+
     @classmethod
     def string_match(cls, pattern, value):
         return pattern.search(value) is not None
@@ -382,14 +495,49 @@ class AnyFieldQuery(CollectionQuery):
         self.pattern = pattern
         self.fields = fields
         self.query_class = cls
+        self.search_table = None
 
         subqueries = []
         for field in self.fields:
             subqueries.append(cls(field, pattern, True))
         super(AnyFieldQuery, self).__init__(subqueries)
 
+    def bind_search(self, search_table):
+        """Use a full-text index to evaluate the query. `search_table`
+        is an FTS5 table, built with the trigram tokenizer, whose
+        columns include all the query's fields and whose rowids are the
+        ids of the rows it indexes.
+        """
+        self.search_table = search_table
+
     def clause(self):
-        return self.clause_with_joiner('or')
+        clause, subvals = self.clause_with_joiner('or')
+        # The trigram index can only find substrings of three or more
+        # characters.
+        if clause and self.search_table \
+                and self.query_class is SubstringQuery \
+                and len(self.pattern) >= 3:
+            search_clause, search_subvals = self.search_clause()
+            clause = '{0} AND ({1})'.format(search_clause, clause)
+            subvals = search_subvals + subvals
+        return clause, subvals
+
+    def search_clause(self):
+        """Generate an SQLite expression matching the pattern as a
+        phrase in the full-text index.
+
+        The index folds the case of all letters, while LIKE only folds
+        ASCII letters, so the index can find more rows than the LIKE
+        clauses. It is used to narrow down the rows that the LIKE
+        clauses then check.
+        """
+        phrase = '{{{0}}}: "{1}"'.format(
+            ' '.join(self.fields), self.pattern.replace('"', '""')
+        )
+        clause = 'id IN (SELECT rowid FROM {0} WHERE {0} MATCH ?)'.format(
+            self.search_table
+        )
+        return clause, [phrase]
 
     def match(self, item):
         for subq in self.subqueries:
@@ -627,6 +775,12 @@ class Sort(object):
         """
         return None
 
+    def index_clause(self):
+        """Generates an SQL expression that an index can be built on to
+        speed up this sort, or None if there is none.
+        """
+        return None
+
     def sort(self, items):
         """Sort the list of objects and return a list.
         """
@@ -760,9 +914,59 @@ class FixedFieldSort(FieldSort):
         return "{0} {1} {2}".format(self.field, collate, order)
 
 
+class FlexFieldSort(FieldSort):
+    """Sort object to sort on a flexible attribute. Like a query, it
+    can be evaluated in SQLite if it is told where the attributes are
+    stored using `bind_flex`; otherwise, it is slow.
+    """
+    def __init__(self, field, ascending=True, case_insensitive=True):
+        super(FlexFieldSort, self).__init__(field, ascending,
+                                            case_insensitive)
+        self.table = None
+        self.flex_table = None
+        self.flex_type = None
+
+    def bind_flex(self, table, flex_table, flex_type=None):
+        """Sort the rows of `table` by their values in the attribute
+        table `flex_table`. `flex_type` is the field's `Type`; it
+        determines how the stored values are cast for comparison.
+        """
+        self.table = table
+        self.flex_table = flex_table
+        self.flex_type = flex_type
+
+    def order_clause(self):
+        if not self.flex_table:
+            return None
+        # Each row's value is found with the unique index on the
+        # attribute table. Objects without the attribute have a null
+        # value, which sorts first.
+        order = "ASC" if self.ascending else "DESC"
+        collate = 'COLLATE NOCASE' if self.case_insensitive else ''
+        return ('(SELECT {0} FROM {1} WHERE entity_id = {2}.id '
+                'AND key = {3}) {4} {5}').format(
+                    flex_value(self.flex_type), self.flex_table,
+                    self.table, sql_string(self.field), collate, order
+        )
+
+    def sort(self, objs):
+        # Missing values sort first, as they do in the database.
+        def key(obj):
+            value = obj.get(self.field)
+            if self.case_insensitive and isinstance(value, unicode):
+                value = value.lower()
+            return value
+
+        return sorted(objs, key=key, reverse=not self.ascending)
+
+    def is_slow(self):
+        return not self.flex_table
+
+
 class SlowFieldSort(FieldSort):
     """A sort criterion by some model field other than a fixed field:
-    i.e., a computed or flexible field.
+    i.e., a computed field or a flexible field that the database cannot
+    sort on.
     """
     def is_slow(self):
         return True
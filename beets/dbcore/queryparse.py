@@ -102,14 +102,24 @@ def construct_query_part(model_cls, prefixes, query_part):
             # The query type matches a specific field, but none was
             # specified. So we use a version of the query that matches
             # any field.
-            return query.AnyFieldQuery(pattern, model_cls._search_fields,
-                                       query_class)
+            q = query.AnyFieldQuery(pattern, model_cls._search_fields,
+                                    query_class)
+            if model_cls._search_index():
+                q.bind_search(model_cls._search_table)
+            return q
         else:
             # Other query type.
             return query_class(pattern)
 
     key = key.lower()
-    return query_class(key.lower(), pattern, key in model_cls._fields)
+    q = query_class(key, pattern, key in model_cls._fields)
+
+    # Let queries on flexible (i.e., neither fixed nor computed) fields
+    # be evaluated against the attribute table.
+    if isinstance(q, query.FieldQuery) and not q.fast and \
+            key not in model_cls._getters():
+        q.bind_flex(model_cls._flex_table, model_cls._type(key))
+    return q
 
 
 def query_from_strings(query_cls, model_cls, prefixes, query_parts):
@@ -144,9 +154,14 @@ def construct_sort_part(model_cls, part):
                                        case_insensitive)
     elif field in model_cls._fields:
         sort = query.FixedFieldSort(field, is_ascending, case_insensitive)
-    else:
-        # Flexible or computed.
+    elif field in model_cls._getters():
+        # Computed.
         sort = query.SlowFieldSort(field, is_ascending, case_insensitive)
+    else:
+        # Flexible: sorted by the database using the attribute table.
+        sort = query.FlexFieldSort(field, is_ascending, case_insensitive)
+        sort.bind_flex(model_cls._table, model_cls._flex_table,
+                       model_cls._type(field))
     return sort
 
 
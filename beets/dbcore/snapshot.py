@@ -0,0 +1,270 @@
+# This file is part of beets.
+# Copyright 2015, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Columnar snapshots of a set of objects: the values of some of their
+fields kept in compact arrays, one for each field, that are quick to
+scan, filter and aggregate. They are made with `Results.snapshot`.
+
+Numeric columns are NumPy arrays when NumPy is installed and arrays
+from the `array` module otherwise. Other columns are lists (or NumPy
+arrays of objects).
+"""
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+import array
+import base64
+import itertools
+import json
+import mmap
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def typecode(typ):
+    """Get the array type code for the values of a field type, or None
+    if they are not stored in a typed array.
+    """
+    if typ.null is None:
+        return None
+    if typ.model_type in (int, bool):
+        return b'l'
+    if typ.model_type is float:
+        return b'd'
+    return None
+
+
+def make_column(code, values=()):
+    """Build a column from an iterable of values, with the given array
+    type code or, if it is None, for arbitrary objects.
+    """
+    if numpy:
+        if code:
+            return numpy.fromiter(values, dtype=code)
+        values = list(values)
+        column = numpy.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    elif isinstance(values, array.array) and values.typecode == code:
+        return values
+    elif code:
+        return array.array(code, values)
+    else:
+        return list(values)
+
+
+def is_numeric(column):
+    """Check whether a column holds numbers in a typed array.
+    """
+    if numpy and isinstance(column, numpy.ndarray):
+        return column.dtype != object
+    return isinstance(column, array.array)
+
+
+def scalar(value):
+    """Convert a NumPy number to the plain Python value.
+    """
+    if numpy and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def _typecode_of(column):
+    if numpy and isinstance(column, numpy.ndarray):
+        return None if column.dtype == object else column.dtype.char
+    if isinstance(column, array.array):
+        return column.typecode
+    return None
+
+
+def _take(column, indices):
+    """Get a column with the values at the given positions.
+    """
+    if numpy and isinstance(column, numpy.ndarray):
+        return column[indices]
+    return make_column(_typecode_of(column), (column[i] for i in indices))
+
+
+def encode_value(value):
+    """Prepare a value from a column of objects to be stored as JSON.
+    Byte strings (i.e., paths) are base64-encoded so that they are not
+    confused with text.
+    """
+    if isinstance(value, (bytes, buffer)):
+        return {'bytes': base64.b64encode(bytes(value)).decode('ascii')}
+    return value
+
+
+def decode_value(obj):
+    """Convert a JSON object, written by `encode_value`, back to the
+    value it stands for.
+    """
+    if set(obj) != set(['bytes']):
+        raise ValueError('unknown object in snapshot')
+    return base64.b64decode(obj['bytes'])
+
+
+class Snapshot(object):
+    """The values of some fields for a set of objects, kept by column.
+
+    A snapshot is indexed by field name to get a column. It does not
+    follow later changes to the database.
+    """
+    def __init__(self, columns, key=None):
+        """Create a snapshot from a list of `(field, column)` pairs.
+        `key` identifies the query and state of the database that the
+        snapshot was made from, for caching.
+        """
+        self._columns = dict(columns)
+        self.fields = [field for field, _ in columns]
+        self.key = key
+
+    def __len__(self):
+        if not self.fields:
+            return 0
+        return len(self._columns[self.fields[0]])
+
+    def __getitem__(self, field):
+        return self._columns[field]
+
+    def __contains__(self, field):
+        return field in self._columns
+
+    def filter(self, mask):
+        """Get a snapshot with the rows for which `mask`, a sequence of
+        booleans as long as the snapshot, is true. With NumPy, a mask is
+        built from a comparison of columns, like ``snap['year'] > 2000``.
+        """
+        if numpy:
+            indices = numpy.flatnonzero(numpy.asarray(mask, dtype=bool))
+        else:
+            indices = list(itertools.compress(itertools.count(), mask))
+        return Snapshot([(field, _take(self._columns[field], indices))
+                         for field in self.fields])
+
+    def aggregate(self, group_by=(), **aggregates):
+        """Summarize the rows with `Aggregate` functions given as
+        keyword arguments, in the same way as `Results.aggregate`. All
+        the fields involved must be in the snapshot.
+        """
+        if group_by:
+            keys = zip(*[self._columns[field] for field in group_by])
+            groups = {}
+            for i, key in enumerate(keys):
+                groups.setdefault(tuple(scalar(v) for v in key), []).append(i)
+        else:
+            groups = {(): None}
+
+        out = []
+        for key in sorted(groups):
+            indices = groups[key]
+            values = dict(zip(group_by, key))
+            for name, agg in aggregates.items():
+                columns = [self._columns[field] for field in agg.fields]
+                if indices is None:
+                    size = len(self)
+                else:
+                    size = len(indices)
+                    columns = [_take(column, indices) for column in columns]
+                values[name] = scalar(agg.columnar(columns, size))
+            out.append(values)
+        return out
+
+    def save(self, path):
+        """Write the snapshot to a cache file: a line with a JSON
+        header followed by the columns. Numeric columns are stored as
+        raw arrays so that `load` can map them into memory; other
+        columns are stored as JSON lists.
+        """
+        header = {'key': self.key, 'length': len(self), 'columns': []}
+        chunks = []
+        offset = 0
+        for field in self.fields:
+            column = self._columns[field]
+            code = _typecode_of(column)
+            if code:
+                data = column.tostring()
+                itemsize = column.itemsize
+            else:
+                data = json.dumps([encode_value(v) for v in column],
+                                  separators=(',', ':')).encode('utf-8')
+                itemsize = None
+            # Keep the arrays aligned.
+            padding = -len(data) % 8
+            header['columns'].append((field, code, offset, len(data),
+                                      itemsize))
+            chunks.append(data + b'\0' * padding)
+            offset += len(data) + padding
+
+        tmp = path + (b'.tmp' if isinstance(path, bytes) else '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for chunk in chunks:
+                f.write(chunk)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows does not replace existing files.
+            os.remove(path)
+            os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """Read a snapshot from a cache file written by `save`. Return
+        None if the file is missing or unreadable, or if it was made for
+        another key. With NumPy, numeric columns are mapped into memory
+        rather than read.
+        """
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if header['key'] != key:
+                    return None
+                start = f.tell()
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            columns = []
+            for field, code, offset, size, itemsize in header['columns']:
+                offset += start
+                if code:
+                    code = code.encode('ascii')
+                    if array.array(code).itemsize != itemsize:
+                        return None
+                    if numpy:
+                        column = numpy.frombuffer(data, dtype=code,
+                                                  count=header['length'],
+                                                  offset=offset)
+                    else:
+                        column = array.array(code)
+                        column.fromstring(data[offset:offset + size])
+                else:
+                    values = json.loads(
+                        data[offset:offset + size].decode('utf-8'),
+                        object_hook=decode_value,
+                    )
+                    if not isinstance(values, list):
+                        return None
+                    column = make_column(None, values)
+                if len(column) != header['length']:
+                    return None
+                columns.append((field, column))
+            if not numpy:
+                data.close()
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        return cls(columns, key)
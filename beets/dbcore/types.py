@@ -96,8 +96,9 @@ class Type(object):
         http://www.sqlite.org/datatype3.html
         https://docs.python.org/2/library/sqlite3.html#sqlite-and-python-types
 
-        Flexible fields have the type afinity `TEXT`. This means the
-        `sql_value` is either a `buffer` or a `unicode` object` and the
+        Flexible fields have no type affinity: values of numeric types
+        are stored as numbers and all others as text. This means the
+        `sql_value` can also be a `buffer` or a `unicode` object and the
         method must handle these in addition.
         """
         if isinstance(sql_value, buffer):
@@ -47,11 +47,17 @@ action = Enum('action',
                'ALBUMS'])
 
 QUEUE_SIZE = 128
+IO_THREADS = 8
 SINGLE_ARTIST_THRESH = 0.25
 VARIOUS_ARTISTS = u'Various Artists'
 PROGRESS_KEY = 'tagprogress'
 HISTORY_KEY = 'taghistory'
 
+# Pipeline stages that always run in a single thread because they deal
+# with the user, the library or the file system one task at a time.
+SERIAL_STAGES = ('read_tasks', 'query_tasks', 'group_albums', 'user_query',
+                 'apply_choices', 'manipulate_files')
+
 # Global logger.
 log = logging.getLogger('beets')
 
@@ -188,6 +194,7 @@ class ImportSession(object):
         self.query = query
         self.seen_idents = set()
         self._is_resuming = dict()
+        self.stats = []
 
         # Normalize the paths.
         if self.paths:
@@ -279,46 +286,99 @@ class ImportSession(object):
         self.logger.info(u'import started {0}', time.asctime())
         self.set_config(config['import'])
 
-        # Set up the pipeline.
+        event_loop = config['threaded'].get(bool) and \
+            self.config['event_loop'].get(bool)
+
+        # Set up the pipeline as a list of named stages.
+        processes = self.config['processes'].get(int)
         if self.query is None:
-            stages = [read_tasks(self)]
+            stages = [('read_tasks', read_tasks(self))]
+            if processes:
+                # Read the tags in worker processes.
+                stages += [('read_files', pipeline.replicate([
+                    pipeline.process_stage(read_files)()
+                    for _ in range(processes)
+                ]))]
+            else:
+                stages += [('read_files', pipeline.stage(read_files)())]
+            stages += [('create_tasks', create_tasks(self))]
         else:
-            stages = [query_tasks(self)]
+            stages = [('query_tasks', query_tasks(self))]
 
         # In pretend mode, just log what would otherwise be imported.
         if self.config['pretend']:
-            stages += [log_files(self)]
+            stages += [('log_files', log_files(self))]
         else:
             if self.config['group_albums'] and \
                not self.config['singletons']:
                 # Split directory tasks into one task for each album.
-                stages += [group_albums(self)]
-
-            if self.config['autotag']:
-                stages += [lookup_candidates(self), user_query(self)]
+                stages += [('group_albums', group_albums(self))]
+
+            if self.config['autotag'] and event_loop:
+                stages += [('lookup_candidates',
+                            lookup_candidates_async(self)),
+                           ('user_query', user_query(self))]
+            elif self.config['autotag']:
+                stages += [('lookup_candidates',
+                            self.replicate('lookup_candidates',
+                                           lookup_candidates, self)),
+                           ('user_query', user_query(self))]
             else:
-                stages += [import_asis(self)]
+                stages += [('import_asis', import_asis(self))]
 
-            stages += [apply_choices(self)]
+            stages += [('apply_choices', apply_choices(self))]
 
-            # Plugin stages.
-            for stage_func in plugins.import_stages():
-                stages.append(plugin_stage(self, stage_func))
+            # Plugin stages, named after the plugin and the function so
+            # that stages from different plugins do not share a name.
+            for plugin in plugins.find_plugins():
+                for stage_func in plugin.get_import_stages():
+                    name = u'{0}.{1}'.format(
+                        plugin.name,
+                        getattr(stage_func, '__name__', 'plugin_stage'),
+                    )
+                    stages.append((name, self.replicate(name, plugin_stage,
+                                                        self, stage_func)))
+
+            stages += [('manipulate_files', manipulate_files(self))]
 
-            stages += [manipulate_files(self)]
+        names, stages = zip(*stages)
+        pl = pipeline.Pipeline(stages, names)
+        self.stats = pl.stats
 
-        pl = pipeline.Pipeline(stages)
+        # Start the worker processes before the pipeline's threads.
+        if processes:
+            pipeline.start_processes(processes)
 
         # Run the pipeline.
         plugins.send('import_begin', session=self)
         try:
-            if config['threaded']:
+            if event_loop:
+                pl.run_async(QUEUE_SIZE, IO_THREADS)
+            elif config['threaded']:
                 pl.run_parallel(QUEUE_SIZE)
             else:
                 pl.run_sequential()
         except ImportAbort:
             # User aborted operation. Silently stop.
             pass
+        finally:
+            pipeline.stop_processes()
+
+    def replicate(self, name, stage_func, *args):
+        """Make the coroutine for a pipeline stage by calling
+        `stage_func` with `args`. If the `workers` option asks for more
+        than one worker for the stage called `name`, make that many
+        coroutines and replicate the stage so that the tasks still leave
+        it in order.
+        """
+        workers = self.config['workers']
+        count = workers[name].get(int) if name in workers.keys() else 1
+        if count > 1 and name in SERIAL_STAGES:
+            log.warn(u'The {0} stage cannot run in several threads.', name)
+            count = 1
+        if count <= 1:
+            return stage_func(*args)
+        return pipeline.replicate([stage_func(*args) for _ in range(count)])
 
     # Incremental and resumed imports
 
@@ -634,7 +694,11 @@ class ImportTask(object):
         # Save the original paths of all items for deletion and pruning
         # in the next step (finalization).
         self.old_paths = [item.path for item in items]
-        for item in items:
+        if move or copy or link:
+            destinations = session.lib.destinations(items)
+        else:
+            destinations = ((item, None) for item in items)
+        for item, dest in destinations:
             if move or copy or link:
                 # In copy and link modes, treat re-imports specially:
                 # move in-library files. (Out-of-library files are
@@ -642,21 +706,19 @@ class ImportTask(object):
                 old_path = item.path
                 if (copy or link) and self.replaced_items[item] and \
                    session.lib.directory in util.ancestry(old_path):
-                    item.move()
+                    item.move(dest=dest)
                     # We moved the item, so remove the
                     # now-nonexistent file from old_paths.
                     self.old_paths.remove(old_path)
                 else:
                     # A normal import. Just copy files and keep track of
                     # old paths.
-                    item.move(copy, link)
+                    item.move(copy, link, dest=dest)
 
             if write and self.apply:
                 item.try_write()
 
-        with session.lib.transaction():
-            for item in self.imported_items():
-                item.store()
+        session.lib.store_many(self.imported_items())
 
         plugins.send('import_task_files', session=session, task=self)
 
@@ -710,6 +772,7 @@ class ImportTask(object):
                     displayable_path(self.album.path)
                 )
 
+        reimported_items = []
         for item in self.imported_items():
             dup_items = self.replaced_items[item]
             for dup_item in dup_items:
@@ -730,7 +793,9 @@ class ImportTask(object):
                     dup_item.id,
                     displayable_path(item.path)
                 )
-                item.store()
+            if dup_items:
+                reimported_items.append(item)
+        lib.store_many(reimported_items)
 
     def remove_replaced(self, lib):
         """Removes all the items from the library that have the same
@@ -975,9 +1040,47 @@ class ArchiveImportTask(SentinelImportTask):
         self.toppath = extract_to
 
 
+class ReadRequest(object):
+    """The media files for one import task, found by `read_tasks`. The
+    `read_files` stage reads them, possibly in a worker process, and
+    `create_tasks` then makes the task from the items.
+
+    `dirs` is None for a singleton; otherwise, it holds the directories
+    recorded as imported for the album.
+    """
+    def __init__(self, toppath, paths, dirs=None):
+        self.toppath = toppath
+        self.paths = paths
+        self.dirs = dirs
+        self.results = None  # The values returned by `_read_item`.
+
+    def task(self):
+        """Make the import task for the files that could be read, or
+        return None if there are none. The files that could not be read
+        are logged.
+        """
+        items = [_read_result(path, result)
+                 for path, result in zip(self.paths, self.results)]
+        items = [item for item in items if item]
+        if not items:
+            return None
+        elif self.dirs is None:
+            return SingletonImportTask(self.toppath, items[0])
+        else:
+            return ImportTask(self.toppath, self.dirs, items)
+
+
+class ToppathDone(object):
+    """Sent by `read_tasks` after the tasks for a top-level path, so
+    that `create_tasks` can tell when nothing was imported from it.
+    """
+    def __init__(self, toppath):
+        self.toppath = toppath
+
+
 class ImportTaskFactory(object):
-    """Generate album and singleton import tasks for all media files
-    indicated by a path.
+    """Generate the `ReadRequest`s for album and singleton import tasks
+    for all media files indicated by a path.
     """
     def __init__(self, toppath, session):
         """Create a new task factory.
@@ -989,18 +1092,16 @@ class ImportTaskFactory(object):
         self.toppath = toppath
         self.session = session
         self.skipped = 0  # Skipped due to incremental/resume.
-        self.imported = 0  # "Real" tasks created.
         self.is_archive = ArchiveImportTask.is_archive(syspath(toppath))
 
     def tasks(self):
-        """Yield all import tasks for music found in the user-specified
-        path `self.toppath`. Any necessary sentinel tasks are also
-        produced.
+        """Yield a `ReadRequest` for each task for music found in the
+        user-specified path `self.toppath`. Any necessary sentinel tasks
+        are also produced.
 
-        During generation, update `self.skipped` and `self.imported`
-        with the number of tasks that were not produced (due to
-        incremental mode or resumed imports) and the number of concrete
-        tasks actually produced, respectively.
+        During generation, update `self.skipped` with the number of
+        tasks that were not produced (due to incremental mode or
+        resumed imports).
 
         If `self.toppath` is an archive, it is adjusted to point to the
         extracted data.
@@ -1015,15 +1116,15 @@ class ImportTaskFactory(object):
         for dirs, paths in self.paths():
             if self.session.config['singletons']:
                 for path in paths:
-                    tasks = self._create(self.singleton(path))
-                    for task in tasks:
-                        yield task
+                    request = self.singleton(path)
+                    if request:
+                        yield request
                 yield self.sentinel(dirs)
 
             else:
-                tasks = self._create(self.album(paths, dirs))
-                for task in tasks:
-                    yield task
+                request = self.album(paths, dirs)
+                if request:
+                    yield request
 
         # Produce the final sentinel for this toppath to indicate that
         # it is finished. This is usually just a SentinelImportTask, but
@@ -1034,19 +1135,6 @@ class ImportTaskFactory(object):
         else:
             yield self.sentinel()
 
-    def _create(self, task):
-        """Handle a new task to be emitted by the factory.
-
-        Emit the `import_task_created` event and increment the
-        `imported` count if the task is not skipped. Return the same
-        task. If `task` is None, do nothing.
-        """
-        if task:
-            tasks = task.handle_created(self.session)
-            self.imported += len(tasks)
-            return tasks
-        return []
-
     def paths(self):
         """Walk `self.toppath` and yield `(dirs, files)` pairs where
         `files` are individual music files and `dirs` the set of
@@ -1068,7 +1156,8 @@ class ImportTaskFactory(object):
                 yield dirs, paths
 
     def singleton(self, path):
-        """Return a `SingletonImportTask` for the music file.
+        """Return a `ReadRequest` for a singleton task for the music
+        file.
         """
         if self.session.already_imported(self.toppath, [path]):
             log.debug(u'Skipping previously-imported path: {0}',
@@ -1076,14 +1165,11 @@ class ImportTaskFactory(object):
             self.skipped += 1
             return None
 
-        item = self.read_item(path)
-        if item:
-            return SingletonImportTask(self.toppath, item)
-        else:
-            return None
+        return ReadRequest(self.toppath, [path])
 
     def album(self, paths, dirs=None):
-        """Return a `ImportTask` with all media files from paths.
+        """Return a `ReadRequest` for an album task with all media files
+        from paths.
 
         `dirs` is a list of parent directories used to record already
         imported albums.
@@ -1100,13 +1186,7 @@ class ImportTaskFactory(object):
             self.skipped += 1
             return None
 
-        items = map(self.read_item, paths)
-        items = [item for item in items if item]
-
-        if items:
-            return ImportTask(self.toppath, dirs, items)
-        else:
-            return None
+        return ReadRequest(self.toppath, paths, dirs)
 
     def sentinel(self, paths=None):
         """Return a `SentinelImportTask` indicating the end of a
@@ -1143,31 +1223,47 @@ class ImportTaskFactory(object):
         log.debug(u'Archive extracted to: {0}', self.toppath)
         return archive_task
 
-    def read_item(self, path):
-        """Return an `Item` read from the path.
 
-        If an item cannot be read, return `None` instead and log an
-        error.
-        """
-        try:
-            return library.Item.from_path(path)
-        except library.ReadError as exc:
-            if isinstance(exc.reason, mediafile.FileTypeError):
-                # Silently ignore non-music files.
-                pass
-            elif isinstance(exc.reason, mediafile.UnreadableFileError):
-                log.warn(u'unreadable file: {0}', displayable_path(path))
-            else:
-                log.error(u'error reading {0}: {1}',
-                          displayable_path(path), exc)
+def _read_result(path, result):
+    """Get the item from the result of `_read_item`, or log the error
+    and return None.
+    """
+    if not isinstance(result, library.ReadError):
+        return result
+    if isinstance(result.reason, mediafile.FileTypeError):
+        # Silently ignore non-music files.
+        pass
+    elif isinstance(result.reason, mediafile.UnreadableFileError):
+        log.warn(u'unreadable file: {0}', displayable_path(path))
+    else:
+        log.error(u'error reading {0}: {1}',
+                  displayable_path(path), result)
+
+
+def _read_item(path):
+    """Read an `Item` from the path, or return the `ReadError` if it
+    cannot be read. Runs in a worker process with the `processes`
+    option, so the error is made picklable.
+    """
+    try:
+        return library.Item.from_path(path)
+    except library.ReadError as exc:
+        if isinstance(exc.reason, mediafile.FileTypeError):
+            reason = mediafile.FileTypeError(path)
+        elif isinstance(exc.reason, mediafile.UnreadableFileError):
+            reason = mediafile.UnreadableFileError(path)
+        else:
+            reason = unicode(exc.reason)
+        return library.ReadError(path, reason)
 
 
 # Full-album pipeline stages.
 
 def read_tasks(session):
-    """A generator yielding all the albums (as ImportTask objects) found
-    in the user-specified list of paths. In the case of a singleton
-    import, yields single-item tasks instead.
+    """A generator yielding the files of all the albums (as
+    `ReadRequest` objects) found in the user-specified list of paths. In
+    the case of a singleton import, yields requests for single items
+    instead. The tasks are made from them by `create_tasks`.
     """
     skipped = 0
     for toppath in session.paths:
@@ -1179,16 +1275,45 @@ def read_tasks(session):
         for t in task_factory.tasks():
             yield t
         skipped += task_factory.skipped
-
-        if not task_factory.imported:
-            log.warn(u'No files imported from {0}',
-                     displayable_path(toppath))
+        yield ToppathDone(toppath)
 
     # Show skipped directories (due to incremental/resume).
     if skipped:
         log.info(u'Skipped {0} paths.', skipped)
 
 
+def read_files(msg):
+    """Read the items for a `ReadRequest`; other messages are sent on
+    as they are. With the `processes` option, this runs as a process
+    stage, so the messages are copies.
+    """
+    if isinstance(msg, ReadRequest):
+        msg.results = [_read_item(path) for path in msg.paths]
+    return msg
+
+
+def create_tasks(session):
+    """A coroutine that makes the import tasks for the `ReadRequest`s
+    from `read_files` and emits the `import_task_created` event for
+    them. Sentinel tasks are sent on as they are.
+    """
+    imported = 0  # "Real" tasks created for the current toppath.
+    msg = None
+    while True:
+        msg = yield msg
+        if isinstance(msg, ReadRequest):
+            task = msg.task()
+            tasks = task.handle_created(session) if task else []
+            imported += len(tasks)
+            msg = pipeline.multiple(tasks)
+        elif isinstance(msg, ToppathDone):
+            if not imported:
+                log.warn(u'No files imported from {0}',
+                         displayable_path(msg.toppath))
+            imported = 0
+            msg = pipeline.BUBBLE
+
+
 def query_tasks(session):
     """A generator that works as a drop-in-replacement for read_tasks.
     Instead of finding files from the filesystem, a query is used to
@@ -1231,6 +1356,22 @@ def lookup_candidates(session, task):
         # abstraction.
         return
 
+    _lookup_candidates(session, task)
+
+
+@pipeline.async_stage
+def lookup_candidates_async(session, task):
+    """Like `lookup_candidates`, but waits for the lookup in an I/O
+    thread so that `Pipeline.run_async` can look up several albums at
+    once.
+    """
+    if task.skip:
+        return
+
+    yield pipeline.call(_lookup_candidates, session, task)
+
+
+def _lookup_candidates(session, task):
     plugins.send('import_task_start', session=session, task=task)
     log.debug(u'Looking up: {0}', displayable_path(task.paths))
     task.lookup_candidates()
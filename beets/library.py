@@ -23,6 +23,7 @@ import shlex
 import unicodedata
 import time
 import re
+import threading
 from unidecode import unidecode
 import platform
 
@@ -34,6 +35,7 @@ from beets.util import bytestring_path, syspath, normpath, samefile
 from beets.util.functemplate import Template
 from beets import dbcore
 from beets.dbcore import types
+from beets.dbcore.aggregate import Count, CountDistinct
 import beets
 
 
@@ -50,9 +52,6 @@ class PathQuery(dbcore.FieldQuery):
     and case-sensitive otherwise.
     """
 
-    escape_re = re.compile(r'[\\_%]')
-    escape_char = b'\\'
-
     def __init__(self, field, pattern, fast=True, case_sensitive=None):
         """Create a path query.
 
@@ -93,17 +92,18 @@ class PathQuery(dbcore.FieldQuery):
 
     def col_clause(self):
         file_blob = buffer(self.file_path)
+        dir_blob = buffer(self.dir_path)
 
         if self.case_sensitive:
-            dir_blob = buffer(self.dir_path)
-            return '({0} = ?) || (substr({0}, 1, ?) = ?)'.format(self.field), \
-                   (file_blob, len(dir_blob), dir_blob)
+            path = self.field
+        else:
+            # Like `bytes.lower()`, SQLite's `lower()` only folds ASCII
+            # characters. Cast the result back to a blob so it compares
+            # equal to our (blob) patterns.
+            path = 'CAST(lower({0}) AS BLOB)'.format(self.field)
 
-        escape = lambda m: self.escape_char + m.group(0)
-        dir_pattern = self.escape_re.sub(escape, self.dir_path)
-        dir_blob = buffer(dir_pattern + b'%')
-        return '({0} = ?) || ({0} LIKE ? ESCAPE ?)'.format(self.field), \
-               (file_blob, dir_blob, self.escape_char)
+        return '({0} = ?) OR (substr({0}, 1, ?) = ?)'.format(path), \
+               (file_blob, len(dir_blob), dir_blob)
 
 
 # Library-specific field types.
@@ -202,13 +202,19 @@ class SmartArtistSort(dbcore.query.Sort):
         self.ascending = ascending
         self.case_insensitive = case_insensitive
 
-    def order_clause(self):
-        order = "ASC" if self.ascending else "DESC"
+    def index_clause(self):
+        # The sort name, or the name itself if there is none. SQLite
+        # keeps this precomputed in an index, so sorted listings are
+        # read in order instead of being sorted first.
         field = 'albumartist' if self.album else 'artist'
         collate = 'COLLATE NOCASE' if self.case_insensitive else ''
-        return ('(CASE {0}_sort WHEN NULL THEN {0} '
-                'WHEN "" THEN {0} '
-                'ELSE {0}_sort END) {1} {2}').format(field, collate, order)
+        return ("(CASE {0}_sort WHEN NULL THEN {0} "
+                "WHEN '' THEN {0} "
+                "ELSE {0}_sort END) {1}").format(field, collate).strip()
+
+    def order_clause(self):
+        order = "ASC" if self.ascending else "DESC"
+        return '{0} {1}'.format(self.index_clause(), order)
 
     def sort(self, objs):
         if self.album:
@@ -284,18 +290,10 @@ class LibModel(dbcore.Model):
         funcs.update(plugins.template_funcs())
         return funcs
 
-    def store(self):
-        super(LibModel, self).store()
-        plugins.send('database_change', lib=self._db, model=self)
-
     def remove(self):
         super(LibModel, self).remove()
         plugins.send('database_change', lib=self._db, model=self)
 
-    def add(self, lib=None):
-        super(LibModel, self).add(lib)
-        plugins.send('database_change', lib=self._db, model=self)
-
     def __format__(self, spec):
         if not spec:
             spec = beets.config[self._format_config_key].get(unicode)
@@ -319,9 +317,12 @@ class FormattedItemMapping(dbcore.db.FormattedMapping):
     Album-level fields take precedence if `for_path` is true.
     """
 
-    def __init__(self, item, for_path=False):
+    def __init__(self, item, for_path=False, album=None):
+        """Create the mapping for `item`. `album` is the item's album if
+        the caller already has it; otherwise it is looked up.
+        """
         super(FormattedItemMapping, self).__init__(item, for_path)
-        self.album = item.get_album()
+        self.album = album or item.get_album()
         self.album_keys = []
         if self.album:
             for key in self.album.keys(True):
@@ -434,6 +435,9 @@ class Item(LibModel):
 
     _search_fields = ('artist', 'title', 'comments',
                       'album', 'albumartist', 'genre')
+    _search_table = 'items_search'
+
+    _indices = ('album_id', 'path', 'mb_trackid', ('artist', 'title'))
 
     _types = {
         'data_source': types.STRING,
@@ -688,12 +692,16 @@ class Item(LibModel):
 
         self._db._memotable = {}
 
-    def move(self, copy=False, link=False, basedir=None, with_album=True):
+    def move(self, copy=False, link=False, basedir=None, with_album=True,
+             dest=None):
         """Move the item to its designated location within the library
         directory (provided by destination()). Subdirectories are
         created as needed. If the operation succeeds, the item's path
         field is updated to reflect the new location.
 
+        `dest` is the destination if it has already been computed, for
+        example with `Library.destinations`.
+
         If `copy` is true, moving the file is copied rather than moved.
         Similarly, `link` creates a symlink instead.
 
@@ -710,7 +718,8 @@ class Item(LibModel):
         transaction.
         """
         self._check_db()
-        dest = self.destination(basedir=basedir)
+        if dest is None:
+            dest = self.destination(basedir=basedir)
 
         # Create necessary ancestry for the move.
         util.mkdirall(dest)
@@ -743,69 +752,9 @@ class Item(LibModel):
         directory for the destination.
         """
         self._check_db()
-        platform = platform or sys.platform
-        basedir = basedir or self._db.directory
-        path_formats = path_formats or self._db.path_formats
-
-        # Use a path format based on a query, falling back on the
-        # default.
-        for query, path_format in path_formats:
-            if query == PF_KEY_DEFAULT:
-                continue
-            query, _ = parse_query_string(query, type(self))
-            if query.match(self):
-                # The query matches the item! Use the corresponding path
-                # format.
-                break
-        else:
-            # No query matched; fall back to default.
-            for query, path_format in path_formats:
-                if query == PF_KEY_DEFAULT:
-                    break
-            else:
-                assert False, "no default path format"
-        if isinstance(path_format, Template):
-            subpath_tmpl = path_format
-        else:
-            subpath_tmpl = Template(path_format)
-
-        # Evaluate the selected template.
-        subpath = self.evaluate_template(subpath_tmpl, True)
-
-        # Prepare path for output: normalize Unicode characters.
-        if platform == 'darwin':
-            subpath = unicodedata.normalize('NFD', subpath)
-        else:
-            subpath = unicodedata.normalize('NFC', subpath)
-
-        if beets.config['asciify_paths']:
-            subpath = unidecode(subpath)
-
-        # Truncate components and remove forbidden characters.
-        subpath = util.sanitize_path(subpath, self._db.replacements)
-
-        # Encode for the filesystem.
-        if not fragment:
-            subpath = bytestring_path(subpath)
-
-        # Preserve extension.
-        _, extension = os.path.splitext(self.path)
-        if fragment:
-            # Outputting Unicode.
-            extension = extension.decode('utf8', 'ignore')
-        subpath += extension.lower()
-
-        # Truncate too-long components.
-        maxlen = beets.config['max_filename_length'].get(int)
-        if not maxlen:
-            # When zero, try to determine from filesystem.
-            maxlen = util.max_filename_length(self._db.directory)
-        subpath = util.truncate_path(subpath, maxlen)
-
-        if fragment:
-            return subpath
-        else:
-            return normpath(os.path.join(basedir, subpath))
+        formatter = PathFormatter(self._db, fragment, basedir, platform,
+                                  path_formats)
+        return formatter.destination(self)
 
 
 class Album(LibModel):
@@ -851,6 +800,9 @@ class Album(LibModel):
     }
 
     _search_fields = ('album', 'albumartist', 'genre')
+    _search_table = 'albums_search'
+
+    _indices = ('mb_albumid', ('albumartist', 'album'))
 
     _types = {
         'path':        PathType(),
@@ -975,8 +927,9 @@ class Album(LibModel):
 
         # Move items.
         items = list(self.items())
-        for item in items:
-            item.move(copy, link, basedir=basedir, with_album=False)
+        for item, dest in self._db.destinations(items, basedir=basedir):
+            item.move(copy, link, basedir=basedir, with_album=False,
+                      dest=dest)
 
         # Move art.
         self.move_art(copy, link)
@@ -1068,23 +1021,19 @@ class Album(LibModel):
 
         plugins.send('art_set', album=self)
 
-    def store(self):
-        """Update the database with the album information. The album's
-        tracks are also updated.
+    def _track_updates(self):
+        """Get the modified track-level fields of this album (e.g.,
+        `albumartist`) and their values, which its items must match.
         """
-        # Get modified track fields.
         track_updates = {}
         for key in self.item_keys:
             if key in self._dirty:
                 track_updates[key] = self[key]
-
-        with self._db.transaction():
-            super(Album, self).store()
-            if track_updates:
-                for item in self.items():
-                    for key, value in track_updates.items():
-                        item[key] = value
-                    item.store()
+        # As with `Item.__setitem__`, a change to a tag marks the file
+        # as out of date.
+        if any(key in MediaFile.fields() for key in track_updates):
+            track_updates['mtime'] = 0
+        return track_updates
 
     def try_sync(self, write=True):
         """Synchronize the album and its items with the database and
@@ -1158,21 +1107,25 @@ class Library(dbcore.Database):
     """A database of music containing songs and albums.
     """
     _models = (Item, Album)
+    _journal_table = 'changes'
 
     def __init__(self, path='library.blb',
                  directory='~/Music',
                  path_formats=((PF_KEY_DEFAULT,
                                '$artist/$album/$track $title'),),
-                 replacements=None):
+                 replacements=None, concurrent=False, cache_size=0,
+                 journal_size=0):
         if path != ':memory:':
             self.path = bytestring_path(normpath(path))
-        super(Library, self).__init__(path)
+        super(Library, self).__init__(path, concurrent, cache_size,
+                                      journal_size)
 
         self.directory = bytestring_path(normpath(directory))
         self.path_formats = path_formats
         self.replacements = replacements
 
         self._memotable = {}  # Used for template substitution performance.
+        self._aunique_indices = {}
 
     # Adding objects to the database.
 
@@ -1202,18 +1155,49 @@ class Library(dbcore.Database):
         # Store or add the items.
         with self.transaction():
             album.add(self)
+            new_items = [item for item in items if item.id is None]
+            old_items = [item for item in items if item.id is not None]
             for item in items:
                 item.album_id = album.id
-                if item.id is None:
-                    item.add(self)
-                else:
-                    item.store()
+            self.add_many(new_items)
+            self.store_many(old_items)
 
         return album
 
+    def store_many(self, objs):
+        """Save the changes to several items and albums in a single
+        transaction. When an album's track-level fields have changed,
+        its tracks are also updated.
+        """
+        objs = list(objs)
+        track_updates = []
+        for obj in objs:
+            if isinstance(obj, Album):
+                values = obj._track_updates()
+                if values:
+                    track_updates.append((obj.id, values))
+
+        with self.transaction():
+            super(Library, self).store_many(objs)
+            # Each album's tracks are updated with a single statement.
+            for album_id, values in track_updates:
+                self.store_matching(
+                    Item, dbcore.MatchQuery('album_id', album_id), values
+                )
+
+        for obj in objs:
+            plugins.send('database_change', lib=self, model=obj)
+        # Only load the updated tracks if a plugin wants to see them.
+        if track_updates and plugins.event_handlers()['database_change']:
+            for album_id, _ in track_updates:
+                for item in self.items(dbcore.MatchQuery('album_id',
+                                                         album_id)):
+                    plugins.send('database_change', lib=self, model=item)
+
     # Querying.
 
-    def _fetch(self, model_cls, query, sort=None):
+    def _fetch(self, model_cls, query, sort=None, limit=None, offset=None,
+               after=None):
         """Parse a query and fetch. If a order specification is present
         in the query string the `sort` argument is ignored.
         """
@@ -1233,7 +1217,7 @@ class Library(dbcore.Database):
             sort = parsed_sort
 
         return super(Library, self)._fetch(
-            model_cls, query, sort
+            model_cls, query, sort, limit, offset, after
         )
 
     @staticmethod
@@ -1250,15 +1234,37 @@ class Library(dbcore.Database):
         return dbcore.sort_from_strings(
             Item, beets.config['sort_item'].as_str_seq())
 
-    def albums(self, query=None, sort=None):
+    def albums(self, query=None, sort=None, limit=None, offset=None,
+               after=None):
         """Get :class:`Album` objects matching the query.
+
+        `limit` and `offset` select a slice of the results. Alternatively,
+        `after` selects the albums whose id is greater than the given
+        one, ordered by id, for keyset pagination.
         """
-        return self._fetch(Album, query, sort or self.get_default_album_sort())
+        if after is None:
+            sort = sort or self.get_default_album_sort()
+        return self._fetch(Album, query, sort, limit, offset, after)
 
-    def items(self, query=None, sort=None):
+    def items(self, query=None, sort=None, limit=None, offset=None,
+              after=None):
         """Get :class:`Item` objects matching the query.
+
+        `limit` and `offset` select a slice of the results. Alternatively,
+        `after` selects the items whose id is greater than the given one,
+        ordered by id, for keyset pagination.
+        """
+        if after is None:
+            sort = sort or self.get_default_item_sort()
+        return self._fetch(Item, query, sort, limit, offset, after)
+
+    def snapshot(self, fields, query=None, cache=None):
+        """Get a columnar :class:`dbcore.snapshot.Snapshot` with the
+        values of `fields` for the items matching the query. `cache` is
+        an optional path to a file that keeps the snapshot between
+        calls (see `Results.snapshot`).
         """
-        return self._fetch(Item, query, sort or self.get_default_item_sort())
+        return self._fetch(Item, query).snapshot(fields, cache)
 
     # Convenience accessors.
 
@@ -1281,9 +1287,230 @@ class Library(dbcore.Database):
             return None
         return self._get(Album, album_id)
 
+    def destinations(self, items, fragment=False, basedir=None,
+                     platform=None, path_formats=None):
+        """Generate `(item, destination)` pairs for an iterable of
+        items, with the same arguments as :meth:`Item.destination`. The
+        path formats and settings are only prepared once, which makes
+        this faster than calling `destination` for each item.
+        """
+        formatter = PathFormatter(self, fragment, basedir, platform,
+                                  path_formats)
+        for item in items:
+            yield item, formatter.destination(item)
+
+    def _aunique_index(self, keys, disam):
+        """Get the `AuniqueIndex` for the given key and disambiguator
+        fields, creating it if necessary.
+        """
+        index = self._aunique_indices.get((keys, disam))
+        if index is None:
+            index = AuniqueIndex(self, keys, disam)
+            self._aunique_indices[(keys, disam)] = index
+        return index
+
 
 # Default path template resources.
 
+class PathFormatter(object):
+    """Computes the destinations of items in a library's directory
+    (see :meth:`Item.destination` for the arguments).
+
+    The path format queries and templates are parsed, and the settings
+    read, once when the formatter is created. Consecutive items from the
+    same album share a single lookup of the album.
+    """
+    def __init__(self, lib, fragment=False, basedir=None, platform=None,
+                 path_formats=None):
+        self.lib = lib
+        self.fragment = fragment
+        self.basedir = basedir or lib.directory
+
+        platform = platform or sys.platform
+        self.normal_form = 'NFD' if platform == 'darwin' else 'NFC'
+        self.asciify = bool(beets.config['asciify_paths'])
+        self.maxlen = beets.config['max_filename_length'].get(int)
+        if not self.maxlen:
+            # When zero, try to determine from filesystem.
+            self.maxlen = util.max_filename_length(lib.directory)
+
+        # The path formats based on a query, in order, and the default.
+        self.formats = []
+        self.default = None
+        for query, path_format in path_formats or lib.path_formats:
+            if not isinstance(path_format, Template):
+                path_format = Template(path_format)
+            if query != PF_KEY_DEFAULT:
+                query, _ = parse_query_string(query, Item)
+                self.formats.append((query, path_format))
+            elif self.default is None:
+                self.default = path_format
+
+        self.template_funcs = plugins.template_funcs()
+        self._album = None
+
+    def _get_album(self, item):
+        """Get the album of an item, reusing the previous item's album
+        if it is the same.
+        """
+        if item.album_id is None:
+            return None
+        if self._album is None or self._album.id != item.album_id:
+            self._album = item.get_album()
+        return self._album
+
+    def destination(self, item):
+        """Get the destination of an item.
+        """
+        # Use a path format based on a query, falling back on the
+        # default.
+        for query, subpath_tmpl in self.formats:
+            if query.match(item):
+                # The query matches the item! Use the corresponding path
+                # format.
+                break
+        else:
+            # No query matched; fall back to default.
+            assert self.default is not None, "no default path format"
+            subpath_tmpl = self.default
+
+        # Evaluate the selected template.
+        funcs = DefaultTemplateFunctions(item, self.lib).functions()
+        funcs.update(self.template_funcs)
+        subpath = subpath_tmpl.substitute(
+            FormattedItemMapping(item, True, self._get_album(item)), funcs
+        )
+
+        # Prepare path for output: normalize Unicode characters.
+        subpath = unicodedata.normalize(self.normal_form, subpath)
+
+        if self.asciify:
+            subpath = unidecode(subpath)
+
+        # Truncate components and remove forbidden characters.
+        subpath = util.sanitize_path(subpath, self.lib.replacements)
+
+        # Encode for the filesystem.
+        if not self.fragment:
+            subpath = bytestring_path(subpath)
+
+        # Preserve extension.
+        _, extension = os.path.splitext(item.path)
+        if self.fragment:
+            # Outputting Unicode.
+            extension = extension.decode('utf8', 'ignore')
+        subpath += extension.lower()
+
+        # Truncate too-long components.
+        subpath = util.truncate_path(subpath, self.maxlen)
+
+        if self.fragment:
+            return subpath
+        else:
+            return normpath(os.path.join(self.basedir, subpath))
+
+
+class AuniqueIndex(object):
+    """The information that `%aunique{}` needs to disambiguate albums:
+    for each combination of values of the `keys` fields, the number of
+    albums that share it and the number of distinct values of each
+    `disam` field among them.
+
+    The whole index is built with one grouped query on first use. When
+    albums change afterwards, in this process or another one, only the
+    groups of the changed albums are dropped (according to the library's
+    change journal) and queried again when they are next needed. Like
+    the journal, the index does not see writes that bypass the models.
+    """
+    def __init__(self, lib, keys, disam):
+        self.lib = lib
+        self.keys = keys
+        self.disam = disam
+        self._fields = set(keys) | set(disam)
+        self._groups = {}  # Key values -> (count, distinct counts).
+        self._album_keys = {}  # Album id -> key values.
+        self._seq = None  # Last journal entry seen, if built.
+        self._lock = threading.Lock()
+
+    def _aggregates(self):
+        aggregates = {'count': Count()}
+        for i, field in enumerate(self.disam):
+            aggregates['disam{0}'.format(i)] = CountDistinct(field)
+        return aggregates
+
+    def _stats(self, row):
+        return row['count'], [row['disam{0}'.format(i)]
+                              for i in range(len(self.disam))]
+
+    def _key(self, album):
+        return tuple(album.get(key) for key in self.keys)
+
+    def _build(self):
+        """Load the whole index.
+        """
+        self._seq = self.lib.last_change()
+        albums = self.lib._fetch(Album, None)
+        self._groups = {}
+        for row in albums.aggregate(self.keys, **self._aggregates()):
+            key = tuple(row[field] for field in self.keys)
+            self._groups[key] = self._stats(row)
+        snapshot = albums.snapshot(['id'] + list(self.keys))
+        self._album_keys = dict(zip(
+            snapshot['id'], zip(*[snapshot[field] for field in self.keys])
+        ))
+
+    def _update(self):
+        """Drop the groups that albums have left or joined since the
+        index was loaded or last updated.
+        """
+        changes = self.lib.changes_since(self._seq)
+        if not changes or changes[0].seq > self._seq + 1:
+            # The journal has been pruned since, so the changes are
+            # unknown.
+            self._seq = None
+            return
+        self._seq = changes[-1].seq
+
+        for change in changes:
+            if change.model is not Album:
+                continue
+            if change.op == 'store' and self._fields.isdisjoint(change.keys):
+                continue
+            old_key = self._album_keys.pop(change.id, None)
+            if old_key is not None:
+                self._groups.pop(old_key, None)
+            if change.op != 'remove':
+                album = self.lib.get_album(change.id)
+                if album:
+                    key = self._key(album)
+                    self._groups.pop(key, None)
+                    self._album_keys[change.id] = key
+
+    def get(self, album):
+        """Get the number of albums that share the key values of
+        `album` and a list with the number of distinct values of each
+        disambiguation field among them.
+        """
+        with self._lock:
+            if self._seq is not None and \
+                    self.lib.last_change() != self._seq:
+                self._update()
+            if self._seq is None:
+                self._build()
+
+            key = self._key(album)
+            stats = self._groups.get(key)
+            if stats is None:
+                query = dbcore.AndQuery([dbcore.MatchQuery(field, value)
+                                         for field, value
+                                         in zip(self.keys, key)])
+                row = self.lib._fetch(Album, query).aggregate(
+                    **self._aggregates()
+                )[0]
+                stats = self._groups[key] = self._stats(row)
+            return stats
+
+
 def _int_arg(s):
     """Convert a string argument to an integer for use in a template
     function.  May raise a ValueError.
@@ -1386,15 +1613,16 @@ class DefaultTemplateFunctions(object):
             return u''
         if self.item.album_id is None:
             return u''
-        memokey = ('aunique', keys, disam, self.item.album_id)
+        memokey = ('aunique', keys, disam, self.item.album_id,
+                   self.lib._cache_generations[Album])
         memoval = self.lib._memotable.get(memokey)
         if memoval is not None:
             return memoval
 
         keys = keys or 'albumartist album'
         disam = disam or 'albumtype year label catalognum albumdisambig'
-        keys = keys.split()
-        disam = disam.split()
+        keys = tuple(keys.split())
+        disam = tuple(disam.split())
 
         album = self.lib.get_album(self.item)
         if not album:
@@ -1402,28 +1630,22 @@ class DefaultTemplateFunctions(object):
             self.lib._memotable[memokey] = u''
             return u''
 
-        # Find matching albums to disambiguate with.
-        subqueries = []
-        for key in keys:
-            value = getattr(album, key)
-            subqueries.append(dbcore.MatchQuery(key, value))
-        albums = self.lib.albums(dbcore.AndQuery(subqueries))
+        # Count the albums matching these details and the distinct values
+        # of each disambiguator among them.
+        count, distinct = self.lib._aunique_index(keys, disam).get(album)
 
         # If there's only one album to matching these details, then do
         # nothing.
-        if len(albums) == 1:
+        if count == 1:
             self.lib._memotable[memokey] = u''
             return u''
 
         # Find the first disambiguator that distinguishes the albums.
-        for disambiguator in disam:
-            # Get the value for each album for the current field.
-            disam_values = set([getattr(a, disambiguator) for a in albums])
-
-            # If the set of unique values is equal to the number of
+        for disambiguator, disam_count in zip(disam, distinct):
+            # If the number of unique values is equal to the number of
             # albums in the disambiguation set, we're done -- this is
             # sufficient disambiguation.
-            if len(disam_values) == len(albums):
+            if disam_count == count:
                 break
 
         else:
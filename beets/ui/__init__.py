@@ -29,6 +29,7 @@ import sqlite3
 import errno
 import re
 import struct
+import time
 import traceback
 import os.path
 
@@ -974,11 +975,13 @@ def _setup(options, lib=None):
     subcommands = list(default_commands)
     subcommands.extend(plugins.commands())
 
+    # The library's schema depends on the types of flexible attributes.
+    library.Item._types.update(plugins.types(library.Item))
+    library.Album._types.update(plugins.types(library.Album))
+
     if lib is None:
         lib = _open_library(config)
         plugins.send("library_opened", lib=lib)
-    library.Item._types.update(plugins.types(library.Item))
-    library.Album._types.update(plugins.types(library.Album))
 
     return subcommands, plugins, lib
 
@@ -1038,13 +1041,21 @@ def _open_library(config):
     """
     dbpath = config['library'].as_filename()
     try:
+        start = time.time()
         lib = library.Library(
             dbpath,
             config['directory'].as_filename(),
             get_path_formats(),
             get_replacements(),
+            config['concurrent_reads'].get(bool),
+            config['model_cache_size'].get(int),
+            config['journal_size'].get(int),
         )
+        lib.log_query_plans = config['log_query_plans'].get(bool)
+        lib.compact_models = config['compact_models'].get(bool)
+        opened = time.time()
         lib.get_item(0)  # Test database connection.
+        tested = time.time()
     except (sqlite3.OperationalError, sqlite3.DatabaseError):
         log.debug(traceback.format_exc())
         raise UserError(u"database file {0} could not be opened".format(
@@ -1054,6 +1065,9 @@ def _open_library(config):
               u'library directory: {1}',
               util.displayable_path(lib.path),
               util.displayable_path(lib.directory))
+    log.debug(u'library opened in {0:.3f} seconds '
+              u'(setup {1:.3f}, first query {2:.3f})',
+              tested - start, opened - start, tested - opened)
     return lib
 
 
@@ -21,6 +21,7 @@ from __future__ import (division, absolute_import, print_function,
 
 import os
 import re
+import json
 
 import beets
 from beets import ui
@@ -36,9 +37,14 @@ from beets import library
 from beets import config
 from beets import logging
 from beets.util.confit import _package_path
+from beets.dbcore.aggregate import Count, CountDistinct, Sum
 
 VARIOUS_ARTISTS = u'Various Artists'
 
+# The number of changed items that `update` and `modify` save to the
+# database at once.
+STORE_BATCH_SIZE = 128
+
 # Global logger.
 log = logging.getLogger('beets')
 
@@ -871,6 +877,22 @@ def import_files(lib, paths, query):
 
     # Emit event.
     plugins.send('import', lib=lib, paths=paths)
+    return session
+
+
+def show_pipeline_stats(stats):
+    """Print a table of the import pipeline's `StageStats`: for each
+    stage, the messages it handled, the seconds it spent working and
+    blocked on its input and output queues, and its longest input queue.
+    """
+    print_(u'{0:<20} {1:>8} {2:>9} {3:>9} {4:>9} {5:>6}'.format(
+        u'stage', u'tasks', u'busy', u'input', u'output', u'queue'
+    ))
+    for stage in stats:
+        print_(u'{0:<20} {1:>8} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>6}'.format(
+            stage.name, stage.messages, stage.busy, stage.input_wait,
+            stage.output_wait, stage.peak_queue
+        ))
 
 
 def import_func(lib, opts, args):
@@ -890,7 +912,17 @@ def import_func(lib, opts, args):
         if not paths:
             raise ui.UserError('no path specified')
 
-    import_files(lib, paths, query)
+    session = import_files(lib, paths, query)
+
+    if opts.stats:
+        show_pipeline_stats(session.stats)
+    if opts.stats_file:
+        try:
+            with open(syspath(normpath(opts.stats_file)), 'w') as f:
+                json.dump([stage.as_dict() for stage in session.stats], f,
+                          indent=4)
+        except IOError as exc:
+            raise ui.UserError(u'could not write stats: {0}'.format(exc))
 
 
 import_cmd = ui.Subcommand(
@@ -968,6 +1000,14 @@ import_cmd.parser.add_option(
     '--pretend', dest='pretend', action='store_true',
     help='just print the files to import'
 )
+import_cmd.parser.add_option(
+    '--stats', dest='stats', action='store_true',
+    help='show the time spent in each import stage'
+)
+import_cmd.parser.add_option(
+    '--stats-file', dest='stats_file', metavar='PATH',
+    help='write the time spent in each import stage to a JSON file'
+)
 import_cmd.func = import_func
 default_commands.append(import_cmd)
 
@@ -979,10 +1019,10 @@ def list_items(lib, query, album, fmt=''):
     albums instead of single items.
     """
     if album:
-        for album in lib.albums(query):
+        for album in lib.albums(query).stream():
             ui.print_(format(album, fmt))
     else:
-        for item in lib.items(query):
+        for item in lib.items(query).stream():
             ui.print_(format(item, fmt))
 
 
@@ -996,8 +1036,78 @@ list_cmd.func = list_func
 default_commands.append(list_cmd)
 
 
+def _store_batch(lib, batch):
+    """Save the objects collected in the list `batch` to the database
+    and empty it.
+    """
+    lib.store_many(batch)
+    del batch[:]
+
+
 # update: Update library contents according to on-disk tags.
 
+def _update_read_items(lib, items, move, pretend, affected_albums,
+                       read_items):
+    """Pick up the changes to the items' files for `update_items`.
+    Items whose data was read are collected in `read_items` and saved
+    in batches; the ids of the albums of changed items are added to
+    `affected_albums`.
+    """
+    for item in items:
+        # Item deleted?
+        if not os.path.exists(syspath(item.path)):
+            ui.print_(format(item))
+            ui.print_(ui.colorize('text_error', u'  deleted'))
+            if not pretend:
+                item.remove(True)
+            affected_albums.add(item.album_id)
+            continue
+
+        # Did the item change since last checked?
+        if item.current_mtime() <= item.mtime:
+            log.debug(u'skipping {0} because mtime is up to date ({1})',
+                      displayable_path(item.path), item.mtime)
+            continue
+
+        # Read new data.
+        try:
+            item.read()
+        except library.ReadError as exc:
+            log.error(u'error reading {0}: {1}',
+                      displayable_path(item.path), exc)
+            continue
+
+        # Special-case album artist when it matches track artist. (Hacky
+        # but necessary for preserving album-level metadata for non-
+        # autotagged imports.)
+        if not item.albumartist:
+            old_item = lib.get_item(item.id)
+            if old_item.albumartist == old_item.artist == item.artist:
+                item.albumartist = old_item.albumartist
+                item.clear_dirty('albumartist')
+
+        # Check for and display changes.
+        changed = ui.show_model_changes(item,
+                                        fields=library.Item._media_fields)
+
+        # Save changes.
+        if not pretend:
+            if changed:
+                # Move the item if it's in the library.
+                if move and lib.directory in ancestry(item.path):
+                    item.move()
+
+                affected_albums.add(item.album_id)
+
+            # If there were no changes to the metadata, the file's
+            # mtime was still different. Store the new mtime, which
+            # is set in the call to read(), so we don't check this
+            # again in the future.
+            read_items.append(item)
+            if len(read_items) >= STORE_BATCH_SIZE:
+                _store_batch(lib, read_items)
+
+
 def update_items(lib, query, album, move, pretend):
     """For all the items matched by the query, update the library to
     reflect the item's embedded tags.
@@ -1007,58 +1117,15 @@ def update_items(lib, query, album, move, pretend):
 
         # Walk through the items and pick up their changes.
         affected_albums = set()
-        for item in items:
-            # Item deleted?
-            if not os.path.exists(syspath(item.path)):
-                ui.print_(format(item))
-                ui.print_(ui.colorize('text_error', u'  deleted'))
-                if not pretend:
-                    item.remove(True)
-                affected_albums.add(item.album_id)
-                continue
-
-            # Did the item change since last checked?
-            if item.current_mtime() <= item.mtime:
-                log.debug(u'skipping {0} because mtime is up to date ({1})',
-                          displayable_path(item.path), item.mtime)
-                continue
-
-            # Read new data.
-            try:
-                item.read()
-            except library.ReadError as exc:
-                log.error(u'error reading {0}: {1}',
-                          displayable_path(item.path), exc)
-                continue
-
-            # Special-case album artist when it matches track artist. (Hacky
-            # but necessary for preserving album-level metadata for non-
-            # autotagged imports.)
-            if not item.albumartist:
-                old_item = lib.get_item(item.id)
-                if old_item.albumartist == old_item.artist == item.artist:
-                    item.albumartist = old_item.albumartist
-                    item._dirty.discard('albumartist')
-
-            # Check for and display changes.
-            changed = ui.show_model_changes(item,
-                                            fields=library.Item._media_fields)
-
-            # Save changes.
-            if not pretend:
-                if changed:
-                    # Move the item if it's in the library.
-                    if move and lib.directory in ancestry(item.path):
-                        item.move()
-
-                    item.store()
-                    affected_albums.add(item.album_id)
-                else:
-                    # The file's mtime was different, but there were no
-                    # changes to the metadata. Store the new mtime,
-                    # which is set in the call to read(), so we don't
-                    # check this again in the future.
-                    item.store()
+        read_items = []
+        try:
+            _update_read_items(lib, items, move, pretend, affected_albums,
+                               read_items)
+        finally:
+            # Record the items read so far, even if the loop was
+            # interrupted.
+            if read_items:
+                _store_batch(lib, read_items)
 
         # Skip album changes while pretending.
         if pretend:
@@ -1160,25 +1227,22 @@ default_commands.append(remove_cmd)
 def show_stats(lib, query, exact):
     """Shows some statistics about the matched items."""
     items = lib.items(query)
-
-    total_size = 0
-    total_time = 0.0
-    total_items = 0
-    artists = set()
-    albums = set()
-    album_artists = set()
-
-    for item in items:
-        if exact:
+    stats = items.aggregate(
+        total_items=Count(),
+        total_time=Sum('length'),
+        total_bits=Sum('length', 'bitrate'),
+        artists=CountDistinct('artist'),
+        albums=CountDistinct('album_id'),
+        album_artists=CountDistinct('albumartist'),
+    )[0]
+
+    total_time = float(stats['total_time'])
+    if exact:
+        total_size = 0
+        for item in items.stream():
             total_size += os.path.getsize(item.path)
-        else:
-            total_size += int(item.length * item.bitrate / 8)
-        total_time += item.length
-        total_items += 1
-        artists.add(item.artist)
-        album_artists.add(item.albumartist)
-        if item.album_id:
-            albums.add(item.album_id)
+    else:
+        total_size = int(stats['total_bits'] / 8)
 
     size_str = '' + ui.human_bytes(total_size)
     if exact:
@@ -1190,14 +1254,14 @@ Total time: {1}{2}
 Artists: {5}
 Albums: {6}
 Album artists: {7}""".format(
-        total_items,
+        stats['total_items'],
         ui.human_seconds(total_time),
         ' ({0:.2f} seconds)'.format(total_time) if exact else '',
         'Total size' if exact else 'Approximate total size',
         size_str,
-        len(artists),
-        len(albums),
-        len(album_artists)),
+        stats['artists'],
+        stats['albums'],
+        stats['album_artists']),
     )
 
 
@@ -1216,6 +1280,49 @@ stats_cmd.func = stats_func
 default_commands.append(stats_cmd)
 
 
+# index: Manage database indexes.
+
+def index_fields(lib, fields, album, drop):
+    """Lists the indexes on the item or album tables or, if `fields`
+    are given, adds or drops an index on those fields.
+    """
+    model_cls = library.Album if album else library.Item
+
+    if not fields:
+        for name, columns, declared in lib.indices(model_cls):
+            print_(u'{0}: {1}{2}'.format(
+                name, u', '.join(columns), u' (built in)' if declared else u''
+            ))
+        return
+
+    try:
+        if drop:
+            if not lib.drop_index(model_cls, fields):
+                raise ui.UserError(u'no index on {0}'.format(
+                    u', '.join(fields)
+                ))
+        else:
+            lib.add_index(model_cls, fields)
+    except ValueError as exc:
+        raise ui.UserError(unicode(exc))
+
+
+def index_func(lib, opts, args):
+    index_fields(lib, decargs(args), opts.album, opts.drop)
+
+
+index_cmd = ui.Subcommand(
+    'index', help='list, add, or drop database indexes'
+)
+index_cmd.parser.add_album_option()
+index_cmd.parser.add_option(
+    '-d', '--drop', action='store_true',
+    help='drop the index on the fields instead of adding one'
+)
+index_cmd.func = index_func
+default_commands.append(index_cmd)
+
+
 # version: Show current beets version.
 
 def show_version(lib, opts, args):
@@ -1288,16 +1395,34 @@ def modify_items(lib, mods, dels, query, write, move, album, confirm):
         if not ui.input_yn('Really modify%s (Y/n)?' % extra):
             return
 
-    # Apply changes to database and files
+    # Apply changes to database and files. As with `try_sync`, an
+    # album is stored before its tracks' tags are written, and an item's
+    # tags are written before it is stored (with the file's new mtime).
+    # Items are stored in batches.
     with lib.transaction():
-        for obj in changed:
-            if move:
-                cur_path = obj.path
-                if lib.directory in ancestry(cur_path):  # In library?
-                    log.debug(u'moving object {0}', displayable_path(cur_path))
-                    obj.move()
-
-            obj.try_sync(write)
+        batch = []
+        try:
+            for obj in changed:
+                if move:
+                    cur_path = obj.path
+                    if lib.directory in ancestry(cur_path):  # In library?
+                        log.debug(u'moving object {0}',
+                                  displayable_path(cur_path))
+                        obj.move()
+
+                if album:
+                    obj.try_sync(write)
+                else:
+                    if write:
+                        obj.try_write()
+                    batch.append(obj)
+                    if len(batch) >= STORE_BATCH_SIZE:
+                        _store_batch(lib, batch)
+        finally:
+            # Record the items already moved or written, even if the
+            # loop was interrupted.
+            if batch:
+                _store_batch(lib, batch)
 
 
 def modify_parse_args(args):
@@ -1367,11 +1492,18 @@ def move_items(lib, dest, query, copy, album):
     action = 'Copying' if copy else 'Moving'
     entity = 'album' if album else 'item'
     log.info(u'{0} {1} {2}s.', action, len(objs), entity)
-    for obj in objs:
-        log.debug(u'moving: {0}', util.displayable_path(obj.path))
+    if album:
+        for obj in objs:
+            log.debug(u'moving: {0}', util.displayable_path(obj.path))
 
-        obj.move(copy, basedir=dest)
-        obj.store()
+            obj.move(copy, basedir=dest)
+            obj.store()
+    else:
+        for obj, path in lib.destinations(objs, basedir=dest):
+            log.debug(u'moving: {0}', util.displayable_path(obj.path))
+
+            obj.move(copy, basedir=dest, dest=path)
+            obj.store()
 
 
 def move_func(lib, opts, args):
@@ -1406,9 +1538,11 @@ def write_items(lib, query, pretend, force):
     """Write tag information from the database to the respective files
     in the filesystem.
     """
-    items, albums = _do_query(lib, query, False, False)
+    items = lib.items(query)
+    if not items:
+        raise ui.UserError('No matching items found.')
 
-    for item in items:
+    for item in items.stream():
         # Item deleted?
         if not os.path.exists(syspath(item.path)):
             log.info(u'missing file: {0}', util.displayable_path(item.path))
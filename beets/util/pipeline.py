@@ -28,20 +28,45 @@ When running a parallel pipeline, it is also possible to use
 multiple coroutines for the same pipeline stage; this lets you speed
 up a bottleneck stage by dividing its work among multiple threads.
 To do so, pass an iterable of coroutines to the Pipeline constructor
-in place of any single coroutine.
+in place of any single coroutine. The messages then leave the stage in
+whatever order the threads finish them; wrap the coroutines with
+`replicate` to have them sent on in the order they arrived instead.
+
+Pipelines can also be run by an event loop in a single thread with
+`Pipeline.run_async`. Stages made with `async_stage` then wait for
+blocking calls, such as network requests, in a pool of I/O threads while
+the loop keeps feeding them other messages, so a stage can have many
+messages in flight. Ordinary stages run in the loop itself.
+
+Stages made with `process_stage` do their work in a shared pool of
+worker processes, which lets CPU-bound stages use more than one core.
+
+While it runs, a pipeline keeps a `StageStats` record for each stage
+with the number of messages, the time spent working and waiting on the
+queues, and the longest input queue seen, to find the stage that holds
+the others back.
 """
 
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import Queue
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
+import collections
+import functools
+import multiprocessing
 import sys
+import time
 
 BUBBLE = b'__PIPELINE_BUBBLE__'
 POISON = b'__PIPELINE_POISON__'
 
 DEFAULT_QUEUE_SIZE = 16
+DEFAULT_IO_THREADS = 8
+
+# The worker processes for `process_stage` stages.
+_pool = None
+_pool_lock = Lock()
 
 
 def _invalidate_queue(q, val=None, sync=True):
@@ -139,6 +164,22 @@ def multiple(messages):
     return MultiMessage(messages)
 
 
+class ReplicatedStage(tuple):
+    """The coroutines of a pipeline stage run by several threads whose
+    messages are sent to the next stage in the order of their input.
+    """
+
+
+def replicate(coros):
+    """Use a list of coroutines, which should all do the same work, for
+    one middle stage of a pipeline. In a parallel pipeline each runs in
+    its own thread, and the messages they yield are reordered to match
+    the messages they received, so the following stages see them in the
+    same order as with a single coroutine.
+    """
+    return ReplicatedStage(coros)
+
+
 def stage(func):
     """Decorate a function to become a simple stage.
 
@@ -153,6 +194,7 @@ def stage(func):
     [3, 4, 5]
     """
 
+    @functools.wraps(func)
     def coro(*args):
         task = None
         while True:
@@ -176,6 +218,7 @@ def mutator_stage(func):
     [{'x': True}, {'a': False, 'x': True}]
     """
 
+    @functools.wraps(func)
     def coro(*args):
         task = None
         while True:
@@ -184,6 +227,223 @@ def mutator_stage(func):
     return coro
 
 
+class Call(object):
+    """A blocking call that an `async_stage` stage waits for.
+    """
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+def call(func, *args, **kwargs):
+    """Yield call(func, ...) from an `async_stage` function to wait for
+    a blocking call. The yield evaluates to the function's return value,
+    or raises its exception.
+    """
+    return Call(func, args, kwargs)
+
+
+class AsyncStage(object):
+    """The coroutine for a stage made with `async_stage`.
+
+    `Pipeline.run_async` starts a generator from the stage function for
+    each message and runs the calls it waits for in I/O threads. The
+    other ways of running a pipeline use the coroutine interface, which
+    runs the calls in the stage's own thread.
+    """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+    def start(self, msg):
+        """Get the generator that handles a message.
+        """
+        return self.func(*(self.args + (msg,)))
+
+    def next(self):
+        # Priming, like a coroutine.
+        return None
+
+    def send(self, msg):
+        tasklet = self.start(msg)
+        value, exc_info = None, None
+        while True:
+            try:
+                if exc_info:
+                    out = tasklet.throw(*exc_info)
+                else:
+                    out = tasklet.send(value)
+            except StopIteration:
+                return msg
+            if not isinstance(out, Call):
+                tasklet.close()
+                return out
+            try:
+                value, exc_info = out.run(), None
+            except Exception:
+                value, exc_info = None, sys.exc_info()
+
+
+def async_stage(func):
+    """Decorate a generator function to become a stage that can wait
+    for blocking calls without holding up the pipeline.
+
+    The function yields `call(...)` to wait for a call. The first value
+    it yields that is not a call is the message sent on; if it yields
+    none, the message it was given is sent on, as with `mutator_stage`.
+
+    >>> @async_stage
+    ... def fetch(task):
+    ...     page = yield call(urllib.urlopen, task)
+    ...     yield page.read()
+    """
+    @functools.wraps(func)
+    def make(*args):
+        return AsyncStage(func, args)
+    return make
+
+
+def start_processes(processes=None):
+    """Start the pool of worker processes that runs `process_stage`
+    stages, with `processes` workers or one for each CPU, and return
+    it. The pool is shared: if it is already running, it is returned
+    as is. Since the workers are forked, it is best started before the
+    pipeline's threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(processes)
+        return _pool
+
+
+def stop_processes():
+    """Shut down the pool of worker processes, if it was started.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+            _pool = None
+
+
+def _run_in_process(module, name, args):
+    """Call the function of a `process_stage` stage, found by name
+    since functions cannot be pickled. Runs in a worker process.
+    """
+    __import__(module)
+    func = getattr(sys.modules[module], name)
+    # With the decorator, the name refers to the stage.
+    func = getattr(func, 'process_func', func)
+    return func(*args)
+
+
+def _apply_in_process(module, name, args):
+    """Call a stage function in the pool and wait for its result.
+    """
+    return start_processes().apply(_run_in_process, (module, name, args))
+
+
+class ProcessStage(AsyncStage):
+    """The coroutine for a stage made with `process_stage`.
+
+    The stage waits for the worker process as an `AsyncStage` waits for
+    a call, so `Pipeline.run_async` keeps as many messages at the pool
+    as it has I/O threads. The other ways of running a pipeline wait in
+    the stage's thread, one message at a time for each coroutine.
+    """
+    def start(self, msg):
+        return self._handle(self.args + (msg,))
+
+    def _handle(self, args):
+        out = yield call(_apply_in_process, self.func.__module__,
+                         self.func.__name__, args)
+        yield out
+
+
+def process_stage(func):
+    """Decorate a function to become a stage that runs in a worker
+    process. The stage sends on the function's return value; changes it
+    makes to its arguments are not seen by the pipeline.
+
+    >>> @process_stage
+    ... def square(n):
+    ...     return n * n
+    >>> pipe = Pipeline([
+    ...     iter([1, 2, 3]),
+    ...     square(),
+    ... ])
+    >>> list(pipe.pull())
+    [1, 4, 9]
+
+    The function must be defined at the top level of a module, and its
+    arguments and the messages it takes and returns must be picklable.
+    Each coroutine has one message at the pool at a time; to keep
+    several workers busy in a threaded pipeline, `replicate` the stage.
+    """
+    @functools.wraps(func)
+    def make(*args):
+        return ProcessStage(func, args)
+    make.process_func = func
+    return make
+
+
+class StageStats(object):
+    """Counters for one stage of a pipeline, shared by all the threads
+    running it. Times are in seconds.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.messages = 0  # Messages taken (or produced by a first stage).
+        self.busy = 0.0  # Time spent in the coroutines.
+        self.input_wait = 0.0  # Time blocked waiting for messages.
+        self.output_wait = 0.0  # Time blocked sending messages on.
+        self.peak_queue = 0  # Longest input queue when taking a message.
+        self._lock = Lock()
+
+    def record(self, messages=0, busy=0.0, input_wait=0.0, output_wait=0.0,
+               queued=0):
+        """Add the measurements for a message to the counters.
+        """
+        with self._lock:
+            self.messages += messages
+            self.busy += busy
+            self.input_wait += input_wait
+            self.output_wait += output_wait
+            if queued > self.peak_queue:
+                self.peak_queue = queued
+
+    def as_dict(self):
+        """Get the counters as a dictionary, for example to dump them as
+        JSON.
+        """
+        return {
+            'name': self.name,
+            'messages': self.messages,
+            'busy': self.busy,
+            'input_wait': self.input_wait,
+            'output_wait': self.output_wait,
+            'peak_queue': self.peak_queue,
+        }
+
+
+def _stage_name(coro, index):
+    """Guess a name for the stage with the given coroutine, for stages
+    that were not named explicitly.
+    """
+    if isinstance(coro, AsyncStage):
+        return coro.func.__name__
+    code = getattr(coro, 'gi_code', None)
+    if code is not None and code.co_name != 'coro':
+        return code.co_name
+    return 'stage {0}'.format(index)
+
+
 def _allmsgs(obj):
     """Returns a list of all the messages encapsulated in obj. If obj
     is a MultiMessage, returns its enclosed messages. If obj is BUBBLE,
@@ -199,12 +459,13 @@ def _allmsgs(obj):
 
 class PipelineThread(Thread):
     """Abstract base class for pipeline-stage threads."""
-    def __init__(self, all_threads):
+    def __init__(self, all_threads, stats=None):
         super(PipelineThread, self).__init__()
         self.abort_lock = Lock()
         self.abort_flag = False
         self.all_threads = all_threads
         self.exc_info = None
+        self.stats = stats or StageStats()
 
     def abort(self):
         """Shut down the thread at the next chance possible.
@@ -230,8 +491,8 @@ class FirstPipelineThread(PipelineThread):
     """The thread running the first stage in a parallel pipeline setup.
     The coroutine should just be a generator.
     """
-    def __init__(self, coro, out_queue, all_threads):
-        super(FirstPipelineThread, self).__init__(all_threads)
+    def __init__(self, coro, out_queue, all_threads, stats=None):
+        super(FirstPipelineThread, self).__init__(all_threads, stats)
         self.coro = coro
         self.out_queue = out_queue
         self.out_queue.acquire()
@@ -247,18 +508,24 @@ class FirstPipelineThread(PipelineThread):
                         return
 
                 # Get the value from the generator.
+                start = time.time()
                 try:
                     msg = self.coro.next()
                 except StopIteration:
                     break
+                produced = time.time()
 
                 # Send messages to the next stage.
-                for msg in _allmsgs(msg):
+                msgs = _allmsgs(msg)
+                for msg in msgs:
                     with self.abort_lock:
                         if self.abort_flag:
                             return
                     self.out_queue.put(msg)
 
+                self.stats.record(messages=len(msgs), busy=produced - start,
+                                  output_wait=time.time() - produced)
+
         except:
             self.abort_all(sys.exc_info())
             return
@@ -271,8 +538,8 @@ class MiddlePipelineThread(PipelineThread):
     """A thread running any stage in the pipeline except the first or
     last.
     """
-    def __init__(self, coro, in_queue, out_queue, all_threads):
-        super(MiddlePipelineThread, self).__init__(all_threads)
+    def __init__(self, coro, in_queue, out_queue, all_threads, stats=None):
+        super(MiddlePipelineThread, self).__init__(all_threads, stats)
         self.coro = coro
         self.in_queue = in_queue
         self.out_queue = out_queue
@@ -289,8 +556,12 @@ class MiddlePipelineThread(PipelineThread):
                         return
 
                 # Get the message from the previous stage.
+                start = time.time()
+                queued = self.in_queue.qsize()
                 msg = self.in_queue.get()
+                received = time.time()
                 if msg is POISON:
+                    self.stats.record(input_wait=received - start)
                     break
 
                 with self.abort_lock:
@@ -299,6 +570,7 @@ class MiddlePipelineThread(PipelineThread):
 
                 # Invoke the current stage.
                 out = self.coro.send(msg)
+                done = time.time()
 
                 # Send messages to next stage.
                 for msg in _allmsgs(out):
@@ -307,6 +579,9 @@ class MiddlePipelineThread(PipelineThread):
                             return
                     self.out_queue.put(msg)
 
+                self.stats.record(1, done - received, received - start,
+                                  time.time() - done, queued)
+
         except:
             self.abort_all(sys.exc_info())
             return
@@ -315,12 +590,124 @@ class MiddlePipelineThread(PipelineThread):
         self.out_queue.release()
 
 
+class Sequencer(object):
+    """Numbers the messages taken by the threads of a replicated stage
+    and puts their results into the output queue in the same order.
+
+    At most `window` messages are in progress or waiting for an earlier
+    one at any time, so that a slow message cannot make the results
+    that follow it pile up.
+    """
+    def __init__(self, in_queue, out_queue, window):
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.window = window
+        self.in_lock = Lock()
+        self.out_cond = Condition()
+        self.next_in = 0
+        self.next_out = 0
+        self.pending = {}
+        self.aborted = False
+
+    def get(self):
+        """Get the next message from the input queue along with its
+        sequence number, or POISON and None when the input is finished.
+        """
+        with self.out_cond:
+            while self.next_in - self.next_out >= self.window and \
+                    not self.aborted:
+                self.out_cond.wait()
+        with self.in_lock:
+            msg = self.in_queue.get()
+            if msg is POISON:
+                return msg, None
+            seq = self.next_in
+            self.next_in += 1
+        return msg, seq
+
+    def put(self, seq, msgs):
+        """Record the messages produced for the message numbered `seq`
+        and send on all those whose turn has come.
+        """
+        with self.out_cond:
+            self.pending[seq] = msgs
+            while self.next_out in self.pending:
+                for msg in self.pending.pop(self.next_out):
+                    self.out_queue.put(msg)
+                self.next_out += 1
+            self.out_cond.notifyAll()
+
+    def abort(self):
+        """Stop waiting for the window to open.
+        """
+        with self.out_cond:
+            self.aborted = True
+            self.out_cond.notifyAll()
+
+
+class ReplicatedPipelineThread(MiddlePipelineThread):
+    """One of the threads running a replicated stage. Messages are
+    taken and sent on through a `Sequencer` shared by the threads of
+    the stage.
+    """
+    def __init__(self, coro, sequencer, all_threads, stats=None):
+        super(ReplicatedPipelineThread, self).__init__(
+            coro, sequencer.in_queue, sequencer.out_queue, all_threads,
+            stats
+        )
+        self.sequencer = sequencer
+
+    def abort(self):
+        super(ReplicatedPipelineThread, self).abort()
+        self.sequencer.abort()
+
+    def run(self):
+        try:
+            # Prime the coroutine.
+            self.coro.next()
+
+            while True:
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Get the message from the previous stage.
+                start = time.time()
+                queued = self.in_queue.qsize()
+                msg, seq = self.sequencer.get()
+                received = time.time()
+                if msg is POISON:
+                    self.stats.record(input_wait=received - start)
+                    break
+
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Invoke the current stage and send the messages on
+                # once the earlier ones have been.
+                out = self.coro.send(msg)
+                done = time.time()
+                self.sequencer.put(seq, _allmsgs(out))
+
+                self.stats.record(1, done - received, received - start,
+                                  time.time() - done, queued)
+
+        except BaseException:
+            # The main thread re-raises the exception.
+            self.abort_all(sys.exc_info())
+            return
+
+        # Pipeline is shutting down normally.
+        self.out_queue.release()
+
+
 class LastPipelineThread(PipelineThread):
     """A thread running the last stage in a pipeline. The coroutine
     should yield nothing.
     """
-    def __init__(self, coro, in_queue, all_threads):
-        super(LastPipelineThread, self).__init__(all_threads)
+    def __init__(self, coro, in_queue, all_threads, stats=None):
+        super(LastPipelineThread, self).__init__(all_threads, stats)
         self.coro = coro
         self.in_queue = in_queue
 
@@ -335,8 +722,12 @@ class LastPipelineThread(PipelineThread):
                         return
 
                 # Get the message from the previous stage.
+                start = time.time()
+                queued = self.in_queue.qsize()
                 msg = self.in_queue.get()
+                received = time.time()
                 if msg is POISON:
+                    self.stats.record(input_wait=received - start)
                     break
 
                 with self.abort_lock:
@@ -346,22 +737,209 @@ class LastPipelineThread(PipelineThread):
                 # Send to consumer.
                 self.coro.send(msg)
 
+                self.stats.record(1, time.time() - received,
+                                  received - start, queued=queued)
+
         except:
             self.abort_all(sys.exc_info())
             return
 
 
+class _Slot(object):
+    """A message handled by a stage of an `AsyncRunner`. The slots of a
+    stage are kept in the order their messages arrived.
+    """
+    __slots__ = ('msg', 'outputs', 'tasklet')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.outputs = None  # The messages to send on, once done.
+        self.tasklet = None
+
+
+class AsyncRunner(object):
+    """Runs a pipeline with an event loop in the current thread, for
+    `Pipeline.run_async`.
+
+    Each stage after the first has an inbox of messages waiting for it
+    and a queue of slots for the messages it is handling. Ordinary
+    stages finish a message as soon as they get it. `AsyncStage`
+    generators are resumed as the calls they wait for return from the
+    I/O threads. The messages a stage produces leave its slots in the
+    order of its input.
+    """
+    def __init__(self, pipeline, queue_size, threads):
+        self.coros = [stage[0] for stage in pipeline.stages]
+        self.stats = pipeline.stats
+        # As with queues, a size of zero means no limit.
+        self.queue_size = queue_size if queue_size > 0 else float('inf')
+        self.threads = threads
+        self.inboxes = [collections.deque() for _ in self.coros]
+        self.slots = [collections.deque() for _ in self.coros]
+        self.calls = Queue.Queue()
+        self.results = Queue.Queue()
+        self.outstanding = 0
+        self.exhausted = False
+
+    def run(self):
+        # Prime the coroutines.
+        for coro in self.coros[1:]:
+            coro.next()
+
+        workers = [Thread(target=self._work) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while self._advance():
+                # Wait for a call to return. The timeout lets us
+                # receive KeyboardInterrupt exceptions.
+                while True:
+                    try:
+                        result = self.results.get(True, 1)
+                        break
+                    except Queue.Empty:
+                        pass
+                self.outstanding -= 1
+                self._resume(*result)
+
+        finally:
+            # Drop the calls that have not started and stop the threads
+            # once the running ones return.
+            try:
+                while True:
+                    self.calls.get_nowait()
+            except Queue.Empty:
+                pass
+            for worker in workers:
+                self.calls.put(None)
+            for worker in workers:
+                worker.join()
+
+    def _work(self):
+        """Run calls from the I/O threads.
+        """
+        while True:
+            job = self.calls.get()
+            if job is None:
+                return
+            index, slot, call = job
+            try:
+                value, exc_info = call.run(), None
+            except Exception:
+                value, exc_info = None, sys.exc_info()
+            self.results.put((index, slot, value, exc_info))
+
+    def _advance(self):
+        """Do all the work that does not wait for a call. Return whether
+        some messages are still in progress.
+        """
+        last = len(self.coros) - 1
+        progress = True
+        while progress:
+            progress = False
+            # Start from the end so that messages leave the pipeline
+            # before more come in.
+            for i in range(last, 0, -1):
+                progress |= self._flush(i)
+                while self.inboxes[i] and self._can_start(i):
+                    self._start(i, self.inboxes[i].popleft())
+                    progress = True
+                progress |= self._flush(i)
+            if not self.exhausted and len(self.inboxes[1]) < self.queue_size:
+                self._produce()
+                progress = True
+
+        return not self.exhausted or any(self.inboxes) or any(self.slots)
+
+    def _produce(self):
+        start = time.time()
+        try:
+            out = self.coros[0].next()
+        except StopIteration:
+            self.exhausted = True
+            return
+        msgs = _allmsgs(out)
+        self.stats[0].record(len(msgs), time.time() - start)
+        self.inboxes[1].extend(msgs)
+
+    def _can_start(self, index):
+        """Check whether a stage may take another message: it must not
+        have too many in progress, nor the next stage too many waiting.
+        """
+        if index < len(self.coros) - 1 and \
+                len(self.inboxes[index + 1]) >= self.queue_size:
+            return False
+        return len(self.slots[index]) < self.queue_size
+
+    def _start(self, index, msg):
+        slot = _Slot(msg)
+        self.slots[index].append(slot)
+        coro = self.coros[index]
+        if isinstance(coro, AsyncStage):
+            self.stats[index].record(1, queued=len(self.inboxes[index]) + 1)
+            slot.tasklet = coro.start(msg)
+            self._resume(index, slot, None, None)
+        else:
+            start = time.time()
+            out = coro.send(msg)
+            self.stats[index].record(1, time.time() - start,
+                                     queued=len(self.inboxes[index]) + 1)
+            slot.outputs = _allmsgs(out)
+
+    def _resume(self, index, slot, value, exc_info):
+        """Run the generator of an `AsyncStage` until it waits for a
+        call or is done.
+        """
+        start = time.time()
+        try:
+            if exc_info:
+                out = slot.tasklet.throw(*exc_info)
+            else:
+                out = slot.tasklet.send(value)
+        except StopIteration:
+            slot.outputs = [slot.msg]
+        else:
+            if isinstance(out, Call):
+                self.calls.put((index, slot, out))
+                self.outstanding += 1
+            else:
+                slot.tasklet.close()
+                slot.outputs = _allmsgs(out)
+        self.stats[index].record(busy=time.time() - start)
+
+    def _flush(self, index):
+        """Send on the messages of the stage's first slots that are
+        done. Return whether there were any.
+        """
+        slots = self.slots[index]
+        last = index == len(self.coros) - 1
+        flushed = False
+        while slots and slots[0].outputs is not None:
+            outputs = slots.popleft().outputs
+            if not last:
+                self.inboxes[index + 1].extend(outputs)
+            flushed = True
+        return flushed
+
+
 class Pipeline(object):
     """Represents a staged pattern of work. Each stage in the pipeline
     is a coroutine that receives messages from the previous stage and
     yields messages to be sent to the next stage.
     """
-    def __init__(self, stages):
+    def __init__(self, stages, names=None):
         """Makes a new pipeline from a list of coroutines. There must
-        be at least two stages.
+        be at least two stages. `names` optionally gives a name for each
+        stage to identify it in the `stats`.
         """
         if len(stages) < 2:
             raise ValueError('pipeline must have at least two stages')
+        if isinstance(stages[0], ReplicatedStage) or \
+                isinstance(stages[-1], ReplicatedStage):
+            raise ValueError('only middle stages can be replicated')
+        if isinstance(stages[0], AsyncStage):
+            raise ValueError('the first stage must be a generator')
         self.stages = []
         for stage in stages:
             if isinstance(stage, (list, tuple)):
@@ -369,6 +947,12 @@ class Pipeline(object):
             else:
                 # Default to one thread per stage.
                 self.stages.append((stage,))
+        if names is None:
+            names = [_stage_name(stage[0], i)
+                     for i, stage in enumerate(self.stages)]
+        elif len(names) != len(self.stages):
+            raise ValueError('pipeline needs one name for each stage')
+        self.stats = [StageStats(name) for name in names]
 
     def run_sequential(self):
         """Run the pipeline sequentially in the current thread. The
@@ -388,19 +972,28 @@ class Pipeline(object):
 
         # Set up first stage.
         for coro in self.stages[0]:
-            threads.append(FirstPipelineThread(coro, queues[0], threads))
+            threads.append(FirstPipelineThread(coro, queues[0], threads,
+                                               self.stats[0]))
 
         # Middle stages.
         for i in range(1, queue_count):
+            if isinstance(self.stages[i], ReplicatedStage):
+                sequencer = Sequencer(queues[i - 1], queues[i],
+                                      len(self.stages[i]) + queue_size)
+                for coro in self.stages[i]:
+                    threads.append(ReplicatedPipelineThread(
+                        coro, sequencer, threads, self.stats[i]
+                    ))
+                continue
             for coro in self.stages[i]:
                 threads.append(MiddlePipelineThread(
-                    coro, queues[i - 1], queues[i], threads
+                    coro, queues[i - 1], queues[i], threads, self.stats[i]
                 ))
 
         # Last stage.
         for coro in self.stages[-1]:
             threads.append(
-                LastPipelineThread(coro, queues[-1], threads)
+                LastPipelineThread(coro, queues[-1], threads, self.stats[-1])
             )
 
         # Start threads.
@@ -433,6 +1026,18 @@ class Pipeline(object):
                 # Make the exception appear as it was raised originally.
                 raise exc_info[0], exc_info[1], exc_info[2]
 
+    def run_async(self, queue_size=DEFAULT_QUEUE_SIZE,
+                  threads=DEFAULT_IO_THREADS):
+        """Run the pipeline with an event loop in the current thread.
+        The calls that `async_stage` stages wait for run in `threads` I/O
+        threads, so each such stage can handle up to `queue_size`
+        messages at once; its messages are still sent on in order. The
+        other stages run in the loop, and only the first coroutine in
+        each stage is used. An exception raised by a stage stops the
+        pipeline and is raised again here.
+        """
+        AsyncRunner(self, queue_size, threads).run()
+
     def pull(self):
         """Yield elements from the end of the pipeline. Runs the stages
         sequentially until the last yields some messages. Each of the messages
@@ -447,12 +1052,22 @@ class Pipeline(object):
             coro.next()
 
         # Begin the pipeline.
-        for out in coros[0]:
+        first = iter(coros[0])
+        while True:
+            start = time.time()
+            try:
+                out = first.next()
+            except StopIteration:
+                break
             msgs = _allmsgs(out)
-            for coro in coros[1:]:
+            self.stats[0].record(len(msgs), time.time() - start)
+
+            for coro, stats in zip(coros[1:], self.stats[1:]):
                 next_msgs = []
                 for msg in msgs:
+                    start = time.time()
                     out = coro.send(msg)
+                    stats.record(1, time.time() - start)
                     next_msgs.extend(_allmsgs(out))
                 msgs = next_msgs
             for msg in msgs:
@@ -460,8 +1075,6 @@ class Pipeline(object):
 
 # Smoke test.
 if __name__ == b'__main__':
-    import time
-
     # Test a normally-terminating pipeline both in sequence and
     # in parallel.
     def produce():
@@ -489,10 +1102,14 @@ if __name__ == b'__main__':
     Pipeline([produce(), work(), consume()]).run_parallel()
     ts_par = time.time()
     Pipeline([produce(), (work(), work()), consume()]).run_parallel()
+    ts_rep = time.time()
+    Pipeline([produce(), replicate([work(), work()]),
+              consume()]).run_parallel()
     ts_end = time.time()
     print('Sequential time:', ts_seq - ts_start)
     print('Parallel time:', ts_par - ts_seq)
-    print('Multiply-parallel time:', ts_end - ts_par)
+    print('Multiply-parallel time:', ts_rep - ts_par)
+    print('Replicated time:', ts_end - ts_rep)
     print()
 
     # Test a pipeline that raises an exception.
@@ -46,8 +46,7 @@ def libtree(lib):
     child node tuples.
     """
     root = Node({}, {})
-    for item in lib.items():
-        dest = item.destination(fragment=True)
+    for item, dest in lib.destinations(lib.items(), fragment=True):
         parts = util.components(dest)
         _insert(root, parts, item.id)
     return root
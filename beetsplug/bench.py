@@ -21,12 +21,20 @@ from beets.plugins import BeetsPlugin
 from beets import ui
 from beets import vfs
 from beets import library
+from beets import dbcore
 from beets.util.functemplate import Template
 from beets.autotag import match
 from beets import plugins
 from beets import importer
 import cProfile
+import os
 import timeit
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
 
 
 def aunique_benchmark(lib, prof):
@@ -83,6 +91,127 @@ def match_benchmark(lib, prof, query=None, album_id=None):
         print('match duration:', interval)
 
 
+def db_benchmark(lib, concurrent, threads, duration, write_ratio):
+    """Measure the throughput of a mix of reads and writes issued by
+    several threads at once.
+
+    Each operation either fetches a random item (a read) or stores a
+    flexible attribute on one (a write). `write_ratio` is the fraction
+    of operations that are writes.
+
+    The benchmark runs on a temporary copy of the library database, so
+    the library itself is neither modified nor switched to the
+    write-ahead log.
+    """
+    with lib.transaction() as tx:
+        ids = [row[0] for row in tx.query('SELECT id FROM items')]
+    if not ids:
+        raise ui.UserError('the library contains no items')
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, b'library.db')
+        shutil.copyfile(lib.path, path)
+        # Changes not yet checkpointed from a write-ahead log.
+        if os.path.exists(lib.path + b'-wal'):
+            shutil.copyfile(lib.path + b'-wal', path + b'-wal')
+        _run_db_benchmark(
+            library.Library(path, lib.directory, concurrent=concurrent),
+            ids, concurrent, threads, duration, write_ratio,
+        )
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def _run_db_benchmark(lib, ids, concurrent, threads, duration,
+                      write_ratio):
+    """Run the threads for `db_benchmark` on the copied library.
+    """
+
+    counts = []
+    deadline = time.time() + duration
+
+    def _worker():
+        reads = writes = 0
+        while time.time() < deadline:
+            item = lib.get_item(random.choice(ids))
+            if random.random() < write_ratio:
+                item['bench_db'] = time.time()
+                item.store()
+                writes += 1
+            else:
+                reads += 1
+        counts.append((reads, writes))
+
+    workers = [threading.Thread(target=_worker) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    reads = sum(r for r, _ in counts)
+    writes = sum(w for _, w in counts)
+    print('{0} threads, {1}: {2:.1f} reads/s, {3:.1f} writes/s'.format(
+        threads, 'concurrent' if concurrent else 'serialized',
+        reads / duration, writes / duration,
+    ))
+
+
+def _model_size(obj):
+    """Estimate the memory, in bytes, taken by a model object and the
+    containers that hold its values. The values themselves are not
+    counted since they are the same in every representation.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    fixed = obj._values_fixed
+    size += sys.getsizeof(fixed)
+    if isinstance(fixed, dbcore.db.FixedValues):
+        size += sys.getsizeof(fixed._values)
+    size += sys.getsizeof(obj._values_flex)
+    if obj._dirty is not dbcore.db._CLEAN:
+        size += sys.getsizeof(obj._dirty)
+    return size
+
+
+def memory_benchmark(count):
+    """Compare the memory taken by items loaded with the default and
+    the compact representation of fixed fields.
+
+    The items come from a synthetic in-memory library with `count`
+    tracks.
+    """
+    lib = library.Library(':memory:')
+    items = []
+    for i in range(count):
+        item = library.Item(
+            title=u'title {0}'.format(i),
+            artist=u'artist {0}'.format(i % 100),
+            album=u'album {0}'.format(i % 1000),
+            track=i % 20 + 1,
+            year=1950 + i % 70,
+            length=180.0 + i % 120,
+            path='/music/{0}.mp3'.format(i).encode('ascii'),
+        )
+        item['play_count'] = i % 50
+        items.append(item)
+    lib.add_many(items)
+    del items
+
+    for mode in (False, True):
+        lib.compact_models = mode
+        start = time.time()
+        items = list(lib.items())
+        interval = time.time() - start
+        size = sum(_model_size(item) for item in items)
+        print('{0}: {1} items loaded in {2:.3f} seconds, '
+              '{3:.1f} MiB ({4} bytes per item)'.format(
+                  'compact' if mode else 'default', len(items),
+                  interval, size / 2 ** 20, size // len(items)))
+        del items
+
+
 class BenchmarkPlugin(BeetsPlugin):
     """A plugin for performing some simple performance benchmarks.
     """
@@ -105,4 +234,33 @@ class BenchmarkPlugin(BeetsPlugin):
         match_bench_cmd.func = lambda lib, opts, args: \
             match_benchmark(lib, opts.profile, ui.decargs(args), opts.id)
 
-        return [aunique_bench_cmd, match_bench_cmd]
+        db_bench_cmd = ui.Subcommand('bench_db',
+                                     help='benchmark for concurrent '
+                                          'database access')
+        db_bench_cmd.parser.add_option('-c', '--concurrent',
+                                       action='store_true', default=False,
+                                       help='use concurrent reads')
+        db_bench_cmd.parser.add_option('-t', '--threads', type='int',
+                                       default=4, help='number of threads')
+        db_bench_cmd.parser.add_option('-d', '--duration', type='float',
+                                       default=5.0,
+                                       help='duration in seconds')
+        db_bench_cmd.parser.add_option('-w', '--write-ratio', type='float',
+                                       default=0.1,
+                                       help='fraction of operations that '
+                                            'write')
+        db_bench_cmd.func = lambda lib, opts, args: \
+            db_benchmark(lib, opts.concurrent, opts.threads, opts.duration,
+                         opts.write_ratio)
+
+        memory_bench_cmd = ui.Subcommand('bench_memory',
+                                         help='benchmark for the memory '
+                                              'taken by loaded items')
+        memory_bench_cmd.parser.add_option('-n', '--count', type='int',
+                                           default=50000,
+                                           help='number of synthetic items')
+        memory_bench_cmd.func = lambda lib, opts, args: \
+            memory_benchmark(opts.count)
+
+        return [aunique_bench_cmd, match_bench_cmd, db_bench_cmd,
+                memory_bench_cmd]
@@ -34,6 +34,7 @@ from beets import vfs
 from beets.util import bluelet
 from beets.library import Item
 from beets import dbcore
+from beets.dbcore.aggregate import Count, Sum
 from beets.mediafile import MediaFile
 
 PROTOCOL_VERSION = '0.13.0'
@@ -1066,13 +1067,10 @@ class Server(BaseServer):
         tag/value query.
         """
         _, key = self._tagtype_lookup(tag)
-        songs = 0
-        playtime = 0.0
-        for item in self.lib.items(dbcore.query.MatchQuery(key, value)):
-            songs += 1
-            playtime += item.length
-        yield u'songs: ' + unicode(songs)
-        yield u'playtime: ' + unicode(int(playtime))
+        items = self.lib.items(dbcore.query.MatchQuery(key, value))
+        stats = items.aggregate(songs=Count(), playtime=Sum('length'))[0]
+        yield u'songs: ' + unicode(stats['songs'])
+        yield u'playtime: ' + unicode(int(stats['playtime']))
 
     # "Outputs." Just a dummy implementation because we don't control
     # any outputs.
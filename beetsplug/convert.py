@@ -209,14 +209,14 @@ class ConvertPlugin(BeetsPlugin):
             self._log.info(u'Finished encoding {0}',
                            util.displayable_path(source))
 
-    def convert_item(self, dest_dir, keep_new, path_formats, fmt,
-                     pretend=False):
+    def convert_item(self, keep_new, fmt, pretend=False):
+        """A pipeline stage that converts the items it receives with
+        their destinations as `(item, dest)` pairs.
+        """
         command, ext = get_format(fmt)
         item, original, converted = None, None, None
         while True:
-            item = yield (item, original, converted)
-            dest = item.destination(basedir=dest_dir,
-                                    path_formats=path_formats)
+            item, dest = yield (item, original, converted)
 
             # When keeping the new file in the library, we first move the
             # current (pristine) file to the destination. We'll then copy it
@@ -366,16 +366,16 @@ class ConvertPlugin(BeetsPlugin):
 
         if opts.album:
             albums = lib.albums(ui.decargs(args))
-            items = (i for a in albums for i in a.items())
+            items = (i for a in albums for i in a.items().stream())
             if self.config['copy_album_art']:
                 for album in albums:
                     self.copy_album_art(album, opts.dest, path_formats,
                                         pretend)
         else:
-            items = iter(lib.items(ui.decargs(args)))
-        convert = [self.convert_item(opts.dest,
-                                     opts.keep_new,
-                                     path_formats,
+            items = lib.items(ui.decargs(args)).stream()
+        items = lib.destinations(items, basedir=opts.dest,
+                                 path_formats=path_formats)
+        convert = [self.convert_item(opts.keep_new,
                                      opts.format,
                                      pretend)
                    for _ in range(opts.threads)]
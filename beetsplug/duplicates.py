@@ -18,7 +18,9 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import shlex
+import collections
 
+from beets.dbcore.aggregate import Count
 from beets.plugins import BeetsPlugin
 from beets.ui import decargs, print_, vararg_callback, Subcommand, UserError
 from beets.util import command_output, displayable_path, subprocess
@@ -204,9 +206,16 @@ class DuplicatesPlugin(BeetsPlugin):
 
         If strict, all attributes must be defined for a duplicate match.
         """
-        import collections
+        # Count the objects with each key in the database first, so
+        # only objects with duplicate keys are kept in memory.
+        key_counts = collections.Counter()
+        for row in objs.aggregate(group_by=keys, count=Count()):
+            values = [row[k] for k in keys]
+            key = tuple(v for v in values if v not in (None, ''))
+            key_counts[key] += row['count']
+
         counts = collections.defaultdict(list)
-        for obj in objs:
+        for obj in objs.stream():
             values = [getattr(obj, k, None) for k in keys]
             values = [v for v in values if v not in (None, '')]
             if strict and len(values) < len(keys):
@@ -219,7 +228,8 @@ class DuplicatesPlugin(BeetsPlugin):
                                 keys, displayable_path(obj.path))
             else:
                 key = tuple(values)
-                counts[key].append(obj)
+                if key_counts[key] > 1:
+                    counts[key].append(obj)
 
         return counts
 
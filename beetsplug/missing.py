@@ -18,16 +18,31 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 from beets.autotag import hooks
+from beets.dbcore.aggregate import Count
 from beets.library import Item
 from beets.plugins import BeetsPlugin
 from beets.ui import decargs, print_, Subcommand
 from beets import config
 
 
-def _missing_count(album):
-    """Return number of missing items in `album`.
+def _missing_count(album, item_counts=None):
+    """Return number of missing items in `album`. The number of items
+    in the album is looked up in `item_counts` (see `_item_counts`),
+    if given.
     """
-    return (album.albumtotal or 0) - len(album.items())
+    if item_counts is None:
+        num_items = len(album.items())
+    else:
+        num_items = item_counts.get(album.id, 0)
+    return (album.albumtotal or 0) - num_items
+
+
+def _item_counts(lib):
+    """Return a dictionary mapping album ids to the number of items in
+    each album in `lib`.
+    """
+    rows = lib.items().aggregate(group_by=('album_id',), count=Count())
+    return dict((row['album_id'], row['count']) for row in rows)
 
 
 def _item(track_info, album_info, album_id):
@@ -111,16 +126,19 @@ class MissingPlugin(BeetsPlugin):
 
             albums = lib.albums(decargs(args))
             if total:
-                print(sum([_missing_count(a) for a in albums]))
+                item_counts = _item_counts(lib)
+                print(sum(_missing_count(a, item_counts)
+                          for a in albums.stream()))
                 return
 
             # Default format string for count mode.
             if count:
                 fmt += ': $missing'
+                item_counts = _item_counts(lib)
 
             for album in albums:
                 if count:
-                    if _missing_count(album):
+                    if _missing_count(album, item_counts):
                         print_(format(album, fmt))
 
                 else:
@@ -18,21 +18,42 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 from beets.plugins import BeetsPlugin
+from beets.dbcore.query import FixedFieldSort
 from beets.ui import Subcommand, decargs, print_
 import random
 from operator import attrgetter
 from itertools import groupby
 
 
+def _sample(lib, query, album, number):
+    """Choose `number` random objects matching the query (or fewer, if
+    there are not enough). When the query can be evaluated by the
+    database, only the ids of the matching objects are read and only
+    the chosen objects are loaded. Objects removed in the meantime are
+    left out.
+    """
+    fetch = lib.albums if album else lib.items
+    results = fetch(query, FixedFieldSort('id'))
+    if results.is_slow():
+        objs = list(results)
+        return random.sample(objs, min(len(objs), number))
+
+    ids = results.snapshot(['id'])['id']
+    get = lib.get_album if album else lib.get_item
+    objs = [get(int(id))
+            for id in random.sample(ids, min(len(ids), number))]
+    return [obj for obj in objs if obj is not None]
+
+
 def random_item(lib, opts, args):
     query = decargs(args)
 
-    if opts.album:
-        objs = list(lib.albums(query))
-    else:
-        objs = list(lib.items(query))
-
     if opts.equal_chance:
+        if opts.album:
+            objs = list(lib.albums(query))
+        else:
+            objs = list(lib.items(query))
+
         # Group the objects by artist so we can sample from them.
         key = attrgetter('albumartist')
         objs.sort(key=key)
@@ -58,8 +79,7 @@ def random_item(lib, opts, args):
                 del objs_by_artists[artist]
 
     else:
-        number = min(len(objs), opts.number)
-        objs = random.sample(objs, number)
+        objs = _sample(lib, query, opts.album, opts.number)
 
     for item in objs:
         print_(format(item))
@@ -20,6 +20,7 @@ from beets.plugins import BeetsPlugin
 from beets import ui
 from beets import util
 import beets.library
+from beets.dbcore.aggregate import Count, CountDistinct, Sum
 import flask
 from flask import g
 from werkzeug.routing import BaseConverter, PathConverter
@@ -124,6 +125,30 @@ def resource_list(name):
     return make_responder
 
 
+def _pagination():
+    """Get the `limit`, `offset` and `after` arguments for a library
+    query from the request's query string.
+    """
+    args = flask.request.args
+    return {
+        'limit': args.get('limit', type=int),
+        'offset': args.get('offset', type=int),
+        'after': args.get('after', type=int),
+    }
+
+
+def _fetch_page(fetch, queries=None):
+    """Call `fetch` (`Library.items` or `Library.albums`) with the
+    query and the pagination arguments of the request. A query that
+    combines `after` with a sort cannot be answered and is rejected as
+    a bad request.
+    """
+    try:
+        return fetch(queries, **_pagination())
+    except ValueError as exc:
+        flask.abort(400, unicode(exc))
+
+
 class IdListConverter(BaseConverter):
     """Converts comma separated lists of ids in urls to integer lists.
     """
@@ -176,7 +201,7 @@ def get_item(id):
 @app.route('/item/query/')
 @resource_list('items')
 def all_items():
-    return g.lib.items()
+    return _fetch_page(g.lib.items)
 
 
 @app.route('/item/<int:item_id>/file')
@@ -191,7 +216,7 @@ def item_file(item_id):
 @app.route('/item/query/<query:queries>')
 @resource_query('items')
 def item_query(queries):
-    return g.lib.items(queries)
+    return _fetch_page(g.lib.items, queries)
 
 
 # Albums.
@@ -206,13 +231,13 @@ def get_album(id):
 @app.route('/album/query/')
 @resource_list('albums')
 def all_albums():
-    return g.lib.albums()
+    return _fetch_page(g.lib.albums)
 
 
 @app.route('/album/query/<query:queries>')
 @resource_query('albums')
 def album_query(queries):
-    return g.lib.albums(queries)
+    return _fetch_page(g.lib.albums, queries)
 
 
 @app.route('/album/<int:album_id>/art')
@@ -233,14 +258,58 @@ def all_artists():
 
 # Library information.
 
+def _stats_snapshot(lib):
+    """Get a snapshot of the item fields summarized by `/stats`. It is
+    kept between requests and only loaded again when the library's
+    change journal shows that something has changed.
+    """
+    last = lib.last_change()
+    cached = app.config.get('stats_snapshot')
+    if cached is None or cached[0] is not lib or cached[1] != last:
+        cached = (lib, last, lib.snapshot(['length', 'bitrate', 'artist',
+                                           'albumartist']))
+        app.config['stats_snapshot'] = cached
+    return cached[2]
+
+
 @app.route('/stats')
 def stats():
     with g.lib.transaction() as tx:
-        item_rows = tx.query("SELECT COUNT(*) FROM items")
         album_rows = tx.query("SELECT COUNT(*) FROM albums")
+    summary = _stats_snapshot(g.lib).aggregate(
+        items=Count(),
+        total_time=Sum('length'),
+        total_bits=Sum('length', 'bitrate'),
+        artists=CountDistinct('artist'),
+        album_artists=CountDistinct('albumartist'),
+    )[0]
     return flask.jsonify({
-        'items': item_rows[0][0],
+        'items': summary['items'],
         'albums': album_rows[0][0],
+        'artists': summary['artists'],
+        'album_artists': summary['album_artists'],
+        'total_time': summary['total_time'],
+        'total_size': int(summary['total_bits'] / 8),
+    })
+
+
+@app.route('/changes')
+def changes():
+    """List the changes to the library after the sequence number given
+    by the `since` argument, so that clients can update incrementally.
+    """
+    since = flask.request.args.get('since', 0, type=int)
+    limit = flask.request.args.get('limit', type=int)
+    return flask.jsonify({
+        'first': g.lib.first_change(),
+        'last': g.lib.last_change(),
+        'changes': [{
+            'seq': change.seq,
+            'type': change.model.__name__.lower() if change.model else None,
+            'id': change.id,
+            'op': change.op,
+            'keys': change.keys,
+        } for change in g.lib.changes_since(since, limit)],
     })
 
 
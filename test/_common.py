@@ -240,6 +240,9 @@ class DummyOut(object):
     def write(self, s):
         self.buf.append(s)
 
+    def flush(self):
+        pass
+
     def get(self):
         return b''.join(self.buf)
 
@@ -267,6 +270,9 @@ class DummyIn(object):
         self.reads += 1
         return self.buf.pop(0)
 
+    def close(self):
+        pass
+
 
 class DummyIO(object):
     """Mocks input and output streams for testing UI code."""
@@ -17,11 +17,18 @@
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
+import json
 import os
+import pickle
 import sqlite3
+import threading
+
+from mock import patch
 
 from test._common import unittest
+from test.helper import capture_log
 from beets import dbcore
+from beets.dbcore import aggregate
 from tempfile import mkstemp
 
 
@@ -115,6 +122,28 @@ class TestDatabaseTwoModels(dbcore.Database):
     pass
 
 
+class IndexedTestModel(TestModel2):
+    _indices = ('field_one', ('field_one', 'field_two'))
+
+
+class IndexedTestDatabase(dbcore.Database):
+    _models = (IndexedTestModel,)
+    pass
+
+
+class JournalTestDatabase(dbcore.Database):
+    _models = (TestModel1,)
+    _journal_table = 'changes'
+
+
+class CompactTestModel(TestModel2):
+    _compact = True
+
+
+class CompactTestDatabase(dbcore.Database):
+    _models = (CompactTestModel,)
+
+
 class MigrationTest(unittest.TestCase):
     """Tests the ability to change the database schema between
     versions.
@@ -170,6 +199,522 @@ class MigrationTest(unittest.TestCase):
         except sqlite3.OperationalError:
             self.fail("select failed")
 
+    def test_open_up_to_date_skips_schema_setup(self):
+        with patch.object(TestDatabase2, '_make_schema') as make_schema:
+            TestDatabase2(self.libfile)
+        self.assertFalse(make_schema.called)
+
+    def test_open_with_other_fields_sets_up_schema(self):
+        with patch.object(TestDatabase3, '_make_schema') as make_schema:
+            TestDatabase3(self.libfile)
+        self.assertTrue(make_schema.called)
+
+    def test_schema_version_stored(self):
+        new_lib = TestDatabase3(self.libfile)
+        c = new_lib._connection().cursor()
+        c.execute("pragma user_version")
+        self.assertEqual(c.fetchone()[0], new_lib._schema_version())
+        self.assertNotEqual(new_lib._schema_version(),
+                            TestDatabase2(':memory:')._schema_version())
+
+
+class ConcurrentTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.libfile = mkstemp('db')
+        os.close(handle)
+        self.db = TestDatabase1(self.libfile, concurrent=True)
+
+    def tearDown(self):
+        self.db._connection().close()
+        os.remove(self.libfile)
+
+    def test_uses_write_ahead_log(self):
+        with self.db.transaction() as tx:
+            mode = tx.query('PRAGMA journal_mode')[0][0]
+        self.assertEqual(mode, 'wal')
+
+    def test_read_does_not_wait_for_writer(self):
+        model = TestModel1()
+        model.add(self.db)
+
+        results = []
+
+        def read():
+            results.append(self.db._get(TestModel1, model.id))
+
+        with self.db.transaction() as tx:
+            tx.mutate('UPDATE test SET field_one=1')
+            self.assertTrue(self.db._db_lock.locked())
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertFalse(self.db._db_lock.locked())
+
+        self.assertEqual(results[0].id, model.id)
+        self.assertEqual(results[0].field_one, 0)  # Uncommitted write.
+
+    def test_read_transaction_does_not_lock(self):
+        with self.db.transaction() as tx:
+            tx.query('SELECT * FROM test')
+            self.assertFalse(self.db._db_lock.locked())
+
+
+class IdentityMapTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:', cache_size=2)
+        self.model = TestModel1()
+        self.model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_get_returns_same_object(self):
+        obj = self.db._get(TestModel1, self.model.id)
+        self.assertIs(self.db._get(TestModel1, self.model.id), obj)
+
+    def test_disabled_by_default(self):
+        db = TestDatabase1(':memory:')
+        model = TestModel1()
+        model.add(db)
+        self.assertIsNot(db._get(TestModel1, model.id),
+                         db._get(TestModel1, model.id))
+
+    def test_missing_object_is_not_cached(self):
+        self.assertIsNone(self.db._get(TestModel1, 2))
+        TestModel1().add(self.db)
+        self.assertIsNotNone(self.db._get(TestModel1, 2))
+
+    def test_store_invalidates(self):
+        obj = self.db._get(TestModel1, self.model.id)
+        self.model.field_one = 3
+        self.model.store()
+        new_obj = self.db._get(TestModel1, self.model.id)
+        self.assertIsNot(new_obj, obj)
+        self.assertEqual(new_obj.field_one, 3)
+
+    def test_remove_invalidates(self):
+        self.db._get(TestModel1, self.model.id)
+        self.model.remove()
+        self.assertIsNone(self.db._get(TestModel1, self.model.id))
+
+    def test_raw_write_invalidates(self):
+        self.db._get(TestModel1, self.model.id)
+        with self.db.transaction() as tx:
+            tx.mutate('UPDATE test SET field_one=4')
+        self.assertEqual(self.db._get(TestModel1, self.model.id).field_one, 4)
+
+    def test_dirty_object_is_not_returned(self):
+        obj = self.db._get(TestModel1, self.model.id)
+        obj.field_one = 5
+        new_obj = self.db._get(TestModel1, self.model.id)
+        self.assertIsNot(new_obj, obj)
+        self.assertEqual(new_obj.field_one, 0)
+
+    def test_load_refreshes(self):
+        obj = self.db._get(TestModel1, self.model.id)
+        self.model.load()
+        self.assertIsNot(self.db._get(TestModel1, self.model.id), obj)
+
+    def test_least_recently_used_is_evicted(self):
+        for _ in range(2):
+            TestModel1().add(self.db)
+        first = self.db._get(TestModel1, 1)
+        second = self.db._get(TestModel1, 2)
+        self.db._get(TestModel1, 1)
+        self.db._get(TestModel1, 3)
+        self.assertIs(self.db._get(TestModel1, 1), first)
+        self.assertIsNot(self.db._get(TestModel1, 2), second)
+
+    def test_write_to_other_table_does_not_invalidate(self):
+        with self.db.transaction() as tx:
+            tx.mutate('CREATE TABLE other (x)')
+        obj = self.db._get(TestModel1, self.model.id)
+        with self.db.transaction() as tx:
+            tx.mutate('INSERT INTO other (x) VALUES (1)')
+        self.assertIs(self.db._get(TestModel1, self.model.id), obj)
+
+
+class BulkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_add_many_assigns_ids(self):
+        TestModel1().add(self.db)
+        models = [TestModel1() for _ in range(3)]
+        self.db.add_many(models)
+        self.assertEqual([m.id for m in models], [2, 3, 4])
+        self.assertEqual(len(self.db._fetch(TestModel1)), 4)
+
+    def test_add_many_stores_fields(self):
+        models = [TestModel1(field_one=i, foo='x{0}'.format(i))
+                  for i in range(3)]
+        self.db.add_many(models)
+        for model in models:
+            stored = self.db._get(TestModel1, model.id)
+            self.assertEqual(stored.field_one, model.field_one)
+            self.assertEqual(stored.foo, model.foo)
+            self.assertFalse(model._dirty)
+
+    def test_store_many_different_fields(self):
+        models = [TestModel1() for _ in range(3)]
+        self.db.add_many(models)
+        models[0].field_one = 1
+        models[1].foo = 'bar'
+        models[2].field_one = 3
+        models[2].foo = 'baz'
+        self.db.store_many(models)
+
+        stored = [self.db._get(TestModel1, m.id) for m in models]
+        self.assertEqual([m.field_one for m in stored], [1, 0, 3])
+        self.assertEqual([m.get('foo') for m in stored], [None, 'bar', 'baz'])
+
+    def test_store_many_deletes_flexattr(self):
+        model = TestModel1(foo='bar')
+        model.add(self.db)
+        del model.foo
+        self.db.store_many([model])
+        self.assertNotIn('foo', self.db._get(TestModel1, model.id))
+
+    def test_store_matching_updates_matching_rows(self):
+        models = [TestModel1(field_one=i % 2) for i in range(4)]
+        self.db.add_many(models)
+        self.db.store_matching(TestModel1,
+                               dbcore.query.MatchQuery('field_one', 1),
+                               {'field_one': 5})
+        stored = [self.db._get(TestModel1, m.id) for m in models]
+        self.assertEqual([m.field_one for m in stored], [0, 5, 0, 5])
+
+    def test_store_matching_rejects_flexattr(self):
+        with self.assertRaises(ValueError):
+            self.db.store_matching(TestModel1, dbcore.query.TrueQuery(),
+                                   {'foo': 'bar'})
+
+
+class FlexStorageTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.libfile = mkstemp('db')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.libfile)
+
+    def stored(self, db, key):
+        with db.transaction() as tx:
+            rows = tx.query('SELECT value, typeof(value) FROM testflex '
+                            'WHERE key = ?', (key,))
+        return tuple(rows[0])
+
+    def test_typed_value_stored_as_number(self):
+        db = TestDatabase1(self.libfile)
+        model = TestModel1(some_float_field=1.5)
+        model.add(db)
+        self.assertEqual(self.stored(db, 'some_float_field'), (1.5, 'real'))
+        self.assertEqual(db._get(TestModel1, model.id).some_float_field, 1.5)
+
+    def test_typed_string_value_parsed(self):
+        db = TestDatabase1(self.libfile)
+        model = TestModel1()
+        model.some_float_field = '2'
+        model.add(db)
+        self.assertEqual(self.stored(db, 'some_float_field'), (2.0, 'real'))
+
+    def test_untyped_value_stored_as_text(self):
+        db = TestDatabase1(self.libfile)
+        model = TestModel1(foo=5, bar=True)
+        model.add(db)
+        self.assertEqual(self.stored(db, 'foo'), ('5', 'text'))
+        self.assertEqual(self.stored(db, 'bar'), ('1', 'text'))
+        self.assertEqual(db._get(TestModel1, model.id).foo, '5')
+
+    def test_migrate_text_values(self):
+        conn = sqlite3.connect(self.libfile)
+        conn.executescript("""
+            CREATE TABLE testflex (
+                id INTEGER PRIMARY KEY,
+                entity_id INTEGER,
+                key TEXT,
+                value TEXT,
+                UNIQUE(entity_id, key) ON CONFLICT REPLACE);
+            CREATE INDEX testflex_by_entity ON testflex (entity_id);
+            CREATE INDEX testflex_by_key_foo ON testflex (value)
+                WHERE key = 'foo';
+            INSERT INTO testflex (entity_id, key, value)
+                VALUES (1, 'some_float_field', '2.5');
+            INSERT INTO testflex (entity_id, key, value)
+                VALUES (1, 'foo', '3');
+        """)
+        conn.commit()
+        conn.close()
+
+        db = TestDatabase1(self.libfile)
+        self.assertEqual(self.stored(db, 'some_float_field'), (2.5, 'real'))
+        self.assertEqual(self.stored(db, 'foo'), ('3', 'text'))
+        with db.transaction() as tx:
+            rows = tx.query("SELECT name FROM sqlite_master "
+                            "WHERE type = 'index' AND tbl_name = 'testflex' "
+                            "AND sql IS NOT NULL ORDER BY name")
+        self.assertEqual([row[0] for row in rows],
+                         ['testflex_by_entity', 'testflex_by_key_foo'])
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.db = IndexedTestDatabase(':memory:')
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def plan(self, model_cls, query):
+        sql, subvals = self.db._fetch(model_cls, query)._select('id')
+        with self.db.transaction() as tx:
+            rows = tx.query('EXPLAIN QUERY PLAN ' + sql, subvals)
+        return ' '.join(row[3] for row in rows)
+
+    def test_declared_indices_created(self):
+        self.assertEqual(self.db.indices(IndexedTestModel), [
+            ('test_by_field_one', ('field_one',), True),
+            ('test_by_field_one_field_two', ('field_one', 'field_two'), True),
+        ])
+
+    def test_declared_index_used(self):
+        plan = self.plan(IndexedTestModel,
+                         dbcore.query.MatchQuery('field_one', 1))
+        self.assertIn('test_by_field_one', plan)
+
+    def test_add_and_drop_fixed_index(self):
+        name = self.db.add_index(IndexedTestModel, 'field_two')
+        self.assertEqual(name, 'test_by_field_two')
+        self.assertIn((name, ('field_two',), False),
+                      self.db.indices(IndexedTestModel))
+
+        self.assertTrue(self.db.drop_index(IndexedTestModel, 'field_two'))
+        self.assertNotIn(name, [n for n, _, _
+                                in self.db.indices(IndexedTestModel)])
+        self.assertFalse(self.db.drop_index(IndexedTestModel, 'field_two'))
+
+    def test_flex_index_used(self):
+        name = self.db.add_index(IndexedTestModel, 'some_float_field')
+        self.assertIn((name, ('some_float_field',), False),
+                      self.db.indices(IndexedTestModel))
+
+        query = dbcore.query.NumericQuery('some_float_field', '1..2', False)
+        query.bind_flex('testflex', dbcore.types.FLOAT)
+        self.assertIn(name, self.plan(IndexedTestModel, query))
+
+    def test_flex_index_matches_values(self):
+        self.db.add_index(IndexedTestModel, 'some_float_field')
+        for value in (1.0, 2.5):
+            IndexedTestModel(some_float_field=value).add(self.db)
+        query = dbcore.query.NumericQuery('some_float_field', '2..3', False)
+        query.bind_flex('testflex', dbcore.types.FLOAT)
+        results = self.db._fetch(IndexedTestModel, query)
+        self.assertEqual([m.some_float_field for m in results], [2.5])
+
+    def test_drop_declared_index_fails(self):
+        with self.assertRaises(ValueError):
+            self.db.drop_index(IndexedTestModel, 'field_one')
+
+    def test_flex_index_with_other_fields_fails(self):
+        with self.assertRaises(ValueError):
+            self.db.add_index(IndexedTestModel, ('field_one', 'foo'))
+
+    def logged_plans(self):
+        log = dbcore.db.log
+        level = log.level
+        log.setLevel(dbcore.db.logging.DEBUG)
+        try:
+            with capture_log() as logs:
+                list(self.db._fetch(IndexedTestModel))
+        finally:
+            log.setLevel(level)
+        return [m for m in logs if m.startswith('query plan')]
+
+    def test_query_plans_not_logged_by_default(self):
+        self.assertEqual(self.logged_plans(), [])
+
+    def test_query_plans_logged_when_enabled(self):
+        self.db.log_query_plans = True
+        self.assertEqual(len(self.logged_plans()), 1)
+
+    def test_invalid_field_name_fails(self):
+        with self.assertRaises(ValueError):
+            self.db.add_index(IndexedTestModel, "foo'; --")
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.db = JournalTestDatabase(':memory:')
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_records_add_store_remove(self):
+        model = TestModel1(field_one=1)
+        model.add(self.db)
+        model.field_one = 2
+        model.foo = 'bar'
+        model.store()
+        model.remove()
+
+        changes = self.db.changes_since(0)
+        self.assertEqual([(c.model, c.id, c.op) for c in changes], [
+            (TestModel1, model.id, 'add'),
+            (TestModel1, model.id, 'store'),
+            (TestModel1, model.id, 'remove'),
+        ])
+        self.assertEqual(changes[1].keys, ('field_one', 'foo'))
+        self.assertEqual(changes[2].keys, ())
+        self.assertEqual([c.seq for c in changes], [1, 2, 3])
+
+    def test_store_without_changes_not_recorded(self):
+        model = TestModel1()
+        model.add(self.db)
+        last = self.db.last_change()
+        model.store()
+        self.assertEqual(self.db.changes_since(last), [])
+
+    def test_changes_since(self):
+        models = [TestModel1(field_one=i) for i in range(3)]
+        self.db.add_many(models)
+        last = self.db.last_change()
+        models[1].field_one = 5
+        models[2].field_one = 6
+        self.db.store_many(models)
+
+        changes = self.db.changes_since(last)
+        self.assertEqual([c.id for c in changes],
+                         [models[1].id, models[2].id])
+        self.assertEqual(changes[0].seq, last + 1)
+        self.assertEqual(len(self.db.changes_since(last, limit=1)), 1)
+
+    def test_prune_keeps_sequence(self):
+        TestModel1().add(self.db)
+        TestModel1().add(self.db)
+        self.db.prune_changes(self.db.last_change())
+        self.assertEqual(self.db.changes_since(0), [])
+
+        TestModel1().add(self.db)
+        self.assertEqual([c.seq for c in self.db.changes_since(0)], [3])
+
+    def test_last_change_survives_prune(self):
+        TestModel1().add(self.db)
+        TestModel1().add(self.db)
+        self.db.prune_changes(2)
+        self.assertEqual(self.db.last_change(), 2)
+        self.assertEqual(self.db.first_change(), 3)
+
+    def test_first_change(self):
+        self.assertEqual(self.db.first_change(), 1)
+        for _ in range(3):
+            TestModel1().add(self.db)
+        self.assertEqual(self.db.first_change(), 1)
+        self.db.prune_changes(1)
+        self.assertEqual(self.db.first_change(), 2)
+
+    def test_journal_size_prunes_on_open(self):
+        handle, path = mkstemp('db')
+        os.close(handle)
+        db = JournalTestDatabase(path)
+        for _ in range(5):
+            TestModel1().add(db)
+        db._connection().close()
+
+        db = JournalTestDatabase(path, journal_size=2)
+        self.assertEqual([c.seq for c in db.changes_since(0)], [4, 5])
+        self.assertEqual(db.last_change(), 5)
+        db._connection().close()
+
+        db = JournalTestDatabase(path)
+        self.assertEqual(len(db.changes_since(0)), 2)
+        db._connection().close()
+        os.remove(path)
+
+    def test_no_journal(self):
+        db = TestDatabase1(':memory:')
+        TestModel1().add(db)
+        with self.assertRaises(ValueError):
+            db.changes_since(0)
+
+
+class CompactModelTest(unittest.TestCase):
+    def setUp(self):
+        self.db = CompactTestDatabase(':memory:')
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_uses_fixed_values(self):
+        model = CompactTestModel()
+        self.assertIsInstance(model._values_fixed, dbcore.db.FixedValues)
+        self.assertFalse(hasattr(model._values_fixed, '__dict__'))
+
+    def test_key_table_shared(self):
+        model1 = CompactTestModel()
+        model2 = CompactTestModel()
+        self.assertIs(model1._values_fixed._keys, model2._values_fixed._keys)
+
+    def test_fixed_values_mapping(self):
+        values = CompactTestModel()._values_fixed
+        values['field_one'] = 1
+        self.assertEqual(values['field_one'], 1)
+        self.assertEqual(values.get('field_two'), None)
+        self.assertEqual(list(values), ['field_one'])
+        self.assertEqual(len(values), 1)
+        self.assertTrue('field_one' in values)
+        self.assertFalse('field_two' in values)
+        del values['field_one']
+        self.assertFalse('field_one' in values)
+        with self.assertRaises(KeyError):
+            del values['field_one']
+
+    def test_store_and_retrieve(self):
+        model = CompactTestModel()
+        model.field_one = 1
+        model.field_two = 2
+        model.flex = u'value'
+        model.add(self.db)
+        other = self.db._get(CompactTestModel, model.id)
+        self.assertEqual(other.field_one, 1)
+        self.assertEqual(other.field_two, 2)
+        self.assertEqual(other.flex, u'value')
+        self.assertTrue(set(['id', 'field_one', 'field_two', 'flex'])
+                        .issubset(other.keys()))
+
+    def test_database_option(self):
+        db = TestDatabase2(':memory:')
+        db.compact_models = True
+        model = TestModel2()
+        model.field_one = 1
+        model.add(db)
+        self.assertIsInstance(model._values_fixed, dict)
+        loaded = list(db._fetch(TestModel2))
+        self.assertIsInstance(loaded[0]._values_fixed, dbcore.db.FixedValues)
+        self.assertEqual(loaded[0].field_one, 1)
+        self.assertIsInstance(TestModel2(db)._values_fixed,
+                              dbcore.db.FixedValues)
+        db._connection().close()
+
+    def test_dirty_set_created_on_write(self):
+        model = CompactTestModel()
+        model.add(self.db)
+        model = self.db._get(CompactTestModel, model.id)
+        self.assertIs(model._dirty, dbcore.db._CLEAN)
+        model.field_one = 1
+        self.assertEqual(model._dirty, set(['field_one']))
+        self.assertIs(self.db._get(CompactTestModel, model.id)._dirty,
+                      dbcore.db._CLEAN)
+
+    def test_clear_dirty_keys(self):
+        model = CompactTestModel()
+        model.field_one = 1
+        model.field_two = 2
+        model.clear_dirty('field_one')
+        self.assertEqual(model._dirty, set(['field_two']))
+
 
 class ModelTest(unittest.TestCase):
     def setUp(self):
@@ -467,8 +1012,9 @@ class SortFromStringsTest(unittest.TestCase):
 
     def test_flex_field_sort(self):
         s = self.sfs(['flex_field+'])
-        self.assertIsInstance(s, dbcore.query.SlowFieldSort)
-        self.assertEqual(s, dbcore.query.SlowFieldSort('flex_field'))
+        self.assertIsInstance(s, dbcore.query.FlexFieldSort)
+        self.assertEqual(s, dbcore.query.FlexFieldSort('flex_field'))
+        self.assertFalse(s.is_slow())
 
     def test_special_sort(self):
         s = self.sfs(['some_sort+'])
@@ -581,6 +1127,382 @@ class ResultsIteratorTest(unittest.TestCase):
         objs = self.db._fetch(TestModel1)
         self.assertEqual(len(objs), 2)
 
+    def test_length_does_not_fetch_rows(self):
+        objs = self.db._fetch(TestModel1)
+        self.assertEqual(len(objs), 2)
+        self.assertIsNone(objs._ids)
+
+    def test_length_with_fast_query(self):
+        q = dbcore.query.MatchQuery('id', 1)
+        self.assertEqual(len(self.db._fetch(TestModel1, q)), 1)
+        q = dbcore.query.MatchQuery('id', 3)
+        self.assertEqual(len(self.db._fetch(TestModel1, q)), 0)
+
+    def test_truthiness(self):
+        self.assertTrue(self.db._fetch(TestModel1))
+        q = dbcore.query.MatchQuery('id', 3)
+        self.assertFalse(self.db._fetch(TestModel1, q))
+
+    def test_truthiness_slow_query(self):
+        q = dbcore.query.SubstringQuery('foo', 'bar', False)
+        self.assertTrue(self.db._fetch(TestModel1, q))
+        q = dbcore.query.SubstringQuery('foo', 'qux', False)
+        self.assertFalse(self.db._fetch(TestModel1, q))
+
+    def test_stream(self):
+        objs = self.db._fetch(TestModel1)
+        self.assertEqual([o.foo for o in objs.stream()], ['baz', 'bar'])
+        self.assertEqual(objs._objects, [])
+
+    def test_stream_then_iterate(self):
+        objs = self.db._fetch(TestModel1)
+        list(objs.stream())
+        self.assertEqual([o.foo for o in objs], ['baz', 'bar'])
+
+    def test_stream_slow_sort(self):
+        s = dbcore.query.SlowFieldSort('foo')
+        objs = self.db._fetch(TestModel1, sort=s)
+        self.assertEqual([o.foo for o in objs.stream()], ['bar', 'baz'])
+
+    def test_removed_row_is_skipped(self):
+        objs = self.db._fetch(TestModel1)
+        len(objs)
+        self.db._get(TestModel1, 1).remove()
+        self.assertEqual([o.foo for o in objs], ['bar'])
+
+
+class ResultsSliceTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+        for foo in ['d', 'b', 'a', 'c']:
+            model = TestModel1()
+            model.foo = foo
+            model.field_one = ord(foo)
+            model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def foos(self, *args, **kwargs):
+        return [o.foo for o in self.db._fetch(TestModel1, *args, **kwargs)]
+
+    def test_limit(self):
+        self.assertEqual(self.foos(limit=2), ['d', 'b'])
+
+    def test_offset(self):
+        self.assertEqual(self.foos(offset=1), ['b', 'a', 'c'])
+
+    def test_limit_and_offset(self):
+        self.assertEqual(self.foos(limit=2, offset=1), ['b', 'a'])
+
+    def test_offset_past_end(self):
+        self.assertEqual(self.foos(offset=10), [])
+
+    def test_fast_sort(self):
+        s = dbcore.query.FixedFieldSort('field_one')
+        self.assertEqual(self.foos(sort=s, limit=2, offset=1), ['b', 'c'])
+
+    def test_slow_sort(self):
+        s = dbcore.query.SlowFieldSort('foo')
+        self.assertEqual(self.foos(sort=s, limit=2, offset=1), ['b', 'c'])
+
+    def test_slow_query(self):
+        q = dbcore.query.RegexpQuery('foo', '[abc]', False)
+        self.assertEqual(self.foos(q, limit=2, offset=1), ['a', 'c'])
+
+    def test_length(self):
+        self.assertEqual(len(self.db._fetch(TestModel1, limit=3)), 3)
+        self.assertEqual(len(self.db._fetch(TestModel1, offset=3)), 1)
+        q = dbcore.query.RegexpQuery('foo', '[abc]', False)
+        self.assertEqual(len(self.db._fetch(TestModel1, q, limit=5)), 3)
+
+    def test_truthiness(self):
+        self.assertTrue(self.db._fetch(TestModel1, offset=3))
+        self.assertFalse(self.db._fetch(TestModel1, offset=4))
+        q = dbcore.query.RegexpQuery('foo', '[abc]', False)
+        self.assertFalse(self.db._fetch(TestModel1, q, offset=3))
+
+    def test_stream(self):
+        objs = self.db._fetch(TestModel1, limit=2, offset=1)
+        self.assertEqual([o.foo for o in objs.stream()], ['b', 'a'])
+
+    def test_after(self):
+        self.assertEqual(self.foos(after=2), ['a', 'c'])
+        self.assertEqual(self.foos(after=1, limit=2), ['b', 'a'])
+
+    def test_after_with_slow_query(self):
+        q = dbcore.query.RegexpQuery('foo', '[bcd]', False)
+        self.assertEqual(self.foos(q, after=1), ['b', 'c'])
+
+    def test_after_with_sort_raises(self):
+        s = dbcore.query.FixedFieldSort('field_one')
+        with self.assertRaises(ValueError):
+            self.db._fetch(TestModel1, sort=s, after=1)
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+        for field_one, foo in [(1, 'a'), (2, 'a'), (4, None), (8, 'b')]:
+            model = TestModel1(field_one=field_one)
+            if foo:
+                model.foo = foo
+            model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def aggregate(self, query=None, *args, **kwargs):
+        return self.db._fetch(TestModel1, query).aggregate(*args, **kwargs)
+
+    def test_without_groups(self):
+        rows = self.aggregate(
+            count=aggregate.Count(),
+            sum=aggregate.Sum('field_one'),
+            min=aggregate.Min('field_one'),
+            max=aggregate.Max('field_one'),
+            foos=aggregate.CountDistinct('foo'),
+        )
+        self.assertEqual(rows, [{'count': 4, 'sum': 15, 'min': 1,
+                                 'max': 8, 'foos': 2}])
+
+    def test_group_by_flexattr(self):
+        rows = self.aggregate(group_by=('foo',),
+                              count=aggregate.Count(),
+                              sum=aggregate.Sum('field_one'))
+        self.assertEqual(rows, [
+            {'foo': None, 'count': 1, 'sum': 4},
+            {'foo': 'a', 'count': 2, 'sum': 3},
+            {'foo': 'b', 'count': 1, 'sum': 8},
+        ])
+
+    def test_sum_of_product(self):
+        rows = self.aggregate(sum=aggregate.Sum('field_one', 'field_one'))
+        self.assertEqual(rows[0]['sum'], 85)
+
+    def test_no_matches(self):
+        q = dbcore.query.MatchQuery('field_one', 3)
+        rows = self.aggregate(q, count=aggregate.Count(),
+                              sum=aggregate.Sum('field_one'),
+                              max=aggregate.Max('field_one'))
+        self.assertEqual(rows, [{'count': 0, 'sum': 0, 'max': None}])
+        self.assertEqual(self.aggregate(q, group_by=('foo',),
+                                        count=aggregate.Count()), [])
+
+    def test_fast_query(self):
+        q = dbcore.query.NumericQuery('field_one', '2..')
+        rows = self.aggregate(q, group_by=('foo',), count=aggregate.Count())
+        self.assertEqual([r['count'] for r in rows], [1, 1, 1])
+
+    def test_slow_query_matches_fast_query(self):
+        fast = dbcore.query.NumericQuery('field_one', '2..')
+        slow = dbcore.query.NumericQuery('field_one', '2..', False)
+        kwargs = dict(group_by=('foo',),
+                      count=aggregate.Count(),
+                      sum=aggregate.Sum('field_one'),
+                      foos=aggregate.CountDistinct('foo'))
+        self.assertEqual(self.aggregate(fast, **kwargs),
+                         self.aggregate(slow, **kwargs))
+
+    def test_limit(self):
+        rows = self.db._fetch(TestModel1, limit=2).aggregate(
+            sum=aggregate.Sum('field_one'))
+        self.assertEqual(rows[0]['sum'], 3)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.db = JournalTestDatabase(':memory:')
+        for field_one, foo in [(1, 'a'), (2, 'a'), (4, None), (8, 'b')]:
+            model = TestModel1(field_one=field_one)
+            if foo:
+                model.foo = foo
+            model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def snapshot(self, query=None, fields=('field_one', 'foo'), **kwargs):
+        return self.db._fetch(TestModel1, query).snapshot(fields, **kwargs)
+
+    def test_columns(self):
+        snap = self.snapshot()
+        self.assertEqual(len(snap), 4)
+        self.assertEqual(snap.fields, ['field_one', 'foo'])
+        self.assertTrue(dbcore.snapshot.is_numeric(snap['field_one']))
+        self.assertEqual(list(snap['field_one']), [1, 2, 4, 8])
+        self.assertEqual(list(snap['foo']), ['a', 'a', None, 'b'])
+
+    def test_aggregate_matches_results(self):
+        kwargs = dict(count=aggregate.Count(),
+                      sum=aggregate.Sum('field_one'),
+                      product=aggregate.Sum('field_one', 'field_one'),
+                      min=aggregate.Min('field_one'),
+                      max=aggregate.Max('field_one'),
+                      foos=aggregate.CountDistinct('foo'))
+        for group_by in ((), ('foo',)):
+            self.assertEqual(
+                self.snapshot().aggregate(group_by, **kwargs),
+                self.db._fetch(TestModel1).aggregate(group_by, **kwargs),
+            )
+
+    def test_no_matches(self):
+        q = dbcore.query.MatchQuery('field_one', 3)
+        rows = self.snapshot(q).aggregate(count=aggregate.Count(),
+                                          sum=aggregate.Sum('field_one'),
+                                          max=aggregate.Max('field_one'))
+        self.assertEqual(rows, [{'count': 0, 'sum': 0, 'max': None}])
+
+    def test_filter(self):
+        snap = self.snapshot()
+        snap = snap.filter([value > 1 for value in snap['field_one']])
+        self.assertEqual(list(snap['field_one']), [2, 4, 8])
+        self.assertEqual(list(snap['foo']), ['a', None, 'b'])
+
+    def test_slow_query_matches_fast_query(self):
+        fast = dbcore.query.NumericQuery('field_one', '2..')
+        slow = dbcore.query.NumericQuery('field_one', '2..', False)
+        fast_snap = self.snapshot(fast)
+        slow_snap = self.snapshot(slow)
+        self.assertEqual(list(fast_snap['field_one']),
+                         list(slow_snap['field_one']))
+        self.assertEqual(list(fast_snap['foo']), list(slow_snap['foo']))
+
+    def test_cache_reused_until_change(self):
+        fd, path = mkstemp()
+        os.close(fd)
+        try:
+            self.snapshot(cache=path)
+
+            # A raw write is not journaled, so the cached snapshot is
+            # still used.
+            with self.db.transaction() as tx:
+                tx.mutate('UPDATE test SET field_one = 16 WHERE id = 1')
+            snap = self.snapshot(cache=path)
+            self.assertEqual(list(snap['field_one']), [1, 2, 4, 8])
+            self.assertEqual(list(snap['foo']), ['a', 'a', None, 'b'])
+
+            model = self.db._get(TestModel1, 2)
+            model.field_one = 32
+            model.store()
+            snap = self.snapshot(cache=path)
+            self.assertEqual(list(snap['field_one']), [16, 32, 4, 8])
+        finally:
+            os.remove(path)
+
+    def test_cache_for_other_query_not_used(self):
+        fd, path = mkstemp()
+        os.close(fd)
+        try:
+            self.snapshot(cache=path)
+            q = dbcore.query.MatchQuery('field_one', 1)
+            snap = self.snapshot(q, cache=path)
+            self.assertEqual(list(snap['field_one']), [1])
+        finally:
+            os.remove(path)
+
+    def test_save_and_load_object_columns(self):
+        snap = dbcore.snapshot.Snapshot([
+            ('path', dbcore.snapshot.make_column(None, [b'/a\xff', None])),
+            ('title', dbcore.snapshot.make_column(None, [u'\xe9', u'b'])),
+            ('n', dbcore.snapshot.make_column(b'l', [1, 2])),
+        ], 'key')
+        fd, path = mkstemp()
+        os.close(fd)
+        try:
+            snap.save(path)
+            loaded = dbcore.snapshot.Snapshot.load(path, 'key')
+            self.assertEqual(list(loaded['path']), [b'/a\xff', None])
+            self.assertIsInstance(loaded['path'][0], bytes)
+            self.assertEqual(list(loaded['title']), [u'\xe9', u'b'])
+            self.assertEqual(list(loaded['n']), [1, 2])
+        finally:
+            os.remove(path)
+
+    def test_load_does_not_unpickle(self):
+        fd, path = mkstemp()
+        os.close(fd)
+        try:
+            data = pickle.dumps([1, 2], 2)
+            header = {'key': 'key', 'length': 2,
+                      'columns': [('foo', None, 0, len(data), None)]}
+            with open(path, 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n' + data)
+            self.assertIsNone(dbcore.snapshot.Snapshot.load(path, 'key'))
+        finally:
+            os.remove(path)
+
+
+class ResultsWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+        for i in range(5):
+            model = TestModel1()
+            model.field_one = i
+            model['foo'] = 'foo{0}'.format(i)
+            model.add(self.db)
+
+        self.window_size = dbcore.db.Results._window_size
+        dbcore.db.Results._window_size = 2
+
+    def tearDown(self):
+        dbcore.db.Results._window_size = self.window_size
+        self.db._connection().close()
+
+    def test_flex_values_across_windows(self):
+        objs = list(self.db._fetch(TestModel1))
+        self.assertEqual([o.foo for o in objs],
+                         ['foo{0}'.format(i) for i in range(5)])
+
+    def test_model_without_flex_values(self):
+        model = TestModel1()
+        model.add(self.db)
+        objs = list(self.db._fetch(TestModel1))
+        self.assertEqual(len(objs), 6)
+        self.assertNotIn('foo', objs[-1])
+
+    def test_slow_query_across_windows(self):
+        q = dbcore.query.SubstringQuery('foo', '3', False)
+        objs = list(self.db._fetch(TestModel1, q))
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].field_one, 3)
+
+    def test_first_window_does_not_read_remaining_ids(self):
+        results = self.db._fetch(TestModel1)
+        it = iter(results)
+        self.assertEqual(next(it).field_one, 0)
+        self.assertEqual(len(results._ids), 2)
+        self.assertEqual([o.field_one for o in it], [1, 2, 3, 4])
+        self.assertEqual(len(results._ids), 5)
+
+    def test_row_moved_into_first_window_is_not_repeated(self):
+        results = self.db._fetch(TestModel1, None,
+                                 dbcore.query.FixedFieldSort('field_one'))
+        it = iter(results)
+        self.assertEqual(next(it).field_one, 0)
+        with self.db.transaction() as tx:
+            tx.mutate('UPDATE test SET field_one = -1 WHERE field_one = 1')
+        self.assertEqual([o.field_one for o in it], [1, 2, 3, 4])
+
+    def test_get_by_id_runs_two_queries(self):
+        # Every query goes through `Transaction.cursor`.
+        cursor = dbcore.db.Transaction.cursor
+        with patch.object(dbcore.db.Transaction, 'cursor', autospec=True,
+                          side_effect=cursor) as mock_cursor:
+            self.assertEqual(self.db._get(TestModel1, 2).field_one, 1)
+        statements = [args[1] for args, _ in mock_cursor.call_args_list
+                      if not args[1].startswith('EXPLAIN')]
+        self.assertEqual(len(statements), 2)
+
+    def test_row_changed_after_query_is_skipped(self):
+        q = dbcore.query.NumericQuery('field_one', '..3')
+        results = self.db._fetch(TestModel1, q)
+        it = iter(results)
+        self.assertEqual(next(it).field_one, 0)
+        with self.db.transaction() as tx:
+            tx.mutate('UPDATE test SET field_one = 10 WHERE field_one = 2')
+        self.assertEqual([o.field_one for o in it], [1, 3])
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
@@ -30,7 +30,7 @@ from mock import patch
 
 from test import _common
 from test._common import unittest
-from beets.util import displayable_path
+from beets.util import displayable_path, pipeline
 from test.helper import TestImportSession, TestHelper, has_program, capture_log
 from beets import importer
 from beets.importer import albums_in_dir
@@ -38,6 +38,7 @@ from beets.mediafile import MediaFile
 from beets import autotag
 from beets.autotag import AlbumInfo, TrackInfo, AlbumMatch
 from beets import config
+from beets import plugins
 from beets import logging
 
 
@@ -266,6 +267,32 @@ class NonAutotaggedImportTest(_common.TestCase, ImportHelper):
                 'Tag Artist', 'Tag Album', '%s.mp3' % mediafile.title
             )
 
+    def test_stats_name_stages(self):
+        self.importer.run()
+        self.assertEqual(
+            [s.name for s in self.importer.stats],
+            ['read_tasks', 'read_files', 'create_tasks', 'import_asis',
+             'apply_choices', 'manipulate_files']
+        )
+        self.assertEqual(self.importer.stats[3].messages, 2)
+
+    def test_import_with_processes_reads_tags(self):
+        config['import']['processes'] = 2
+
+        self.importer.run()
+        self.assertEqual(set(i.title for i in self.lib.items()),
+                         set(m.title for m in self.import_media))
+        self.assertIsNone(pipeline._pool)
+
+    def test_import_singletons_with_processes(self):
+        config['import']['processes'] = 2
+        config['import']['singletons'] = True
+
+        self.importer.run()
+        self.assertEqual(set(i.title for i in self.lib.items()),
+                         set(m.title for m in self.import_media))
+        self.assertEqual(len(self.lib.albums()), 0)
+
     def test_import_with_move_deletes_import_files(self):
         config['import']['move'] = True
 
@@ -636,6 +663,71 @@ class ImportTest(_common.TestCase, ImportHelper):
             self.lib.items().get().data_source
 
 
+class StageWorkersTest(_common.TestCase, ImportHelper):
+    """Test running import stages in several threads.
+    """
+    def setUp(self):
+        self.setup_beets(disk=True)
+        self._create_import_dir(2)
+        self._setup_import_session()
+        self.matcher = AutotagStub().install()
+        self.matcher.matching = AutotagStub.GOOD
+
+    def tearDown(self):
+        self.teardown_beets()
+        self.matcher.restore()
+
+    def test_threaded_import_with_lookup_workers(self):
+        config['threaded'] = True
+        config['import']['workers'] = {'lookup_candidates': 3}
+        self.importer.add_choice(importer.action.APPLY)
+        self.importer.run()
+        self.assertEqual(self.lib.albums().get().album, 'Applied Album')
+
+    def test_import_with_event_loop(self):
+        config['threaded'] = True
+        config['import']['event_loop'] = True
+        self.importer.add_choice(importer.action.APPLY)
+        self.importer.run()
+        self.assertEqual(self.lib.albums().get().album, 'Applied Album')
+        self.assertEqual(self.importer.stats[3].name, 'lookup_candidates')
+        self.assertEqual(self.importer.stats[3].messages, 2)
+
+    def test_plugin_stages_named_after_plugin(self):
+        class StagePlugin(plugins.BeetsPlugin):
+            def __init__(self, name):
+                super(StagePlugin, self).__init__(name)
+                self.import_stages = [self.imported]
+
+            def imported(self, session, task):
+                pass
+
+        config['threaded'] = True
+        stage_plugins = [StagePlugin('one'), StagePlugin('two')]
+        self.importer.add_choice(importer.action.APPLY)
+        with patch('beets.plugins.find_plugins', lambda: stage_plugins):
+            self.importer.run()
+        names = [stats.name for stats in self.importer.stats]
+        self.assertIn('one.imported', names)
+        self.assertIn('two.imported', names)
+
+    def test_replicate_stage_with_workers(self):
+        config['import']['workers'] = {'lookup_candidates': 3}
+        self.importer.set_config(config['import'])
+        stage = self.importer.replicate('lookup_candidates',
+                                        importer.lookup_candidates,
+                                        self.importer)
+        self.assertIsInstance(stage, pipeline.ReplicatedStage)
+        self.assertEqual(len(stage), 3)
+
+    def test_serial_stage_not_replicated(self):
+        config['import']['workers'] = {'user_query': 3}
+        self.importer.set_config(config['import'])
+        stage = self.importer.replicate('user_query', importer.user_query,
+                                        self.importer)
+        self.assertNotIsInstance(stage, pipeline.ReplicatedStage)
+
+
 class ImportTracksTest(_common.TestCase, ImportHelper):
     """Test TRACKS and APPLY choice.
     """
@@ -25,6 +25,7 @@ import shutil
 import re
 import unicodedata
 import sys
+from mock import patch
 
 from test import _common
 from test._common import unittest
@@ -104,6 +105,69 @@ class AddTest(_common.TestCase):
         self.assertEqual(new_grouping, self.i.grouping)
 
 
+class StoreManyTest(_common.TestCase):
+    def setUp(self):
+        super(StoreManyTest, self).setUp()
+        self.lib = beets.library.Library(':memory:')
+        self.items = [item() for _ in range(3)]
+        self.album = self.lib.add_album(self.items)
+
+    def test_add_album_adds_items(self):
+        self.assertEqual(len(set(i.id for i in self.items)), 3)
+        self.assertEqual(len(self.album.items()), 3)
+
+    def test_store_many_items(self):
+        for i, it in enumerate(self.items):
+            it.track = i + 10
+        self.lib.store_many(self.items)
+        tracks = sorted(i.track for i in self.lib.items())
+        self.assertEqual(tracks, [10, 11, 12])
+
+    def test_store_many_propagates_album_fields(self):
+        self.album.albumartist = 'new artist'
+        self.lib.store_many([self.album])
+        for it in self.lib.items():
+            self.assertEqual(it.albumartist, 'new artist')
+
+    def test_store_many_sends_database_change(self):
+        self.album.albumartist = 'new artist'
+        handlers = {'database_change': [lambda lib, model: None]}
+        with patch('beets.plugins.event_handlers', return_value=handlers):
+            with patch('beets.plugins.send') as send:
+                self.lib.store_many([self.album])
+        models = [c[1]['model'] for c in send.call_args_list
+                  if c[0] == ('database_change',)]
+        self.assertEqual(len(models), 4)
+
+    def test_album_fields_propagated_without_loading_items(self):
+        self.album.albumartist = 'new artist'
+        with patch.object(beets.library.Album, 'items') as items:
+            with patch.object(beets.library.Library, 'items') as lib_items:
+                self.album.store()
+        self.assertFalse(items.called)
+        self.assertFalse(lib_items.called)
+        self.assertEqual(set(i.albumartist for i in self.lib.items()),
+                         set(['new artist']))
+
+    def test_propagation_updates_search_and_journal(self):
+        seq = self.lib.last_change()
+        self.album.albumartist = 'unusual'
+        self.album.store()
+        self.assertEqual(len(self.lib.items('unusual')), 3)
+        table = beets.library.Item._search_index()
+        if table:
+            rows = self.lib._connection().execute(
+                "SELECT rowid FROM {0} WHERE {0} MATCH 'unusual'".format(table)
+            ).fetchall()
+            self.assertEqual(len(rows), 3)
+        changes = self.lib.changes_since(seq)
+        self.assertEqual(
+            sorted((c.model, c.id) for c in changes
+                   if c.model is beets.library.Item),
+            sorted((beets.library.Item, i.id) for i in self.items),
+        )
+
+
 class RemoveTest(_common.LibTestCase):
     def test_remove_deletes_from_db(self):
         self.i.remove()
@@ -468,6 +532,34 @@ class DestinationTest(_common.TestCase):
         dest = self.i.destination()
         self.assertTrue('XZ' in dest)
 
+    def test_destinations_match_destination(self):
+        self.lib.directory = 'base'
+        self.lib.path_formats = [('comp:true', 'comps/$title'),
+                                 ('default', '$artist/$album/$title')]
+        items = []
+        for i, comp in enumerate([False, True, False]):
+            it = item(self.lib)
+            it.title = 'title {0}'.format(i)
+            it.comp = comp
+            items.append(it)
+        self.lib.add_album(items[:2])
+
+        dests = list(self.lib.destinations(items))
+        self.assertEqual([i for i, _ in dests], items)
+        self.assertEqual([d for _, d in dests],
+                         [i.destination() for i in items])
+        self.assertEqual(dests[1][1], np('base/comps/title 1'))
+
+    def test_destinations_share_album_lookup(self):
+        self.lib.path_formats = [('default', '$album/$title')]
+        items = [item(self.lib), item(self.lib)]
+        self.lib.add_album(items)
+        with patch.object(beets.library.Item, 'get_album',
+                          autospec=True,
+                          side_effect=beets.library.Item.get_album) as m:
+            list(self.lib.destinations(items, fragment=True))
+        self.assertEqual(m.call_count, 1)
+
 
 class ItemFormattedMappingTest(_common.LibTestCase):
     def test_formatted_item_value(self):
@@ -652,6 +744,61 @@ class DisambiguationTest(_common.TestCase, PathFormattingMixin):
         self._setf(u'foo%aunique{albumartist album,month year}/$title')
         self._assert_dest('/base/foo [2001]/the title', self.i1)
 
+    def test_album_change_after_lookup(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        album2 = self.lib.get_album(self.i2)
+        album2.album = 'different album'
+        album2.store()
+        self._assert_dest('/base/foo/the title', self.i1)
+
+    def test_new_album_after_lookup(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        i3 = item()
+        i3.year = 2001
+        self.lib.add_album([i3])
+        self._assert_dest('/base/foo 1/the title', self.i1)
+
+    def test_removed_album_after_lookup(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        self.lib.get_album(self.i2).remove()
+        self._assert_dest('/base/foo/the title', self.i1)
+
+    def test_unrelated_change_keeps_index(self):
+        index = self.lib._aunique_index(('albumartist', 'album'), ('year',))
+        stats = index.get(self.lib.get_album(self.i1))
+        self.assertEqual(stats, (2, [2]))
+        album2 = self.lib.get_album(self.i2)
+        album2.artpath = b'/art.jpg'
+        album2.store()
+        self.assertIs(index.get(album2), stats)
+
+    def test_item_change_keeps_index(self):
+        index = self.lib._aunique_index(('albumartist', 'album'), ('year',))
+        index.get(self.lib.get_album(self.i1))
+        self.i1.title = 'another title'
+        self.i1.store()
+        with patch.object(index, '_build') as build:
+            index.get(self.lib.get_album(self.i1))
+        self.assertFalse(build.called)
+
+    def test_album_change_from_other_library(self):
+        path = os.path.join(self.temp_dir, b'library.db')
+        lib = beets.library.Library(path)
+        i1, i2 = item(), item()
+        lib.add_album([i1])
+        lib.add_album([i2])
+        index = lib._aunique_index(('albumartist', 'album'), ('year',))
+        album1 = lib.get_album(i1)
+        self.assertEqual(index.get(album1)[0], 2)
+
+        other = beets.library.Library(path)
+        album2 = other.get_album(i2)
+        album2.album = 'different album'
+        album2.store()
+        other._connection().close()
+        self.assertEqual(index.get(album1)[0], 1)
+        lib._connection().close()
+
     def test_unique_sanitized(self):
         album2 = self.lib.get_album(self.i2)
         album2.year = 2001
@@ -782,6 +929,22 @@ class AlbumInfoTest(_common.TestCase):
         self.assertEqual(i.albumartist, 'myNewArtist')
         self.assertNotEqual(i.artist, 'myNewArtist')
 
+    def test_albuminfo_change_marks_items_dirty(self):
+        self.i.mtime = 12345.0
+        self.i.store()
+        ai = self.lib.get_album(self.i)
+        ai.album = 'myNewAlbum'
+        ai.store()
+        self.assertEqual(self.lib.items()[0].mtime, 0)
+
+    def test_albuminfo_non_tag_change_keeps_mtime(self):
+        self.i.mtime = 12345.0
+        self.i.store()
+        ai = self.lib.get_album(self.i)
+        ai.artpath = '/my/great/art'
+        ai.store()
+        self.assertEqual(self.lib.items()[0].mtime, 12345.0)
+
     def test_albuminfo_change_artist_does_not_change_items(self):
         ai = self.lib.get_album(self.i)
         ai.artist = 'myNewArtist'
@@ -1111,6 +1274,34 @@ class ParseQueryTest(unittest.TestCase):
             beets.library.parse_query_string(b"query", None)
 
 
+class SnapshotTest(_common.LibTestCase):
+    def test_cache_with_path_query(self):
+        self.i.path = os.path.join(self.temp_dir, b'song.mp3')
+        self.i.store()
+        cache = os.path.join(self.temp_dir, b'snapshot')
+        query = 'path:{0}'.format(util.displayable_path(self.i.path))
+        snap = self.lib.snapshot(['title', 'path'], query, cache)
+        self.assertEqual(list(snap['path']), [self.i.path])
+
+        # The second call reads the cache file.
+        with patch.object(beets.dbcore.db.Results, '_snapshot_column') \
+                as snapshot_column:
+            snap = self.lib.snapshot(['title', 'path'], query, cache)
+        self.assertFalse(snapshot_column.called)
+        self.assertEqual(list(snap['title']), [self.i.title])
+        self.assertEqual(list(snap['path']), [self.i.path])
+
+    @unittest.skipUnless(beets.dbcore.snapshot.numpy, 'NumPy not installed')
+    def test_numpy_columns(self):
+        numpy = beets.dbcore.snapshot.numpy
+        snap = self.lib.snapshot(['year', 'title'])
+        self.assertIsInstance(snap['year'], numpy.ndarray)
+        self.assertEqual(snap['year'].dtype, numpy.dtype(b'l'))
+        self.assertEqual(list(snap['year']), [self.i.year])
+        snap = snap.filter(snap['year'] > self.i.year)
+        self.assertEqual(len(snap), 0)
+
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
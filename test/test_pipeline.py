@@ -17,6 +17,9 @@
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
+import threading
+import time
+
 from test._common import unittest
 from beets.util import pipeline
 
@@ -73,6 +76,89 @@ def _multi_work():
         i = pipeline.multiple([i, -i])
 
 
+# A worker that takes longer for earlier messages.
+def _slow_work(num=5):
+    i = None
+    while True:
+        i = yield i
+        time.sleep((num - i) * 0.01)
+        i *= 2
+
+
+# A worker that waits for a call that takes longer for earlier messages.
+@pipeline.async_stage
+def _async_work(num, i):
+    yield pipeline.call(time.sleep, (num - i) * 0.01)
+    yield i * 2
+
+
+# A worker that waits for a call that returns once all the other calls
+# it has made are running.
+class _Rendezvous(object):
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+        self.all_running = threading.Event()
+
+    def double(self, i):
+        with self.lock:
+            self.count -= 1
+            if not self.count:
+                self.all_running.set()
+        # Give up eventually rather than hang.
+        if not self.all_running.wait(10):
+            raise TestException()
+        return i * 2
+
+
+@pipeline.async_stage
+def _async_meet(rendezvous, i):
+    doubled = yield pipeline.call(rendezvous.double, i)
+    yield doubled
+
+
+# A worker that waits for a call that returns at once.
+@pipeline.async_stage
+def _async_double(i):
+    doubled = yield pipeline.call(lambda: i * 2)
+    yield doubled
+
+
+# A worker that changes a message in place after waiting.
+@pipeline.async_stage
+def _async_mutate(d):
+    d['value'] = yield pipeline.call(lambda: d['key'] * 2)
+
+
+# An asynchronous worker whose call raises an exception.
+@pipeline.async_stage
+def _async_exc_work(num, i):
+    def _fail():
+        raise TestException()
+    if i == num:
+        yield pipeline.call(_fail)
+    yield i * 2
+
+
+# A worker that runs in another process.
+@pipeline.process_stage
+def _process_work(factor, i):
+    return i * factor
+
+
+# A function to be made into a process stage without the decorator.
+def _square(i):
+    return i * i
+
+
+# A worker that fails in another process.
+@pipeline.process_stage
+def _process_exc_work(num, i):
+    if i == num:
+        raise TestException()
+    return i * 2
+
+
 class SimplePipelineTest(unittest.TestCase):
     def setUp(self):
         self.l = []
@@ -86,6 +172,10 @@ class SimplePipelineTest(unittest.TestCase):
         self.pl.run_parallel()
         self.assertEqual(self.l, [0, 2, 4, 6, 8])
 
+    def test_run_async(self):
+        self.pl.run_async()
+        self.assertEqual(self.l, [0, 2, 4, 6, 8])
+
     def test_pull(self):
         pl = pipeline.Pipeline((_produce(), _work()))
         self.assertEqual(list(pl.pull()), [0, 2, 4, 6, 8])
@@ -112,11 +202,207 @@ class ParallelStageTest(unittest.TestCase):
         # Order possibly not preserved; use set equality.
         self.assertEqual(set(self.l), set([0, 2, 4, 6, 8]))
 
+    def test_run_async(self):
+        self.pl.run_async()
+        self.assertEqual(self.l, [0, 2, 4, 6, 8])
+
     def test_pull(self):
         pl = pipeline.Pipeline((_produce(), (_work(), _work())))
         self.assertEqual(list(pl.pull()), [0, 2, 4, 6, 8])
 
 
+class ReplicatedStageTest(unittest.TestCase):
+    def setUp(self):
+        self.out = []
+        self.pl = pipeline.Pipeline((
+            _produce(), pipeline.replicate([_slow_work(), _slow_work()]),
+            _consume(self.out)
+        ))
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assertEqual(self.out, [0, 2, 4, 6, 8])
+
+    def test_run_parallel_preserves_order(self):
+        self.pl.run_parallel()
+        self.assertEqual(self.out, [0, 2, 4, 6, 8])
+
+    def test_run_parallel_constrained(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(1000), pipeline.replicate([_work() for _ in range(4)]),
+            _consume(out)
+        ))
+        pl.run_parallel(1)
+        self.assertEqual(out, [i * 2 for i in range(1000)])
+
+    def test_bubbles_and_multiple_messages(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(), pipeline.replicate([_bub_work(), _bub_work()]),
+            pipeline.replicate([_multi_work(), _multi_work()]),
+            _consume(out)
+        ))
+        pl.run_parallel()
+        self.assertEqual(out, [0, 0, 2, -2, 4, -4, 8, -8])
+
+    def test_exception(self):
+        pl = pipeline.Pipeline((
+            _produce(1000),
+            pipeline.replicate([_exc_work(), _exc_work()]),
+            _consume([])
+        ))
+        self.assertRaises(TestException, pl.run_parallel, 1)
+
+    def test_first_stage_cannot_be_replicated(self):
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline((pipeline.replicate([_produce()]),
+                               _consume([])))
+
+
+class StatsTest(unittest.TestCase):
+    def test_pull_counts_messages(self):
+        pl = pipeline.Pipeline((_produce(), _multi_work()))
+        list(pl.pull())
+        self.assertEqual([s.messages for s in pl.stats], [5, 5])
+
+    def test_run_parallel_counts_messages(self):
+        pl = pipeline.Pipeline((
+            _produce(), _bub_work(),
+            pipeline.replicate([_work(), _work()]), _consume([])
+        ))
+        pl.run_parallel(1)
+        self.assertEqual([s.messages for s in pl.stats], [5, 5, 4, 4])
+        for stats in pl.stats:
+            self.assertLessEqual(stats.peak_queue, 1)
+
+    def test_run_parallel_measures_time(self):
+        pl = pipeline.Pipeline((_produce(), _slow_work(), _consume([])))
+        pl.run_parallel()
+        self.assertGreater(pl.stats[1].busy, 0.1)
+        self.assertGreater(pl.stats[2].input_wait, 0.05)
+
+    def test_names(self):
+        pl = pipeline.Pipeline((_produce(), _work()), ['read', 'work'])
+        self.assertEqual(pl.stats[1].as_dict()['name'], 'work')
+
+    def test_default_names(self):
+        pl = pipeline.Pipeline((_produce(), _work()))
+        self.assertEqual([s.name for s in pl.stats], ['_produce', '_work'])
+
+    def test_wrong_number_of_names(self):
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline((_produce(), _work()), ['read'])
+
+
+class AsyncStageTest(unittest.TestCase):
+    def setUp(self):
+        self.out = []
+        self.pl = pipeline.Pipeline((
+            _produce(), _async_work(5), _consume(self.out)
+        ))
+
+    def test_run_async_preserves_order(self):
+        self.pl.run_async()
+        self.assertEqual(self.out, [0, 2, 4, 6, 8])
+
+    def test_run_async_overlaps_calls(self):
+        # Each call waits until all of them are running, so the
+        # pipeline only finishes if it makes them at the same time.
+        rendezvous = _Rendezvous(10)
+        pl = pipeline.Pipeline((
+            _produce(10), _async_meet(rendezvous), _consume(self.out)
+        ))
+        pl.run_async(threads=10)
+        self.assertEqual(self.out, [i * 2 for i in range(10)])
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assertEqual(self.out, [0, 2, 4, 6, 8])
+
+    def test_run_parallel(self):
+        self.pl.run_parallel()
+        self.assertEqual(self.out, [0, 2, 4, 6, 8])
+
+    def test_mutator(self):
+        pl = pipeline.Pipeline((
+            iter([{'key': 1}, {'key': 2}]), _async_mutate()
+        ))
+        self.assertEqual(list(pl.pull()), [{'key': 1, 'value': 2},
+                                           {'key': 2, 'value': 4}])
+        out = []
+        pl = pipeline.Pipeline((
+            iter([{'key': 1}, {'key': 2}]), _async_mutate(), _consume(out)
+        ))
+        pl.run_async()
+        self.assertEqual(out, [{'key': 1, 'value': 2},
+                               {'key': 2, 'value': 4}])
+
+    def test_exception_in_call(self):
+        pl = pipeline.Pipeline((
+            _produce(), _async_exc_work(3), _consume(self.out)
+        ))
+        self.assertRaises(TestException, pl.run_async)
+
+    def test_exception_in_call_sequential(self):
+        pl = pipeline.Pipeline((
+            _produce(), _async_exc_work(3), _consume(self.out)
+        ))
+        self.assertRaises(TestException, pl.run_sequential)
+
+    def test_first_stage_cannot_be_async(self):
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline((_async_work(5), _consume([])))
+
+
+class ProcessStageTest(unittest.TestCase):
+    def tearDown(self):
+        pipeline.stop_processes()
+
+    def test_pull(self):
+        pl = pipeline.Pipeline((_produce(), _process_work(3)))
+        self.assertEqual(list(pl.pull()), [0, 3, 6, 9, 12])
+
+    def test_run_parallel_replicated(self):
+        out = []
+        pipeline.start_processes(2)
+        pl = pipeline.Pipeline((
+            _produce(100),
+            pipeline.replicate([_process_work(2) for _ in range(4)]),
+            _consume(out)
+        ))
+        pl.run_parallel()
+        self.assertEqual(out, [i * 2 for i in range(100)])
+
+    def test_run_async(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(100), _process_work(2), _consume(out)
+        ))
+        pl.run_async(queue_size=4, threads=2)
+        self.assertEqual(out, [i * 2 for i in range(100)])
+
+    def test_undecorated_function(self):
+        stage = pipeline.process_stage(_square)
+        pl = pipeline.Pipeline((_produce(), stage()))
+        self.assertEqual(list(pl.pull()), [0, 1, 4, 9, 16])
+
+    def test_exception_in_process(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(), _process_exc_work(3), _consume(out)
+        ))
+        self.assertRaises(TestException, pl.run_parallel)
+
+    def test_pool_is_shared(self):
+        pool = pipeline.start_processes(2)
+        self.assertIs(pipeline.start_processes(), pool)
+
+    def test_stage_named_after_function(self):
+        pl = pipeline.Pipeline((_produce(), _process_work(3)))
+        self.assertEqual(pl.stats[1].name, '_process_work')
+
+
 class ExceptionTest(unittest.TestCase):
     def setUp(self):
         self.l = []
@@ -129,6 +415,9 @@ class ExceptionTest(unittest.TestCase):
     def test_run_parallel(self):
         self.assertRaises(TestException, self.pl.run_parallel)
 
+    def test_run_async(self):
+        self.assertRaises(TestException, self.pl.run_async)
+
     def test_pull(self):
         pl = pipeline.Pipeline((_produce(), _exc_work()))
         pull = pl.pull()
@@ -147,6 +436,9 @@ class ParallelExceptionTest(unittest.TestCase):
     def test_run_parallel(self):
         self.assertRaises(TestException, self.pl.run_parallel)
 
+    def test_run_async(self):
+        self.assertRaises(TestException, self.pl.run_async)
+
 
 class ConstrainedThreadedPipelineTest(unittest.TestCase):
     def test_constrained(self):
@@ -163,6 +455,14 @@ class ConstrainedThreadedPipelineTest(unittest.TestCase):
         pl = pipeline.Pipeline((_produce(1000), _exc_work(), _consume(l)))
         self.assertRaises(TestException, pl.run_parallel, 1)
 
+    def test_constrained_async(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(1000), _work(), _async_double(), _consume(out)
+        ))
+        pl.run_async(1, 2)
+        self.assertEqual(out, [i * 4 for i in range(1000)])
+
     def test_constrained_parallel(self):
         l = []
         pl = pipeline.Pipeline((
@@ -186,6 +486,10 @@ class BubbleTest(unittest.TestCase):
         self.pl.run_parallel()
         self.assertEqual(self.l, [0, 2, 4, 8])
 
+    def test_run_async(self):
+        self.pl.run_async()
+        self.assertEqual(self.l, [0, 2, 4, 8])
+
     def test_pull(self):
         pl = pipeline.Pipeline((_produce(), _bub_work()))
         self.assertEqual(list(pl.pull()), [0, 2, 4, 8])
@@ -206,6 +510,10 @@ class MultiMessageTest(unittest.TestCase):
         self.pl.run_parallel()
         self.assertEqual(self.l, [0, 0, 1, -1, 2, -2, 3, -3, 4, -4])
 
+    def test_run_async(self):
+        self.pl.run_async()
+        self.assertEqual(self.l, [0, 0, 1, -1, 2, -2, 3, -3, 4, -4])
+
     def test_pull(self):
         pl = pipeline.Pipeline((_produce(), _multi_work()))
         self.assertEqual(list(pl.pull()), [0, 0, 1, -1, 2, -2, 3, -3, 4, -4])
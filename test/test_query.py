@@ -30,7 +30,7 @@ from beets import dbcore
 from beets.dbcore import types
 from beets.dbcore.query import (NoneQuery, ParsingError,
                                 InvalidQueryArgumentTypeError)
-from beets.library import Library, Item
+from beets.library import Library, Item, parse_query_string
 
 
 class TestHelper(helper.TestHelper):
@@ -683,6 +683,216 @@ class NoneQueryTest(unittest.TestCase, TestHelper):
         self.assertInResult(item, matched)
 
 
+class FlexQueryClauseTest(unittest.TestCase, TestHelper):
+    """Queries on flexible attributes are evaluated in SQLite.
+    """
+    def setUp(self):
+        self.lib = Library(':memory:')
+        Item._types = {'myint': types.Integer(),
+                       'myfloat': types.Float()}
+
+    def tearDown(self):
+        Item._types = {}
+
+    def assert_fast(self, query_string):
+        q, _ = beets.library.parse_query_string(query_string, Item)
+        clause, _ = q.clause()
+        self.assertIsNotNone(clause)
+
+    def test_typed_numeric_query_is_fast(self):
+        self.assert_fast('myint:2..10')
+
+    def test_untyped_substring_query_is_fast(self):
+        self.assert_fast('myflex:foo')
+
+    def test_computed_field_query_is_slow(self):
+        q, _ = beets.library.parse_query_string('singleton:true', Item)
+        clause, _ = q.clause()
+        self.assertIsNone(clause)
+
+    def test_numeric_range_compares_numbers(self):
+        item = self.add_item(myint=9)
+        self.add_item(myint=10)
+        self.add_item()
+        matched = self.lib.items('myint:..9')
+        self.assertEqual([i.id for i in matched], [item.id])
+
+    def test_float_range(self):
+        item = self.add_item(myfloat=0.5)
+        self.add_item(myfloat=1.5)
+        matched = self.lib.items('myfloat:0..1')
+        self.assertEqual([i.id for i in matched], [item.id])
+
+    def test_substring_match(self):
+        item = self.add_item(myflex='foobar')
+        self.add_item(myflex='baz')
+        self.add_item()
+        matched = self.lib.items('myflex:oba')
+        self.assertEqual([i.id for i in matched], [item.id])
+
+    def test_empty_substring_matches_missing(self):
+        self.add_item(myflex='foobar')
+        self.add_item()
+        matched = self.lib.items('myflex:')
+        self.assertEqual(len(list(matched)), 2)
+
+    def test_none_query_matches_missing(self):
+        item = self.add_item()
+        self.add_item(myflex='foobar')
+        q = NoneQuery('myflex', False)
+        q.bind_flex('item_attributes')
+        self.assertIsNotNone(q.clause()[0])
+        matched = self.lib.items(q)
+        self.assertEqual([i.id for i in matched], [item.id])
+
+
+class ReversedQuery(dbcore.query.StringFieldQuery):
+    @classmethod
+    def string_match(cls, pattern, value):
+        return pattern[::-1] in value
+
+
+class SQLFunctionQueryTest(unittest.TestCase, TestHelper):
+    """Regular expression and custom string queries are evaluated
+    inside SQLite.
+    """
+    def setUp(self):
+        self.lib = Library(':memory:')
+        self.item = self.add_item(title='the title', myflex='foobar')
+        self.add_item(title='other', myflex='baz')
+
+    def test_regexp_has_clause(self):
+        q = dbcore.query.RegexpQuery('title', '^the')
+        self.assertIsNotNone(q.clause()[0])
+
+    def test_regexp_fixed_field(self):
+        matched = self.lib.items('title::^the.*e$')
+        self.assertEqual([i.id for i in matched], [self.item.id])
+
+    def test_regexp_flex_field(self):
+        matched = self.lib.items('myflex::^fo+b')
+        self.assertEqual([i.id for i in matched], [self.item.id])
+
+    def test_regexp_any_field(self):
+        matched = self.lib.items(':^oth')
+        self.assertEqual([i.title for i in matched], ['other'])
+
+    def test_custom_string_query(self):
+        q = ReversedQuery('title', 'eltit')
+        self.assertIsNotNone(q.clause()[0])
+        matched = self.lib.items(q)
+        self.assertEqual([i.id for i in matched], [self.item.id])
+
+
+@unittest.skipUnless(dbcore.db.search_index_supported(),
+                     'SQLite cannot build full-text indices')
+class SearchIndexTest(unittest.TestCase, TestHelper):
+    """Unqualified substring queries use the full-text index.
+    """
+    def setUp(self):
+        self.lib = Library(':memory:')
+        self.item = self.add_item(title='Yellow Submarine',
+                                  artist='The Beatles')
+        self.add_item(title='Paint It Black', artist='The Rolling Stones')
+
+    def titles(self, query):
+        return sorted(i.title for i in self.lib.items(query))
+
+    def test_query_uses_index(self):
+        q, _ = parse_query_string('beatles', Item)
+        self.assertIn('items_search', q.clause()[0])
+
+    def test_short_pattern_does_not_use_index(self):
+        q, _ = parse_query_string('be', Item)
+        self.assertNotIn('items_search', q.clause()[0])
+
+    def test_substring_match(self):
+        self.assertEqual(self.titles('eatl'), ['Yellow Submarine'])
+        self.assertEqual(self.titles('the'), ['Paint It Black',
+                                              'Yellow Submarine'])
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.titles('SUBMAR'), ['Yellow Submarine'])
+
+    def test_phrase_with_quotes(self):
+        self.add_item(title='"Heroes"')
+        self.assertEqual(self.titles(['"hero']), ['"Heroes"'])
+
+    def test_stored_changes_are_indexed(self):
+        self.item.title = 'Octopus\'s Garden'
+        self.item.store()
+        self.assertEqual(self.titles('octopus'), ['Octopus\'s Garden'])
+        self.assertEqual(self.titles('submarine'), [])
+
+    def test_removed_item_is_not_found(self):
+        self.item.remove()
+        self.assertEqual(self.titles('beatles'), [])
+
+    def test_dropped_index_is_rebuilt_on_open(self):
+        self.create_temp_dir()
+        path = os.path.join(self.temp_dir, b'library.db')
+        lib = Library(path)
+        lib.add(Item(title=u'Yellow Submarine'))
+        with lib.transaction() as tx:
+            tx.script('DROP TABLE items_search')
+        lib._connection().close()
+
+        self.lib = Library(path)
+        self.assertEqual(self.titles('submarine'), [u'Yellow Submarine'])
+        self.lib._connection().close()
+        self.remove_temp_dir()
+
+    def test_non_ascii_case_matches_like(self):
+        self.add_item(title=u'Bj\xf6rk')
+        self.assertEqual(self.titles(u'bj\xf6r'), [u'Bj\xf6rk'])
+        self.assertEqual(self.titles(u'BJ\xd6R'), [])
+
+    def test_raw_sql_changes_are_indexed(self):
+        with self.lib.transaction() as tx:
+            tx.mutate('UPDATE items SET title=? WHERE id=?',
+                      (u'Octopus\'s Garden', self.item.id))
+            tx.mutate('INSERT INTO items (title) VALUES (?)',
+                      (u'Here Comes the Sun',))
+        self.assertEqual(self.titles('octopus'), [u'Octopus\'s Garden'])
+        self.assertEqual(self.titles('submarine'), [])
+        self.assertEqual(self.titles('comes'), [u'Here Comes the Sun'])
+
+        with self.lib.transaction() as tx:
+            tx.mutate('DELETE FROM items WHERE id=?', (self.item.id,))
+        with self.lib.transaction() as tx:
+            rows = tx.query('SELECT rowid FROM items_search')
+        self.assertNotIn(self.item.id, [row[0] for row in rows])
+
+    def test_store_matching_is_indexed(self):
+        self.lib.store_matching(Item, dbcore.query.MatchQuery(
+            'id', self.item.id
+        ), {'title': u'Octopus\'s Garden'})
+        self.assertEqual(self.titles('octopus'), [u'Octopus\'s Garden'])
+
+    def test_dropped_trigger_rebuilds_index_on_open(self):
+        self.create_temp_dir()
+        path = os.path.join(self.temp_dir, b'library.db')
+        lib = Library(path)
+        lib.add(Item(title=u'Yellow Submarine'))
+        with lib.transaction() as tx:
+            tx.script('DROP TRIGGER items_search_update')
+            tx.mutate('UPDATE items SET title=?', (u'Octopus\'s Garden',))
+        lib._connection().close()
+
+        self.lib = Library(path)
+        self.assertEqual(self.titles('octopus'), [u'Octopus\'s Garden'])
+        self.assertEqual(self.titles('submarine'), [])
+        self.lib._connection().close()
+        self.remove_temp_dir()
+
+    def test_existing_rows_are_indexed(self):
+        with self.lib.transaction() as tx:
+            tx.script('DROP TABLE items_search')
+        self.lib._make_search_table('items_search', 'items',
+                                    Item._search_fields)
+        self.assertEqual(self.titles('beatles'), ['Yellow Submarine'])
+
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -0,0 +1,73 @@
+# This file is part of beets.
+# Copyright 2015, Philippe Mongeau.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Tests for the 'random' plugin."""
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from mock import patch
+
+from test._common import unittest
+from test.helper import TestHelper
+
+from beetsplug.random import _sample
+
+
+class SampleTest(unittest.TestCase, TestHelper):
+    def setUp(self):
+        self.setup_beets()
+        self.items = [self.add_item(title='t{0}'.format(i))
+                      for i in range(5)]
+
+    def tearDown(self):
+        self.teardown_beets()
+
+    def test_sample_items(self):
+        objs = _sample(self.lib, None, False, 3)
+        self.assertEqual(len(objs), 3)
+        self.assertEqual(len(set(obj.id for obj in objs)), 3)
+
+    def test_sample_more_than_available(self):
+        objs = _sample(self.lib, None, False, 10)
+        self.assertEqual(sorted(obj.id for obj in objs),
+                         sorted(item.id for item in self.items))
+
+    def test_sample_with_query(self):
+        objs = _sample(self.lib, 'title:t3', False, 2)
+        self.assertEqual([obj.title for obj in objs], ['t3'])
+
+    def test_sample_albums(self):
+        self.lib.add_album(self.items[:2])
+        objs = _sample(self.lib, None, True, 2)
+        self.assertEqual(len(objs), 1)
+
+    def test_removed_objects_are_skipped(self):
+        removed = self.items[0].id
+        get_item = self.lib.get_item
+
+        def get_remaining(id):
+            return None if id == removed else get_item(id)
+
+        with patch.object(self.lib, 'get_item', get_remaining):
+            objs = _sample(self.lib, None, False, 5)
+        self.assertEqual(sorted(obj.id for obj in objs),
+                         sorted(item.id for item in self.items[1:]))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == b'__main__':
+    unittest.main(defaultTest='suite')
@@ -188,6 +188,19 @@ class SortFlexFieldTest(DummyDataTestCase):
         for r1, r2 in zip(results, results2):
             self.assertEqual(r1.id, r2.id)
 
+    def test_sort_in_database(self):
+        results = self.lib.items('flex1-')
+        self.assertIsNone(results.sort)
+        self.assertEqual([r.flex1 for r in results],
+                         ['Flex1-2', 'Flex1-2', 'Flex1-1', 'Flex1-0'])
+
+    def test_sort_missing_values_first(self):
+        item = _common.item()
+        item.title = 'No flex'
+        self.lib.add(item)
+        results = self.lib.items('flex1+')
+        self.assertEqual(results[0].title, 'No flex')
+
 
 class SortAlbumFixedFieldTest(DummyDataTestCase):
     def test_sort_asc(self):
@@ -439,6 +452,25 @@ class CaseSensitivityTest(DummyDataTestCase, _common.TestCase):
         self.assertEqual(results[-1].flex1, 'flex1')
 
 
+class SortIndexTest(DummyDataTestCase):
+    def query_plan(self, results):
+        sql, subvals = results._select('id')
+        with self.lib.transaction() as tx:
+            rows = tx.query('EXPLAIN QUERY PLAN ' + sql, subvals)
+        return ' '.join(row[3] for row in rows)
+
+    def test_smart_artist_sort_uses_index(self):
+        config['sort_case_insensitive'] = True
+        plan = self.query_plan(self.lib.items('artist+'))
+        self.assertIn('items_sorted_by_artist', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_smart_album_artist_sort_uses_index(self):
+        config['sort_case_insensitive'] = True
+        plan = self.query_plan(self.lib.albums('albumartist-'))
+        self.assertIn('albums_sorted_by_albumartist', plan)
+
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -30,6 +30,7 @@ from test._common import unittest
 from test.helper import capture_stdout, has_program, TestHelper, control_stdin
 
 from beets import library
+from beets.dbcore.db import FixedValues
 from beets import ui
 from beets.ui import commands
 from beets import autotag
@@ -38,6 +39,7 @@ from beets.mediafile import MediaFile
 from beets import config
 from beets import plugins
 from beets.util.confit import ConfigError
+from beets.util import pipeline
 
 
 class ListTest(unittest.TestCase):
@@ -116,6 +118,63 @@ class ListTest(unittest.TestCase):
         self.assertNotIn(u'the album', stdout.getvalue())
 
 
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.lib = library.Library(':memory:')
+        for artist, length in [('a', 60.0), ('a', 120.0), ('b', 30.0)]:
+            item = _common.item()
+            item.artist = artist
+            item.length = length
+            item.bitrate = 8000
+            self.lib.add(item)
+
+    def test_stats(self):
+        with capture_stdout() as stdout:
+            commands.show_stats(self.lib, '', False)
+        out = stdout.getvalue()
+        self.assertIn(u'Tracks: 3', out)
+        self.assertIn(u'Total time: 3.5 minutes', out)
+        self.assertIn(u'Approximate total size: 205.1 KB', out)
+        self.assertIn(u'Artists: 2', out)
+
+    def test_stats_query(self):
+        with capture_stdout() as stdout:
+            commands.show_stats(self.lib, 'artist:b', False)
+        out = stdout.getvalue()
+        self.assertIn(u'Tracks: 1', out)
+        self.assertIn(u'Artists: 1', out)
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.lib = library.Library(':memory:')
+
+    def test_list_indices(self):
+        with capture_stdout() as stdout:
+            commands.index_fields(self.lib, [], False, False)
+        self.assertIn(u'items_by_path: path (built in)', stdout.getvalue())
+
+    def test_add_and_drop_index(self):
+        commands.index_fields(self.lib, [u'year', u'month'], True, False)
+        with capture_stdout() as stdout:
+            commands.index_fields(self.lib, [], True, False)
+        self.assertIn(u'albums_by_year_month: year, month\n',
+                      stdout.getvalue())
+
+        commands.index_fields(self.lib, [u'year', u'month'], True, True)
+        with capture_stdout() as stdout:
+            commands.index_fields(self.lib, [], True, False)
+        self.assertNotIn(u'albums_by_year_month', stdout.getvalue())
+
+    def test_drop_missing_index_fails(self):
+        with self.assertRaises(ui.UserError):
+            commands.index_fields(self.lib, [u'year'], False, True)
+
+    def test_drop_builtin_index_fails(self):
+        with self.assertRaises(ui.UserError):
+            commands.index_fields(self.lib, [u'path'], False, True)
+
+
 class RemoveTest(_common.TestCase):
     def setUp(self):
         super(RemoveTest, self).setUp()
@@ -184,6 +243,23 @@ class ModifyTest(unittest.TestCase, TestHelper):
         item = self.lib.items().get()
         self.assertIn(b'newTitle', item.path)
 
+    def test_interrupted_write_records_written_items(self):
+        self.add_album_fixture(track_count=2)
+        try_write = library.Item.try_write
+        written = []
+
+        def write_once(item, *args, **kwargs):
+            if written:
+                raise KeyboardInterrupt()
+            try_write(item, *args, **kwargs)
+            written.append(item.id)
+        with patch.object(library.Item, 'try_write', write_once):
+            with self.assertRaises(KeyboardInterrupt):
+                self.modify("--nomove", "title=newTitle")
+        item = self.lib.get_item(written[0])
+        self.assertEqual(item.title, 'newTitle')
+        self.assertEqual(item.mtime, item.current_mtime())
+
     def test_not_move(self):
         self.modify("--nomove", "title=newTitle")
         item = self.lib.items().get()
@@ -568,6 +644,38 @@ class ImportTest(_common.TestCase):
         self.assertRaises(ui.UserError, commands.import_files, None, [],
                           None)
 
+    def test_show_pipeline_stats(self):
+        stats = pipeline.StageStats('lookup_candidates')
+        stats.record(2, busy=1.5, input_wait=0.25, queued=3)
+        with capture_stdout() as out:
+            commands.show_pipeline_stats([stats])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split(),
+                         ['lookup_candidates', '2', '1.50', '0.25', '0.00',
+                          '3'])
+
+
+class OpenLibraryTest(_common.TestCase):
+    def test_model_cache_off_by_default(self):
+        lib = ui._open_library(config)
+        self.assertEqual(lib.cache_size, 0)
+        lib._connection().close()
+
+    def test_compact_models_option(self):
+        config['compact_models'] = True
+        lib = ui._open_library(config)
+        lib.add(library.Item(title=u'title'))
+        items = list(lib.items())
+        self.assertIsInstance(items[0]._values_fixed, FixedValues)
+        self.assertEqual(items[0].title, u'title')
+        lib._connection().close()
+
+    def test_compact_models_off_by_default(self):
+        lib = ui._open_library(config)
+        lib.add(library.Item(title=u'title'))
+        self.assertIsInstance(lib.items().get()._values_fixed, dict)
+        lib._connection().close()
+
 
 class InputTest(_common.TestCase):
     def setUp(self):
@@ -72,6 +72,24 @@ class WebPluginTest(_common.LibTestCase):
         self.assertEqual(len(response.json['results']), 1)
         self.assertEqual(response.json['results'][0]['title'], 'another title')
 
+    def test_get_items_with_limit(self):
+        response = self.client.get('/item/?limit=1&offset=1')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['items']), 1)
+
+    def test_get_items_after_id(self):
+        response = self.client.get('/item/query/?after=1')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i['id'] for i in response.json['items']], [2])
+
+    def test_get_items_after_id_with_sort(self):
+        response = self.client.get('/item/query/title+?after=1')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_all_albums(self):
         response = self.client.get('/album/')
         response.json = json.loads(response.data)
@@ -103,6 +121,62 @@ class WebPluginTest(_common.LibTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json['albums']), 2)
 
+    def test_get_stats(self):
+        response = self.client.get('/stats')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['items'], 2)
+        self.assertEqual(response.json['albums'], 2)
+        self.assertEqual(response.json['artists'], 1)
+
+    def test_stats_follow_changes(self):
+        self.client.get('/stats')
+        self.lib.add(Item(title='third title', artist='other', path=''))
+        response = self.client.get('/stats')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.json['items'], 3)
+        self.assertEqual(response.json['artists'], 2)
+
+    def test_get_changes(self):
+        response = self.client.get('/changes')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        changes = response.json['changes']
+        self.assertEqual(response.json['last'], changes[-1]['seq'])
+        self.assertEqual(changes[-1]['type'], 'album')
+        self.assertEqual(changes[-1]['op'], 'add')
+
+    def test_get_changes_since(self):
+        last = self.lib.last_change()
+        item = self.lib.get_item(1)
+        item.title = 'new title'
+        item.store()
+
+        response = self.client.get('/changes?since={0}'.format(last))
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.json['changes'], [{
+            'seq': last + 1,
+            'type': 'item',
+            'id': 1,
+            'op': 'store',
+            'keys': ['title'],
+        }])
+
+    def test_get_changes_reports_first_kept(self):
+        last = self.lib.last_change()
+        self.lib.prune_changes(last)
+
+        response = self.client.get('/changes?since=0')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.json['changes'], [])
+        self.assertEqual(response.json['first'], last + 1)
+        self.assertEqual(response.json['last'], last)
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)